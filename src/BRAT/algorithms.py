@@ -1,201 +1,87 @@
 import sys
 import numpy as np
-import scipy.linalg as spl
 import warnings
-from BRAT.trees import SubsampledDecisionTreeRegressor
+from BRAT.trees import SubsampledDecisionTreeRegressor, PackedEnsemble, LeafIndex, spawn_seed_sequences, tree_seed, effective_n_jobs
 from tqdm import tqdm
 
-from BRAT.variance_estimation import compute_k_vector, compute_k_vector_batch
+from BRAT.variance_estimation import compute_k_vector, compute_k_matrix, tree_kernel_matrix, InferenceState, RegularizedKernelSolver, KernelSchur, woodbury_sketch, RandomizedKernelSketch, recursive_nystrom, landmark_rows, row_blocks
 
-class BRATD:
+class KernelInferenceMixin:
     """
-    Boulevard Regularized Additive Regression Trees with Dropout (BRAT-D).
+    Kernel, sketching and inference methods shared by BRATD and BRATP.
 
-    This class implements an additive ensemble of decision trees where, at
-    each boosting iteration, a random subset of previous trees is “dropped”
-    (i.e. excluded) when computing the residuals.
+    They only rely on the fitted state common to both ensembles (models,
+    leaf_assignments, subsample, X_train, ...), plus the (lam, q) pair of
+    kernel_regularization for the regularized kernel.
     """
-    def __init__(self, n_estimators=10, 
-                 learning_rate=1.0, 
-                 max_depth=4, 
-                 min_samples_split=2, 
-                 subsample_rate=0.8, 
-                 dropout_rate=0.5, 
-                 disable_tqdm=False):
-        self.n_estimators = n_estimators
-        self.max_depth = max_depth
-        self.min_samples_split = min_samples_split
-        self.subsample_rate = subsample_rate
-        self.dropout_rate = dropout_rate
-        self.learning_rate = learning_rate
-        self.K =None
-        self.C = None
-        self.W = None
-        self.coef = None
-        self.nys_sub = None
-        self.sketched_inverse_K_sq = None
-        self.sigma_hat2 = None
+    def kernel_regularization(self):
         """
-        Initialize the BRAT-D ensemble.
-
-        Parameters
-        ----------
-        n_estimators
-            Total number of trees to fit.
-        learning_rate
-            Shrinkage factor applied to each new tree’s predictions.
-        max_depth
-            Maximum depth for each decision tree.
-        min_samples_split
-            Minimum number of samples required to split an internal node.
-        subsample_rate
-            Fraction of training samples to draw (without replacement) for each tree.
-        dropout_rate
-            Fraction of already-fitted trees to “drop” when forming residuals.
-            If 1.0, this reduces to a demeaned random forest (no boosting).
-        disable_tqdm
-            If True, do not show the tqdm progress bar during fitting.
+        Learning rate lam and keep rate q of the regularized kernel (1/lam) K + q I.
 
-        Raises
+        Return
         ------
-        Warning
-            If `dropout_rate == 1.0` but `learning_rate < 1.0`, which
-            is a demeaned random forests, we reset learning_rate to 1.0 and issue a Warning.
+        lam, q: float
         """
-        if self.dropout_rate == 1.0:
-            if self.learning_rate < 1.0:
-                self.learning_rate = 1.0
-                raise Warning("Can't set learning rate less than 1 when dropout rate is 1. That's a demeaned random forest.")
-        else:
-            self.learning_rate = learning_rate
-
-        self.models = []
-        self.disable_tqdm = disable_tqdm
-        self.yhat = None
+        return self.learning_rate, 1 - self.dropout_rate
 
-    def fit(self, X_train, y_train, X_test, y_test):
+    def get_packed_trees(self):
         """
-        Fit the BRAT-D model to training data, tracking test MSE at each step.
-
-        Parameters
-        ----------
-        X : array-like of shape (n_samples, n_features)
-            Training features.
-        y : array-like of shape (n_samples,)
-            Training targets.
-        X_test : array-like of shape (m_samples, n_features)
-            Held-out features for monitoring mse.
-        y_test : array-like of shape (m_samples,)
-            Held-out targets for monitoring mse.
+        Return the packed flat-array form of the fitted trees, compiling it again
+        if the list of trees has changed since it was built.
 
         Returns
         -------
-        mse_list : list of float
-            Test-set mean squared error after each tree is added.
+        packed_trees : PackedEnsemble
         """
-        n_samples = X_train.shape[0]
-        total_trees = self.n_estimators
-        self.X_train = X_train
-        self.y_train = y_train
-        self.X_test = X_test
-        self.y_test = y_test
-        self.models = []
-        self.subsample = np.zeros((len(y_train), self.n_estimators), dtype = bool)
-        self.leaf_assignments = np.zeros((n_samples, self.n_estimators), dtype=int)
-        mse_list = []
-        
-        pbar = tqdm(range(1, total_trees + 1), 
-                    desc="Building BRATD trees", 
-                    disable=self.disable_tqdm, 
-                    file=sys.stdout)
-        for b in pbar:
-            if len(self.models) > 0:
-                num_residual_models = int(np.round((1-self.dropout_rate) * len(self.models)))
-                residual_used_tree_indices = np.random.permutation(len(self.models))[:num_residual_models]
-                residual_models = [self.models[i] for i in residual_used_tree_indices]
-            else:
-                residual_models = []
-
-            if residual_models:
-                preds = np.zeros(n_samples, dtype=float)
-                for model in residual_models:
-                    preds += model.predict(X_train)
-                preds /= len(self.models)
-                preds *= self.learning_rate
-                residuals = y_train - preds
-            else:
-                residuals = y_train
-
-            tree = SubsampledDecisionTreeRegressor(subsample_rate=self.subsample_rate, max_depth=self.max_depth, min_samples_split=self.min_samples_split)
-            tree.fit(X_train, y=residuals)
-            self.models.append(tree)
-            self.subsample[:, b-1] = tree.subsample
-            self.leaf_assignments[:,b-1] = tree.leaf_assignments
-
-            y_pred = self.predict(X_test)
-            mse = np.mean((y_test - y_pred) ** 2).item()
-            mse_list.append(mse)
-
-            pbar.refresh()
-            sys.stdout.flush()
-        return mse_list
+        if self.packed_trees is None or self.packed_trees.n_trees != len(self.models):
+            self.packed_trees = PackedEnsemble(self.models)
+        return self.packed_trees
 
-    def predict(self, x):
+    def apply_all(self, X):
         """
-        Predict regression targets for new data.
+        Leaf index of every row of X in every fitted tree.
 
         Parameters
         ----------
-        X : array-like of shape (n_samples, n_features)
-            Input features to predict.
+        X : array-like of shape (m_samples, n_features)
 
         Returns
         -------
-        y_pred : np.ndarray of shape (n_samples,)
-            Predicted targets.
+        leaf_ids : np.ndarray of shape (m_samples, n_trees)
+            Column t matches self.models[t].get_tree().apply(X).
         """
-        preds = np.zeros(x.shape[0], dtype=float)
-        for tree in self.models:
-            preds += self.learning_rate * tree.predict(x)
-        if len(self.models) > 0:
-            preds /= len(self.models)
-        else:
-            preds = np.zeros(x.shape[0], dtype=float)
-        preds = preds * (1+ self.learning_rate * (1-self.dropout_rate)) / self.learning_rate
-        return preds
-    
-    def full_K(self):
+        return self.get_packed_trees().apply(X)
+
+    def full_K(self, sparse_output=False, max_memory=2**28, dtype=np.float64):
         """
         Compute the full expected tree-kernel matrix K for the training set.
 
         For each pair of training samples (i, j),  
         K[i, j] = average over trees t of the vote of sample j on sample i. 
-        Hence K is symmetric and positive semi-definite.
+        K is assembled from leaf co-membership blocks and never forms the
+        (n, n, n_trees) tensor.
+
+        Parameters
+        ----------
+        sparse_output : bool, default=False
+            If True, K is a scipy.sparse.csr_matrix, whose storage scales with the
+            number of co-leaf pairs; otherwise a dense array.
+        max_memory : int or None, default=2**28
+            Dense K only. Working-memory budget in bytes on top of K itself;
+            K is filled in row blocks that fit it. If None, one block is used.
+        dtype : numpy dtype, default=np.float64
+            Storage dtype of K; np.float32 halves the footprint of a dense K.
 
         Returns
         -------
-        K : np.ndarray of shape (n_samples, n_samples)
+        K : scipy.sparse.csr_matrix or np.ndarray of shape (n_samples, n_samples)
             The full influence/kernel matrix.
         """
-        n = self.X_train.shape[0]
-        B = len(self.models)
-        ID = np.zeros((n, B), dtype=np.int32)
-        for t, model in enumerate(self.models):
-            decision_tree = model.get_tree()
-            ID[:, t] = decision_tree.apply(self.X_train)
-
-        subsample_mask = self.subsample.astype(float)
-
-        eq = (ID[:, None, :] == ID[None, :, :]).astype(float)
-        eq = eq * subsample_mask[None, :, :]
-        row_sums = np.sum(eq, axis=1, keepdims=True)
-        row_sums[row_sums == 0] = 1.0
-        eq_norm = eq / row_sums
-        K = np.sum(eq_norm, axis=2) / B
+        K = tree_kernel_matrix(self, sparse_output=sparse_output, max_memory=max_memory, dtype=dtype)
         self.K = K
         return K
     
-    def unif_nystrom(self, Nystrom_subsample):
+    def unif_nystrom(self, Nystrom_subsample, random_state=None):
         """
         Uniform Nyström approximation of the full kernel matrix.
 
@@ -205,6 +91,8 @@ class BRATD:
         ----------
         Nystrom_subsample : float
             Fraction of training points to sample (0 < Nystrom_subsample ≤ 1).
+        random_state : int, np.random.SeedSequence, np.random.Generator or None
+            Seed of the landmark draw; None draws fresh entropy.
 
         Returns
         -------
@@ -219,7 +107,7 @@ class BRATD:
         n = X_train.shape[0]
 
         Nystrom_n = int(n * Nystrom_subsample)
-        rng = np.random.default_rng()
+        rng = np.random.default_rng(random_state)
 
         max_retries = 5  # Limit the number of retries
         for retry in range(max_retries):
@@ -228,7 +116,7 @@ class BRATD:
             self.nys_sub = sampled_indices
 
             # Compute C and W
-            C = compute_k_vector_batch(self, X_train, X_train[sampled_indices])  # shape: (Nystrom_n, n)
+            C = landmark_rows(self, sampled_indices)  # shape: (Nystrom_n, n)
             C = C.T  # shape: (n, Nystrom_n)
             W = C[sampled_indices, :]  # shape: (Nystrom_n, Nystrom_n)
 
@@ -236,7 +124,7 @@ class BRATD:
             self.W = W
             return C, W, sampled_indices
 
-    def rec_nystrom(self, X_train, Nystrom_subsample=None, reg=1e-6):
+    def rec_nystrom(self, X_train, Nystrom_subsample=None, reg=1e-6, random_state=None):
         """
         Compute the influence matrix K or Nyström approximation for X_train.
 
@@ -247,79 +135,14 @@ class BRATD:
               - If None, returns full K. 
               - If float (0 < value <= 1), use Nyström with n_components = n * Nystrom_subsample.
           reg: Regularization for W matrix inversion.
+          random_state: Seed of the landmark draws (int, SeedSequence or Generator);
+              None draws fresh entropy.
 
         Returns:
         -------
           - C (n x Nystrom_n), W (Nystrom_n x Nystrom_n), sampled_indices (Nyström).
         """
-        n = X_train.shape[0]
-        B = len(self.models)
-
-        Nystrom_n = int(n * Nystrom_subsample)
-        rng = np.random.default_rng()
-
-        # --- Recursive Nyström ---
-        n_oversample = np.log(Nystrom_n)
-        k = int(np.ceil(Nystrom_n / (4 * n_oversample)))
-        n_levels = int(np.ceil(np.log(n / Nystrom_n) / np.log(2)))
-        perm = rng.permutation(n)
-
-        size_list = [n]
-        for l in range(1, n_levels + 1):
-            size_list.append(int(np.ceil(size_list[l - 1] / 2)))
-
-        sample = np.arange(size_list[-1])
-        indices = perm[sample]
-        weights = np.ones(indices.shape[0])
-
-        # Precompute diagonal of kernel matrix
-        k_diag = np.array([compute_k_vector(self, X_train, X_train[i])[i] for i in range(n)])
-
-        for l in reversed(range(n_levels)):
-            current_indices = perm[:size_list[l]]
-
-            # Compute KS and SKS using compute_k_vector
-            KS = np.zeros((len(current_indices), len(indices)))
-            for i, idx in enumerate(indices):
-                KS[:, i] = compute_k_vector(self, X_train, X_train[idx])[current_indices]
-
-            SKS = KS[sample, :]
-
-            if k >= SKS.shape[0]:
-                lmbda = 10e-6
-            else:
-                weighted_SKS = SKS * weights[:, None] * weights[None, :]
-                eigs = spl.eigvalsh(weighted_SKS, subset_by_index=(SKS.shape[0]-k, SKS.shape[0]-1))
-                lmbda = (np.sum(np.diag(SKS) * (weights ** 2)) - np.sum(eigs)) / k
-
-            lmbda = max(lmbda, 1e-6 * SKS.shape[0])
-
-            R = np.linalg.solve(SKS + np.diag(lmbda * weights ** (-2)), KS.T).T
-
-            if l != 0:
-                leverage_score = np.minimum(1.0, n_oversample * (1 / lmbda) * np.maximum(0.0, (
-                        k_diag[current_indices] - np.sum(R * KS, axis=1))))
-                sample = np.where(rng.uniform(size=size_list[l]) < leverage_score)[0]
-                if sample.size == 0:
-                    leverage_score[:] = Nystrom_n / size_list[l]
-                    sample = rng.choice(size_list[l], size=Nystrom_n, replace=False)
-                weights = np.sqrt(1. / leverage_score[sample])
-            else:
-                leverage_score = np.minimum(1.0, (1 / lmbda) * np.maximum(0.0, (
-                        k_diag[current_indices] - np.sum(R * KS, axis=1))))
-                p = leverage_score / leverage_score.sum()
-                sample = rng.choice(n, size=Nystrom_n, replace=False, p=p)
-
-            indices = perm[sample]
-
-        # Final C and W for Recursive Nyström
-        C = np.zeros((n, Nystrom_n))
-        for i, idx in enumerate(indices):
-            C[:, i] = compute_k_vector(self, X_train, X_train[idx])
-
-        W = np.zeros((Nystrom_n, Nystrom_n))
-        for i, idx_i in enumerate(indices):
-            W[i, :] = C[idx_i, :]
+        C, W, indices = recursive_nystrom(self, Nystrom_subsample, rng=np.random.default_rng(random_state))
 
         self.C = C
         self.W = W
@@ -331,63 +154,20 @@ class BRATD:
         Compute the Nystrom-sketched kernel vector between a new point x
         and the training set, using the sampled subset self.nys_sub.
 
-        Steps:
-        1. Let s = number of Nyström samples (len(self.nys_sub)).
-        2. Let T = total number of trees in the fitted model.
-        3. Extract leaf assignments for the Nyström samples: 
-            leaf_ids_train is an (s by T) array of leaf indices.
-        4. For the test point x, get its leaf index in each tree:
-            leaf_ids_x is a length-T vector.
-        5. Build a boolean mask same_leaf_mask (s by T) that is True
-            when a Nyström sample and x fall in the same leaf of tree t.
-        6. Extract the original subsampling mask for those s samples,
-            selected_mask (s by T).
-        7. valid_mask = same_leaf_mask AND selected_mask; only count
-            in-bag samples in matching leaves.
-        8. For each tree t, count how many valid samples there are:
-            counts[t] = sum over the n rows of valid_mask[:, t].
-        9. To prevent division by zero, set any zero count to 1.
-        10. Divide each column of valid_mask by its count, giving
-            valid_contributions (n by T).
-        11. Zero out all contributions for trees where the count was zero.
-        12. Finally average across the T columns to get a length-n vector:
-            sketched_k[i] = (1/T) * sum_{t=1..T} valid_contributions[i, t].
+        For each tree t, x votes for the in-bag landmarks that share its leaf,
+        each weighted by one over the number of in-bag landmarks in that leaf
+        (trees where no in-bag landmark shares the leaf contribute nothing):
+            sketched_k[i] = (1/T) * sum_{t=1..T} 1{i in-bag, same leaf as x} / count_t.
+        The leaf ids of x come from the packed ensemble and the sum over trees
+        is a single sparse product (see compute_k_matrix).
 
         Returns:
         sketched_k: a numpy array of shape (n,), the Nyström-sketched
                     kernel evaluations between x and each sampled train point.
         """
-        n, T = self.X_train[self.nys_sub].shape[0], len(self.models)
-
-        # Cached leaf assignments: shape (n_samples, T)
-        leaf_ids_train = self.leaf_assignments[self.nys_sub]  # shape: (Nystrom_n, T)
-
-        # Get leaf ID for test point x for all trees at once
-        leaf_ids_x = np.array([tree.get_tree().apply(x.reshape(1, -1))[0] for tree in self.models])  # shape: (T,)
-
-        # Create same_leaf_mask: shape (Nystrom_n, T), True if train sample in same leaf as x
-        same_leaf_mask = (leaf_ids_train == leaf_ids_x[None, :])  # shape: (Nystrom_n, T)
-
-        # Subsample mask: shape (n, T)
-        selected_mask = self.subsample[self.nys_sub]  # shape: (Nystrom_n, T)
-
-        # Valid samples in same leaf AND selected in subsample
-        valid_mask = same_leaf_mask & selected_mask  # shape: (Nystrom_n, T)
-
-        # Count of valid samples per tree: shape: (T,)
-        counts = np.sum(valid_mask, axis=0)  # shape: (T,)
-
-        # Avoid division by zero, set counts to 1 where zero to avoid NaNs
-        counts_safe = np.where(counts == 0, 1, counts)  # shape: (T,)
-
-        # Normalize valid_mask by counts: shape: (n, T)
-        valid_contributions = valid_mask / counts_safe  # shape: (Nystrom_n, T)
-
-        # Zero out trees where count was 0 to avoid wrong sums
-        valid_contributions[:, counts == 0] = 0.0
-
-        # Average across trees
-        sketched_k = np.sum(valid_contributions, axis=1) / T  # shape: (Nystrom_n,)
+        # Leaf ids of x in every tree, compared only against the in-bag landmarks
+        leaf_ids_x = self.apply_all(x.reshape(1, -1))  # shape: (1, T)
+        sketched_k = compute_k_matrix(self, leaf_ids_x, ref_indices=self.nys_sub)[0]  # shape: (Nystrom_n,)
 
         return sketched_k
 
@@ -404,35 +184,65 @@ class BRATD:
         Avoid training small ensemble on large dataset. This will likely result in similar voting vectors and
         increase the chance for the landmark matrix W to be singular. 
         """
-        W = self.W
-        C = self.C
-        lam = self.learning_rate
-        q = 1 - self.dropout_rate
-        retry_count = 0
-
-        while retry_count < 10:
-            try:
-                W_inv = np.linalg.pinv(W)
-                break
-            except np.linalg.LinAlgError:
-                retry_count += 1
-                if retry_count == 10:
-                    raise RuntimeError("SVD did not converge after 10 attempts.")
-        CTC = C.T @ C
+        lam, q = self.kernel_regularization()
         try:
-            sketched_inverse_K = (W_inv @ C.T @ (lam * np.eye(C.shape[0])) 
-                                - lam**2 * (W_inv @ CTC @ np.linalg.inv((1/q) * W + lam * CTC)) @ C.T)
-            sketched_inverse_K_sq = sketched_inverse_K @ sketched_inverse_K.T
-            self.sketched_inverse_K_sq = sketched_inverse_K_sq
+            self.sketched_inverse_K_sq = woodbury_sketch(self.C, self.W, lam, q)
 
         except np.linalg.LinAlgError:
-            print("Singular matrix encountered during sketching. Falling back to full K.")
+            warnings.warn("SVD did not converge during sketching. Falling back to full K.", RuntimeWarning)
             K = self.full_K()
         
+    def randomized_sketch(self, rank, n_oversamples=10, n_iter=2, random_state=None):
+        """
+        Rank-r randomized SVD of the full tree kernel, an alternative to the Nyström
+        landmarks that only needs products of K with blocks of vectors.
+
+        The sketch is stored in self.rsvd_sketch and used by sketch_r and sketch_r_batch.
+        sketch_r prefers a Nyström sketch when both exist, so any Nyström sketch is
+        dropped here.
+
+        Parameters
+        ----------
+        rank : int
+            Rank of the sketch.
+        n_oversamples : int, default=10
+            Extra random directions used by the range finder.
+        n_iter : int, default=2
+            Power iterations; raise for kernels with slowly decaying spectra.
+        random_state : int, np.random.Generator or None
+
+        Returns
+        -------
+        rsvd_sketch : RandomizedKernelSketch
+        """
+        self.rsvd_sketch = RandomizedKernelSketch(self, rank, n_oversamples=n_oversamples,
+                                                  n_iter=n_iter, random_state=random_state)
+        self.sketched_inverse_K_sq = None
+        return self.rsvd_sketch
+
+    def get_K_solver(self):
+        """
+        Return the factorized regularized kernel (1/lr) K + q I used by the exact
+        sketch_r path, computing the full K and factorizing it on first use.
+
+        The factorization is cached on the model and reused until K, the learning
+        rate or the dropout rate changes; refitting the model discards it.
+
+        Return
+        ------
+        K_solver: RegularizedKernelSolver
+        """
+        if self.K is None:
+            self.full_K()
+        lam, q = self.kernel_regularization()
+        if self.K_solver is None or not self.K_solver.matches(self.K, lam, q):
+            self.K_solver = RegularizedKernelSolver(self.K, lam, q)
+        return self.K_solver
+
     def sketch_r(self, x, vector=False):
         """
         Compute the BRAT weight for a new point x,
-        either from the sketched inverse (if available) or exactly.
+        from the Nyström sketched inverse or the randomized sketch (if available), or exactly.
 
         Parameters
         ----------
@@ -446,7 +256,8 @@ class BRATD:
         Returns
         -------
         rn_norm : float
-            The clipped norm of the (approximate) influence vector, capped at 10.
+            The norm of the (approximate) influence vector; norms above 10 are
+            replaced by the ensemble's _clipped_rn_norm().
 
         If vector=True, returns a tuple (r_vec, rn_norm), where
         r_vec is the m-dim landmark-space vector (if sketched) or
@@ -456,19 +267,109 @@ class BRATD:
             sketched_k = self.sketch_k(x)
             rn_norm = np.sqrt(sketched_k.T @ self.sketched_inverse_K_sq @ sketched_k)
             if rn_norm > 10:
-                rn_norm = np.array([1.0])
+                rn_norm = self._clipped_rn_norm()
+            return rn_norm
+        elif self.rsvd_sketch is not None:
+            k = compute_k_vector(self, self.X_train, x)
+            lam, q = self.kernel_regularization()
+            if vector:
+                rn = self.rsvd_sketch.solve(k, lam, q)
+                rn_norm = np.linalg.norm(rn)
+            else:
+                rn_norm = self.rsvd_sketch.rn_norms(k, lam, q)
+            if rn_norm > 10:
+                rn_norm = self._clipped_rn_norm()
+            if vector:
+                return rn, rn_norm
             return rn_norm
         else:
             k = compute_k_vector(self, self.X_train, x)
-            rn = np.linalg.pinv((1/self.learning_rate) * self.K + (1-self.dropout_rate) * np.eye(self.K.shape[0])) @ k
+            rn = self.get_K_solver().solve(k)
             rn_norm = np.linalg.norm(rn)
             if rn_norm > 10:
-                rn_norm = np.array([1.0])
+                rn_norm = self._clipped_rn_norm()
             if vector:
                 return rn, rn_norm
             else:
                 return rn_norm
-    
+
+    def sketch_r_batch(self, X, max_memory=2**28):
+        """
+        Vectorized sketch_r: the clipped BRAT weight norms for every row of X.
+
+        Each block of rows shares one batched kernel evaluation (against the landmarks
+        if a sketch is available, otherwise against the full training set) and one
+        matrix product with the (sketched) inverse.
+
+        Parameters
+        ----------
+        X : array-like, shape (m_samples, n_features)
+            Points of interest.
+        max_memory : int or None, default=2**28
+            Budget in bytes for the kernel rows and weight vectors of one block of
+            rows (default 256 MiB), so the (m, n) cross-kernel is never formed at
+            once. If None, all rows are processed in one block.
+
+        Returns
+        -------
+        rn_norm : np.ndarray, shape (m_samples,)
+            Norm of the influence vector at each row; values above 10 are set to 1.0,
+            as in sketch_r.
+        """
+        X = np.asarray(X)
+        if self.sketched_inverse_K_sq is not None:
+            width = len(self.nys_sub)
+        else:
+            width = self.X_train.shape[0]
+            solver = self.get_K_solver() if self.rsvd_sketch is None else None
+        # CSR kernel row (value + column index), its dense copy and its weight vector
+        bytes_per_row = width * (8 + 4 + 8 + 8)
+        rn_norm = np.empty(X.shape[0])
+        for rows in row_blocks(X.shape[0], bytes_per_row, max_memory):
+            leaf_ids = self.apply_all(X[rows])
+            if self.sketched_inverse_K_sq is not None:
+                sketched_k = compute_k_matrix(self, leaf_ids, ref_indices=self.nys_sub)  # shape: (b, s)
+                rn_norm[rows] = np.sqrt(np.einsum("ij,ij->i", sketched_k @ self.sketched_inverse_K_sq, sketched_k))
+            elif self.rsvd_sketch is not None:
+                k = compute_k_matrix(self, leaf_ids)  # shape: (b, n)
+                rn_norm[rows] = self.rsvd_sketch.rn_norms(k.T, *self.kernel_regularization())
+            else:
+                k = compute_k_matrix(self, leaf_ids)  # shape: (b, n)
+                rn_norm[rows] = np.linalg.norm(solver.solve(k.T), axis=0)
+        rn_norm[rn_norm > 10] = 1.0
+        return rn_norm
+
+    def sketch_r_grid(self, X, learning_rates, dropout_rates):
+        """
+        Exact BRAT weight norms at every row of X for a grid of learning and dropout rates.
+
+        The full K is decomposed once (see KernelSchur) and cached on the model, so
+        each (learning_rate, dropout_rate) pair costs one triangular solve rather than
+        a new factorization. The fitted ensemble, and hence K, is held fixed; only the
+        regularization (1/lr) K + (1 - dropout) I changes.
+
+        Parameters
+        ----------
+        X : array-like, shape (m_samples, n_features)
+            Points of interest.
+        learning_rates : sequence of float
+        dropout_rates : sequence of float
+
+        Returns
+        -------
+        rn_norm : np.ndarray, shape (len(learning_rates), len(dropout_rates), m_samples)
+            Norm of the influence vector for each setting and row; values above 10
+            are set to 1.0, as in sketch_r.
+        """
+        if self.K is None:
+            self.full_K()
+        if self.K_schur is None or not self.K_schur.matches(self.K):
+            self.K_schur = KernelSchur(self.K)
+        k = compute_k_matrix(self, self.apply_all(X))  # shape: (m, n)
+        rn_norm = self.K_schur.rn_norms(k.T, learning_rates, dropout_rates)
+        rn_norm[rn_norm > 10] = 1.0
+        return rn_norm
+
     def est_sigma_hat2(self, in_bag):
         """
         Estimate the variance of the noise.
@@ -495,7 +396,33 @@ class BRATD:
         self.sigma_hat2 = sigma_hat2
         return sigma_hat2
 
-    def est_tau_hat2(self, in_bag, Nystrom_subsample, x):
+    def get_inference_state(self, in_bag=False, Nystrom_subsample=None, random_state=None):
+        """
+        Return the inference state of the current fit, building it on first use.
+
+        The state (noise variance, Nyström landmarks and sketched inverse, scale
+        factor) is cached on the model and reused while in_bag and Nystrom_subsample
+        match; refitting the model discards it.
+
+        Parameters
+        ----------
+        in_bag: Boolean. Deciding the estimation of sigma2_hat
+        Nystrom_subsample: Nystrom subsample rate, or None for the exact kernel.
+        random_state: Seed of the Nystrom landmark draw; None draws fresh entropy.
+
+        Return
+        ------
+        state: InferenceState
+        """
+        state = self.inference_state
+        if (state is None or not state.is_valid(self) or state.in_bag != in_bag
+                or state.Nystrom_subsample != Nystrom_subsample or state.random_state != random_state):
+            state = InferenceState(self, in_bag=in_bag, Nystrom_subsample=Nystrom_subsample,
+                                   random_state=random_state)
+            self.inference_state = state
+        return state
+
+    def est_tau_hat2(self, in_bag, Nystrom_subsample, x, state=None):
         """
         Estimate the built-in variance tau2.
 
@@ -504,6 +431,8 @@ class BRATD:
         in_bag: Boolean. Deciding the estimation of sigma2_hat
         Nystrom_subsample: Nystrom subsample rate used to estimate the BRAT weight vector.
         x: A point of interest of making inference.
+        state: Optional InferenceState of this fit. If None, the model's cached state
+               for (in_bag, Nystrom_subsample) is used.
 
         Return
         ------
@@ -511,53 +440,301 @@ class BRATD:
         rn_norm: Cache BRAT weight vector norm
         tau_hat2: Estimated built-in variance.
         """
-        sigma_hat2 = self.est_sigma_hat2(in_bag)
-        self.unif_nystrom(Nystrom_subsample)
-        self.sketch_K()
-        rn_norm = self.sketch_r(x)
-        s = (1+self.learning_rate * (1-self.dropout_rate)) / self.learning_rate
-        tau_hat2 = (s * rn_norm * sigma_hat2)
+        if state is None:
+            state = self.get_inference_state(in_bag, Nystrom_subsample)
+        elif not state.is_valid(self):
+            raise ValueError("The inference state was built before the model was refit.")
+        sigma_hat2 = state.sigma_hat2
+        rn_norm = state.rn_norm(self, x)
+        tau_hat2 = (state.scale * rn_norm * sigma_hat2)
         return sigma_hat2, rn_norm, tau_hat2
-    
-import sys
-import numpy as np
-import warnings
-from tqdm import tqdm
-
-from BRAT.trees import SubsampledDecisionTreeRegressor
-from BRAT.variance_estimation import compute_k_vector, compute_k_vector_batch
-
 
-class BRATP:
+class BRATD(KernelInferenceMixin):
     """
-    Boulevard Regularized Additive Regression Trees with Parallelized Training (BRAT-P).
+    Boulevard Regularized Additive Regression Trees with Dropout (BRAT-D).
 
     This class implements an additive ensemble of decision trees where, at
-    each boosting iteration, you drop one “group” of trees when forming
-    residuals (the “permutation” variant of BRAT).
+    each boosting iteration, a random subset of previous trees is “dropped”
+    (i.e. excluded) when computing the residuals.
     """
-
-    def __init__(
-        self,
-        n_estimators=10,
-        learning_rate=1.0,
-        max_depth=4,
-        min_samples_split=2,
-        subsample_rate=0.8,
-        n_trees_per_group=10,
-        disable_tqdm=False,
-        drop_first_row=False,
-    ):
+    def __init__(self, n_estimators=10, 
+                 learning_rate=1.0, 
+                 max_depth=4, 
+                 min_samples_split=2, 
+                 subsample_rate=0.8, 
+                 dropout_rate=0.5, 
+                 disable_tqdm=False,
+                 kernel_cache_bytes=2**28,
+                 random_state=None):
+        self.n_estimators = n_estimators
+        self.max_depth = max_depth
+        self.min_samples_split = min_samples_split
+        self.subsample_rate = subsample_rate
+        self.dropout_rate = dropout_rate
+        self.learning_rate = learning_rate
+        self.K =None
+        self.C = None
+        self.W = None
+        self.coef = None
+        self.nys_sub = None
+        self.sketched_inverse_K_sq = None
+        self.sigma_hat2 = None
+        self.inference_state = None
+        self.fit_count = 0
+        self.K_solver = None
+        self.K_schur = None
+        self.rsvd_sketch = None
+        self.kernel_cache_bytes = kernel_cache_bytes
+        self.kernel_cache = None
+        self.random_state = random_state
         """
-        Initialize the BRAT-P model.
+        Initialize the BRAT-D ensemble.
 
         Parameters
         ----------
-        n_estimators : int
+        n_estimators
             Total number of trees to fit.
-        learning_rate : float
-            Scale factor applied to each new trees' predictions.
-        max_depth : int
+        learning_rate
+            Shrinkage factor applied to each new tree’s predictions.
+        max_depth
+            Maximum depth for each decision tree.
+        min_samples_split
+            Minimum number of samples required to split an internal node.
+        subsample_rate
+            Fraction of training samples to draw (without replacement) for each tree.
+        dropout_rate
+            Fraction of already-fitted trees to “drop” when forming residuals.
+            If 1.0, this reduces to a demeaned random forest (no boosting).
+        disable_tqdm
+            If True, do not show the tqdm progress bar during fitting.
+        kernel_cache_bytes
+            Byte budget of the LRU cache of kernel rows shared by the Nyström samplers.
+            0 disables the cache.
+        random_state
+            Int, np.random.SeedSequence or np.random.Generator. If given, the dropout
+            permutations and every tree draw from their own spawned streams instead of
+            the global numpy random state, so fits are reproducible regardless of what
+            else runs. None keeps the global random state.
+
+        Raises
+        ------
+        Warning
+            If `dropout_rate == 1.0` but `learning_rate < 1.0`, which
+            is a demeaned random forests, we reset learning_rate to 1.0 and issue a Warning.
+        """
+        if self.dropout_rate == 1.0:
+            if self.learning_rate < 1.0:
+                self.learning_rate = 1.0
+                raise Warning("Can't set learning rate less than 1 when dropout rate is 1. That's a demeaned random forest.")
+        else:
+            self.learning_rate = learning_rate
+
+        self.models = []
+        self.packed_trees = None
+        self.leaf_index = None
+        self.landmark_index = None
+        self.disable_tqdm = disable_tqdm
+        self.yhat = None
+
+    def fit(self, X_train, y_train, X_test=None, y_test=None, eval_every=1):
+        """
+        Fit the BRAT-D model to training data, tracking test MSE at each step.
+
+        Parameters
+        ----------
+        X : array-like of shape (n_samples, n_features)
+            Training features.
+        y : array-like of shape (n_samples,)
+            Training targets.
+        X_test : array-like of shape (m_samples, n_features), optional
+            Held-out features for monitoring mse.
+        y_test : array-like of shape (m_samples,), optional
+            Held-out targets for monitoring mse.
+        eval_every : int or None, default=1
+            Record the test MSE every `eval_every` trees. If None or 0, or if no
+            held-out set is given, the held-out set is never scored during fitting.
+
+        Returns
+        -------
+        mse_list : list of float
+            Test-set mean squared error after every `eval_every`-th tree is added.
+        """
+        n_samples = X_train.shape[0]
+        total_trees = self.n_estimators
+        self.X_train = X_train
+        self.y_train = y_train
+        self.X_test = X_test
+        self.y_test = y_test
+        self.models = []
+        self.packed_trees = None
+        self.leaf_index = None
+        self.landmark_index = None
+        self.inference_state = None
+        self.fit_count += 1
+        self.K = None
+        self.C = None
+        self.W = None
+        self.nys_sub = None
+        self.sketched_inverse_K_sq = None
+        self.K_solver = None
+        self.K_schur = None
+        self.rsvd_sketch = None
+        self.kernel_cache = None
+        self.subsample = np.zeros((len(y_train), self.n_estimators), dtype = bool)
+        self.leaf_assignments = np.zeros((n_samples, self.n_estimators), dtype=int)
+        # training predictions of every fitted tree, shape (n_estimators, n_samples)
+        self.train_predictions = np.zeros((self.n_estimators, n_samples), dtype=float)
+        mse_list = []
+        evaluate = bool(eval_every) and X_test is not None and y_test is not None
+        if evaluate:
+            # running sum of the per-tree test predictions, one new tree per round
+            test_pred_sum = np.zeros(X_test.shape[0], dtype=float)
+        
+        if self.random_state is None:
+            permutation = np.random.permutation
+            seeds = [None] * total_trees
+        else:
+            permutation_seq, tree_seq = spawn_seed_sequences(self.random_state, 2)
+            permutation = np.random.default_rng(permutation_seq).permutation
+            seeds = [tree_seed(seq) for seq in tree_seq.spawn(total_trees)]
+
+        pbar = tqdm(range(1, total_trees + 1), 
+                    desc="Building BRATD trees", 
+                    disable=self.disable_tqdm, 
+                    file=sys.stdout)
+        for b in pbar:
+            if len(self.models) > 0:
+                num_residual_models = int(np.round((1-self.dropout_rate) * len(self.models)))
+                residual_used_tree_indices = permutation(len(self.models))[:num_residual_models]
+            else:
+                residual_used_tree_indices = []
+
+            if len(residual_used_tree_indices) > 0:
+                # reduce the cached predictions of the kept trees, in the order they were drawn
+                preds = self.train_predictions[residual_used_tree_indices].sum(axis=0)
+                preds /= len(self.models)
+                preds *= self.learning_rate
+                residuals = y_train - preds
+            else:
+                residuals = y_train
+
+            tree = SubsampledDecisionTreeRegressor(subsample_rate=self.subsample_rate, max_depth=self.max_depth, min_samples_split=self.min_samples_split,
+                                                   random_state=seeds[b-1])
+            tree.fit(X_train, y=residuals)
+            self.models.append(tree)
+            self.subsample[:, b-1] = tree.subsample
+            self.leaf_assignments[:,b-1] = tree.leaf_assignments
+            self.train_predictions[b-1] = tree.train_predictions
+
+            if evaluate:
+                test_pred_sum += tree.predict(X_test)
+                if b % eval_every == 0:
+                    y_pred = self.learning_rate * test_pred_sum / b
+                    y_pred = y_pred * (1 + self.learning_rate * (1-self.dropout_rate)) / self.learning_rate
+                    mse = np.mean((y_test - y_pred) ** 2).item()
+                    mse_list.append(mse)
+
+            pbar.refresh()
+            sys.stdout.flush()
+        self.packed_trees = PackedEnsemble(self.models)
+        self.leaf_index = LeafIndex(self.leaf_assignments, self.subsample, self.packed_trees.node_offsets)
+        return mse_list
+
+    def predict(self, x):
+        """
+        Predict regression targets for new data.
+
+        Parameters
+        ----------
+        X : array-like of shape (n_samples, n_features)
+            Input features to predict.
+
+        Returns
+        -------
+        y_pred : np.ndarray of shape (n_samples,)
+            Predicted targets.
+        """
+        if len(self.models) > 0:
+            preds = self.learning_rate * self.get_packed_trees().predict_all(x).sum(axis=1)
+            preds /= len(self.models)
+        else:
+            preds = np.zeros(x.shape[0], dtype=float)
+        preds = preds * (1+ self.learning_rate * (1-self.dropout_rate)) / self.learning_rate
+        return preds
+
+    def staged_predict(self, X):
+        """
+        Yield the prediction after each tree, i.e. what predict(X) returns for the
+        ensemble of the first b trees, for b = 1, ..., len(self.models).
+
+        The per-tree predictions are computed once and accumulated, as in
+        sklearn's GradientBoostingRegressor.staged_predict.
+
+        Parameters
+        ----------
+        X : array-like of shape (n_samples, n_features)
+
+        Yields
+        ------
+        y_pred : np.ndarray of shape (n_samples,)
+        """
+        scale = (1 + self.learning_rate * (1-self.dropout_rate)) / self.learning_rate
+        P = np.ascontiguousarray(self.get_packed_trees().predict_all(X).T)  # shape: (n_trees, n_samples)
+        y_sum = np.zeros(P.shape[1], dtype=float)
+        for b in range(1, P.shape[0] + 1):
+            y_sum += P[b - 1]
+            y_pred = self.learning_rate * y_sum / b
+            yield y_pred * scale
+    
+    def _clipped_rn_norm(self):
+        """
+        Value sketch_r returns in place of a BRAT weight norm above 10.
+        """
+        return np.array([1.0])
+
+import sys
+import numpy as np
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+from BRAT.trees import SubsampledDecisionTreeRegressor, PackedEnsemble, LeafIndex, spawn_seed_sequences, tree_seed, effective_n_jobs
+from BRAT.variance_estimation import compute_k_vector, compute_k_matrix, tree_kernel_matrix, InferenceState, RegularizedKernelSolver, KernelSchur, woodbury_sketch, RandomizedKernelSketch, recursive_nystrom, landmark_rows, row_blocks
+
+
+class BRATP(KernelInferenceMixin):
+    """
+    Boulevard Regularized Additive Regression Trees with Parallelized Training (BRAT-P).
+
+    This class implements an additive ensemble of decision trees where, at
+    each boosting iteration, you drop one “group” of trees when forming
+    residuals (the “permutation” variant of BRAT).
+    """
+
+    def __init__(
+        self,
+        n_estimators=10,
+        learning_rate=1.0,
+        max_depth=4,
+        min_samples_split=2,
+        subsample_rate=0.8,
+        n_trees_per_group=10,
+        disable_tqdm=False,
+        drop_first_row=False,
+        kernel_cache_bytes=2**28,
+        n_jobs=None,
+        random_state=None,
+    ):
+        """
+        Initialize the BRAT-P model.
+
+        Parameters
+        ----------
+        n_estimators : int
+            Total number of trees to fit.
+        learning_rate : float
+            Scale factor applied to each new trees' predictions.
+        max_depth : int
             Maximum depth for each DecisionTreeRegressor.
         min_samples_split : int
             Minimum samples to split a node.
@@ -569,6 +746,20 @@ class BRATP:
             If True, turns off the progress bar when training individual BRATP model.
         drop_first_row : bool
             If True, we build a demeaned random forest in the first row instead of a gradient boosting tree ensemble.
+        kernel_cache_bytes : int
+            Byte budget of the LRU cache of kernel rows shared by the Nyström samplers.
+            0 disables the cache.
+        n_jobs : int or None
+            Number of threads fitting the trees of one group concurrently; negative
+            values count back from the number of cores as in joblib (-1 for all
+            cores). The trees of a group only see the other groups, so they are
+            independent; the first group is serial unless drop_first_row is set.
+            With any integer, one seed per tree is drawn from the global numpy random
+            state before fitting, so results do not depend on n_jobs. None keeps
+            the original serial fit drawing directly from the global random state.
+        random_state : int, np.random.SeedSequence, np.random.Generator or None
+            If given, every tree draws from its own stream spawned from it instead of
+            the global numpy random state, so fits are reproducible for any n_jobs.
         """
         self.n_estimators = n_estimators
         self.learning_rate = learning_rate
@@ -578,14 +769,20 @@ class BRATP:
         self.n_trees_per_group = n_trees_per_group
         self.disable_tqdm = disable_tqdm
         self.drop_first_row = drop_first_row
+        self.n_jobs = n_jobs
+        self.random_state = random_state
 
         # number of full groups
         self.num_groups = (n_estimators + n_trees_per_group - 1) // n_trees_per_group
 
         # placeholders
         self.models = []              # flat list of trees
+        self.packed_trees = None      # flat-array form of self.models
+        self.leaf_index = None        # leaf -> in-bag training rows
+        self.landmark_index = None    # leaf -> in-bag landmark rows
         self.trees_table = None       # list-of-lists of trees
         self.tree_pred_table = None   # 3D array of in-bag train preds
+        self.completed_slot_sums = None  # per-slot sums of tree_pred_table over completed groups
         self.subsample = None         # in-bag mask, shape=(n_train, n_estimators)
 
         # for inference
@@ -594,11 +791,18 @@ class BRATP:
         self.W = None                 # nystrom landmark kernel
         self.nys_sub = None           # landmark indices
         self.sketched_inverse_K_sq = None
+        self.inference_state = None   # cached InferenceState of the current fit
+        self.fit_count = 0            # number of calls to fit
+        self.K_solver = None          # factorized (1/lr) K + q I of the exact path
+        self.K_schur = None           # Schur decomposition of K for hyperparameter grids
+        self.rsvd_sketch = None       # randomized low-rank sketch of K
+        self.kernel_cache_bytes = kernel_cache_bytes
+        self.kernel_cache = None      # LRU cache of kernel rows of training points
 
         # record test errors
         self.mse_values = []
 
-    def fit(self, X_train, y_train, X_test, y_test):
+    def fit(self, X_train, y_train, X_test=None, y_test=None, eval_every=1):
         """
         Fit the BRAT-P model, recording test MSE at each tree.
 
@@ -608,15 +812,19 @@ class BRATP:
             Training features.
         y_train : array-like, shape=(n_train,)
             Training targets.
-        X_test : array-like, shape=(n_test, n_features)
+        X_test : array-like, shape=(n_test, n_features), optional
             Held-out features for MSE monitoring.
-        y_test : array-like, shape=(n_test,)
+        y_test : array-like, shape=(n_test,), optional
             Held-out targets.
+        eval_every : int or None, default=1
+            Record the test MSE every `eval_every` trees. If None or 0, or if no
+            held-out set is given, the held-out set is never scored.
 
         Returns
         -------
         mse_values : list of float
-            Test MSE after each tree is added.
+            Test MSE after every `eval_every`-th tree is added, computed in one
+            staged_predict pass once the trees are fitted.
         """
         n_train = X_train.shape[0]
         B = self.n_estimators
@@ -624,8 +832,27 @@ class BRATP:
         ng = self.num_groups
 
         # initialize storage
+        self.X_train = X_train
+        self.y_train = y_train
+        self.X_test = X_test
+        self.y_test = y_test
         self.models = []
+        self.packed_trees = None
+        self.leaf_index = None
+        self.landmark_index = None
+        self.inference_state = None
+        self.fit_count += 1
+        self.K = None
+        self.C = None
+        self.W = None
+        self.nys_sub = None
+        self.sketched_inverse_K_sq = None
+        self.K_solver = None
+        self.K_schur = None
+        self.rsvd_sketch = None
+        self.kernel_cache = None
         self.subsample = np.zeros((n_train, B), dtype=bool)
+        self.leaf_assignments = np.zeros((n_train, B), dtype=int)
         self.trees_table = [
             [
                 SubsampledDecisionTreeRegressor(
@@ -638,62 +865,106 @@ class BRATP:
             for _ in range(ng)
         ]
         self.tree_pred_table = np.zeros((ng, tpq, n_train), dtype=float)
+        # per-slot sums of the train predictions over completed groups
+        self.completed_slot_sums = np.zeros((tpq, n_train), dtype=float)
         self.mse_values = []
 
-        pbar = tqdm(
-            range(1, B + 1),
-            desc="Building BRAT-P trees",
-            disable=self.disable_tqdm,
-            file=sys.stdout
-        )
+        if self.random_state is not None:
+            seeds = [tree_seed(seq) for seq in spawn_seed_sequences(self.random_state, B)]
+        elif self.n_jobs is None:
+            seeds = [None] * B
+        else:
+            seeds = np.random.randint(np.iinfo(np.int32).max, size=B)
+        n_workers = effective_n_jobs(self.n_jobs)
+        executor = ThreadPoolExecutor(max_workers=n_workers) if n_workers > 1 else None
 
-        for b in pbar:
-            group = (b - 1) // tpq
-            slot = (b - 1) % tpq
-
-            # form residuals by dropping this slot in all groups
-            R = self.tree_pred_table.copy()
-            R[:, slot, :] = 0.0
-            if group == 0 and self.drop_first_row:
-                R[0, :, :] = 0.0
-            elif group > 0:
-                R[group, :, :] = 0.0
-
-            # compute dropped prediction
-            mask = (R != 0).any(axis=2)
-            avg_partial = np.zeros((tpq, n_train), dtype=float)
-            for t in range(tpq):
-                valid_rows = mask[:, t]
-                if valid_rows.sum() > 0:
-                    avg_partial[t] = R[valid_rows, t, :].mean(axis=0)
-            dropped = avg_partial.sum(axis=0)
-            residual = y_train - dropped
-
-            # fit new tree
+        def fit_tree(residual, seed):
             tree = SubsampledDecisionTreeRegressor(
                 subsample_rate=self.subsample_rate,
                 max_depth=self.max_depth,
-                min_samples_split=self.min_samples_split
+                min_samples_split=self.min_samples_split,
+                random_state=seed
             )
             tree.fit(X_train, residual)
-            self.trees_table[group][slot] = tree
-            self.models.append(tree)
+            return tree
 
-            # store its train prediction
-            pred_train = tree.predict(X_train)
-            if b == 1:
-                self.tree_pred_table[group][slot] = self.learning_rate * pred_train
-            else:
-                self.tree_pred_table[group][slot] = pred_train
+        pbar = tqdm(
+            total=B,
+            desc="Building BRAT-P trees",
+            disable=self.disable_tqdm,
+            file=sys.stdout
+        )
 
-            # record test MSE
-            y_pred_test = self.predict(X_test, num_trees=b)
-            mse = np.mean((y_test - y_pred_test) ** 2)
-            self.mse_values.append(mse)
+        try:
+            for group in range(ng):
+                group_b = range(group * tpq + 1, min((group + 1) * tpq, B) + 1)
+                if executor is not None and (group > 0 or self.drop_first_row):
+                    # every tree of this group drops the whole group, so none of them
+                    # sees another; their residuals are fixed before any is fitted
+                    residuals = [y_train - self._dropped_prediction(group, (b - 1) % tpq) for b in group_b]
+                    trees = list(executor.map(fit_tree, residuals, [seeds[b - 1] for b in group_b]))
+                else:
+                    trees = None
+
+                for i, b in enumerate(group_b):
+                    slot = (b - 1) % tpq
+                    if trees is None:
+                        residual = y_train - self._dropped_prediction(group, slot)
+                        tree = fit_tree(residual, seeds[b - 1])
+                    else:
+                        tree = trees[i]
+                    self._add_tree(tree, b, group, slot)
+                    pbar.update(1)
+                self.completed_slot_sums += self.tree_pred_table[group]
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            pbar.close()
+
+        self.packed_trees = PackedEnsemble(self.models)
+        self.leaf_index = LeafIndex(self.leaf_assignments, self.subsample, self.packed_trees.node_offsets)
+
+        if eval_every and X_test is not None and y_test is not None:
+            for b, y_pred_test in enumerate(self.staged_predict(X_test), start=1):
+                if b % eval_every == 0:
+                    self.mse_values.append(np.mean((y_test - y_pred_test) ** 2))
+        return self.mse_values
 
-            pbar.refresh()
+    def _dropped_prediction(self, group, slot):
+        """
+        Sum over slots of the average prediction of the fitted groups, with this slot
+        dropped in every group and, except for the first group without drop_first_row,
+        this whole group dropped too.
 
-        return self.mse_values
+        Groups before `group` are complete, so their per-slot averages come from the
+        running sums over completed groups; the first group only sees its own
+        earlier slots.
+        """
+        if group == 0:
+            if self.drop_first_row:
+                return np.zeros(self.tree_pred_table.shape[2])
+            # slots before this one are the only fitted trees, one per slot
+            return self.tree_pred_table[0, :slot].sum(axis=0)
+
+        avg_partial = self.completed_slot_sums / group
+        avg_partial[slot] = 0.0
+        return avg_partial.sum(axis=0)
+
+    def _add_tree(self, tree, b, group, slot):
+        """
+        Record the b-th fitted tree (1-based) and its train predictions.
+        """
+        self.trees_table[group][slot] = tree
+        self.models.append(tree)
+        self.subsample[:, b-1] = tree.subsample
+        self.leaf_assignments[:, b-1] = tree.leaf_assignments
+
+        # store its train prediction, looked up when the tree was fitted
+        pred_train = tree.train_predictions
+        if b == 1:
+            self.tree_pred_table[group][slot] = self.learning_rate * pred_train
+        else:
+            self.tree_pred_table[group][slot] = pred_train
 
     def predict(self, x, num_trees=None):
         """
@@ -712,370 +983,53 @@ class BRATP:
         B = num_trees or self.n_estimators
         tpq = self.n_trees_per_group
         ng = (B + tpq - 1) // tpq
-        n_samples = x.shape[0]
-
-        P = np.zeros((ng, tpq, n_samples), dtype=float)
-        for g in range(ng):
-            for t in range(tpq):
-                idx = g * tpq + t
-                if idx < B:
-                    P[g, t] = self.trees_table[g][t].predict(x)
 
-        avg_over_groups = np.nanmean(P, axis=0)
-        return np.nansum(avg_over_groups, axis=0)
+        # models are stored group by group, so the first B columns are the first B trees.
+        # Empty slots of the last group count as zero predictions in the group average,
+        # hence averaging over groups and summing over slots is the total divided by ng.
+        P = self.get_packed_trees().predict_all(x)[:, :B]
+        return P.sum(axis=1) / ng
 
-    def full_K(self):
+    def staged_predict(self, X):
         """
-        Compute the full expected tree-kernel matrix K for the training set.
-
-        For each pair of training samples (i, j),  
-        K[i, j] = average over trees t of the vote of sample j on sample i. 
-        Hence K is symmetric and positive semi-definite.
+        Yield the prediction after each tree, i.e. predict(X, num_trees=b) for
+        b = 1, ..., len(self.models), from one pass over the trees.
 
-        Returns
-        -------
-        K : np.ndarray of shape (n_samples, n_samples)
-            The full influence/kernel matrix.
-        """
-        n = self.X_train.shape[0]
-        B = len(self.models)
-        ID = np.zeros((n, B), dtype=np.int32)
-        for t, model in enumerate(self.models):
-            decision_tree = model.get_tree()
-            ID[:, t] = decision_tree.apply(self.X_train)
-
-        subsample_mask = self.subsample.astype(float)
-
-        eq = (ID[:, None, :] == ID[None, :, :]).astype(float)
-        eq = eq * subsample_mask[None, :, :]
-        row_sums = np.sum(eq, axis=1, keepdims=True)
-        row_sums[row_sums == 0] = 1.0
-        eq_norm = eq / row_sums
-        K = np.sum(eq_norm, axis=2) / B
-        self.K = K
-        return K
-
-    def unif_nystrom(self, Nystrom_subsample):
-        """
-        Uniform Nyström approximation of the full kernel matrix.
-
-        Randomly samples a subset of training points to form low-rank factors C and W.
+        The per-tree predictions are computed once and accumulated; the running sum
+        is divided by the number of groups started so far.
 
         Parameters
         ----------
-        Nystrom_subsample : float
-            Fraction of training points to sample (0 < Nystrom_subsample ≤ 1).
-
-        Returns
-        -------
-        C : np.ndarray, shape (n_samples, m)
-            Cross-kernel between all training points and the m sampled landmark points.
-        W : np.ndarray, shape (m, m)
-            Kernel among the m sampled landmark points.
-        sampled_indices : np.ndarray, shape (m,)
-            Indices of the landmark points in the original training set.
-        """
-        X_train = self.X_train
-        n = X_train.shape[0]
-
-        Nystrom_n = int(n * Nystrom_subsample)
-        rng = np.random.default_rng()
-
-        max_retries = 5  # Limit the number of retries
-        for retry in range(max_retries):
-            # Sample indices without replacement
-            sampled_indices = rng.choice(n, size=Nystrom_n, replace=False)
-            self.nys_sub = sampled_indices
-
-            # Compute C and W
-            C = compute_k_vector_batch(self, X_train, X_train[sampled_indices])  # shape: (Nystrom_n, n)
-            C = C.T  # shape: (n, Nystrom_n)
-            W = C[sampled_indices, :]  # shape: (Nystrom_n, Nystrom_n)
-
-            self.C = C
-            self.W = W
-            return C, W, sampled_indices
-
-    def rec_nystrom(self, X_train, Nystrom_subsample=None, reg=1e-6):
-        """
-        Compute the influence matrix K or Nyström approximation for X_train.
-
-        Parameters
-        ----------
-          X_train: Training data (n_samples, n_features).
-          Nystrom_subsample: 
-              - If None, returns full K. 
-              - If float (0 < value <= 1), use Nyström with n_components = n * Nystrom_subsample.
-          reg: Regularization for W matrix inversion.
-
-        Returns:
-        -------
-          - C (n x Nystrom_n), W (Nystrom_n x Nystrom_n), sampled_indices (Nyström).
-        """
-        n = X_train.shape[0]
-        B = len(self.models)
-
-        Nystrom_n = int(n * Nystrom_subsample)
-        rng = np.random.default_rng()
-
-        # --- Recursive Nyström ---
-        n_oversample = np.log(Nystrom_n)
-        k = int(np.ceil(Nystrom_n / (4 * n_oversample)))
-        n_levels = int(np.ceil(np.log(n / Nystrom_n) / np.log(2)))
-        perm = rng.permutation(n)
-
-        size_list = [n]
-        for l in range(1, n_levels + 1):
-            size_list.append(int(np.ceil(size_list[l - 1] / 2)))
-
-        sample = np.arange(size_list[-1])
-        indices = perm[sample]
-        weights = np.ones(indices.shape[0])
-
-        # Precompute diagonal of kernel matrix
-        k_diag = np.array([compute_k_vector(self, X_train, X_train[i])[i] for i in range(n)])
-
-        for l in reversed(range(n_levels)):
-            current_indices = perm[:size_list[l]]
-
-            # Compute KS and SKS using compute_k_vector
-            KS = np.zeros((len(current_indices), len(indices)))
-            for i, idx in enumerate(indices):
-                KS[:, i] = compute_k_vector(self, X_train, X_train[idx])[current_indices]
-
-            SKS = KS[sample, :]
-
-            if k >= SKS.shape[0]:
-                lmbda = 10e-6
-            else:
-                weighted_SKS = SKS * weights[:, None] * weights[None, :]
-                eigs = spl.eigvalsh(weighted_SKS, subset_by_index=(SKS.shape[0]-k, SKS.shape[0]-1))
-                lmbda = (np.sum(np.diag(SKS) * (weights ** 2)) - np.sum(eigs)) / k
-
-            lmbda = max(lmbda, 1e-6 * SKS.shape[0])
-
-            R = np.linalg.solve(SKS + np.diag(lmbda * weights ** (-2)), KS.T).T
-
-            if l != 0:
-                leverage_score = np.minimum(1.0, n_oversample * (1 / lmbda) * np.maximum(0.0, (
-                        k_diag[current_indices] - np.sum(R * KS, axis=1))))
-                sample = np.where(rng.uniform(size=size_list[l]) < leverage_score)[0]
-                if sample.size == 0:
-                    leverage_score[:] = Nystrom_n / size_list[l]
-                    sample = rng.choice(size_list[l], size=Nystrom_n, replace=False)
-                weights = np.sqrt(1. / leverage_score[sample])
-            else:
-                leverage_score = np.minimum(1.0, (1 / lmbda) * np.maximum(0.0, (
-                        k_diag[current_indices] - np.sum(R * KS, axis=1))))
-                p = leverage_score / leverage_score.sum()
-                sample = rng.choice(n, size=Nystrom_n, replace=False, p=p)
-
-            indices = perm[sample]
-
-        # Final C and W for Recursive Nyström
-        C = np.zeros((n, Nystrom_n))
-        for i, idx in enumerate(indices):
-            C[:, i] = compute_k_vector(self, X_train, X_train[idx])
-
-        W = np.zeros((Nystrom_n, Nystrom_n))
-        for i, idx_i in enumerate(indices):
-            W[i, :] = C[idx_i, :]
-
-        self.C = C
-        self.W = W
-        self.nys_sub = indices
-        return C, W, indices
-
-    def sketch_k(self, x):
-        """
-        Compute the Nystrom-sketched kernel vector between a new point x
-        and the training set, using the sampled subset self.nys_sub.
-
-        Steps:
-        1. Let s = number of Nyström samples (len(self.nys_sub)).
-        2. Let T = total number of trees in the fitted model.
-        3. Extract leaf assignments for the Nyström samples: 
-            leaf_ids_train is an (s by T) array of leaf indices.
-        4. For the test point x, get its leaf index in each tree:
-            leaf_ids_x is a length-T vector.
-        5. Build a boolean mask same_leaf_mask (s by T) that is True
-            when a Nyström sample and x fall in the same leaf of tree t.
-        6. Extract the original subsampling mask for those s samples,
-            selected_mask (s by T).
-        7. valid_mask = same_leaf_mask AND selected_mask; only count
-            in-bag samples in matching leaves.
-        8. For each tree t, count how many valid samples there are:
-            counts[t] = sum over the n rows of valid_mask[:, t].
-        9. To prevent division by zero, set any zero count to 1.
-        10. Divide each column of valid_mask by its count, giving
-            valid_contributions (n by T).
-        11. Zero out all contributions for trees where the count was zero.
-        12. Finally average across the T columns to get a length-n vector:
-            sketched_k[i] = (1/T) * sum_{t=1..T} valid_contributions[i, t].
-
-        Returns:
-        sketched_k: a numpy array of shape (n,), the Nyström-sketched
-                    kernel evaluations between x and each sampled train point.
-        """
-        n, T = self.X_train[self.nys_sub].shape[0], len(self.models)
-
-        # Cached leaf assignments: shape (n_samples, T)
-        leaf_ids_train = self.leaf_assignments[self.nys_sub]  # shape: (Nystrom_n, T)
-
-        # Get leaf ID for test point x for all trees at once
-        leaf_ids_x = np.array([tree.get_tree().apply(x.reshape(1, -1))[0] for tree in self.models])  # shape: (T,)
-
-        # Create same_leaf_mask: shape (Nystrom_n, T), True if train sample in same leaf as x
-        same_leaf_mask = (leaf_ids_train == leaf_ids_x[None, :])  # shape: (Nystrom_n, T)
-
-        # Subsample mask: shape (n, T)
-        selected_mask = self.subsample[self.nys_sub]  # shape: (Nystrom_n, T)
-
-        # Valid samples in same leaf AND selected in subsample
-        valid_mask = same_leaf_mask & selected_mask  # shape: (Nystrom_n, T)
-
-        # Count of valid samples per tree: shape: (T,)
-        counts = np.sum(valid_mask, axis=0)  # shape: (T,)
-
-        # Avoid division by zero, set counts to 1 where zero to avoid NaNs
-        counts_safe = np.where(counts == 0, 1, counts)  # shape: (T,)
-
-        # Normalize valid_mask by counts: shape: (n, T)
-        valid_contributions = valid_mask / counts_safe  # shape: (Nystrom_n, T)
-
-        # Zero out trees where count was 0 to avoid wrong sums
-        valid_contributions[:, counts == 0] = 0.0
-
-        # Average across trees
-        sketched_k = np.sum(valid_contributions, axis=1) / T  # shape: (Nystrom_n,)
-
-        return sketched_k
-
-
-    def sketch_K(self):
-        """
-        Compute a sketched approximation to the inverse tree-kernel matrix K
-        (and store its square), using the Woodbury identity on the Nyström factors.
-
-        Requires that self.W (s*s) and self.C (n*s) are already set
-        via a prior call to unif_nystrom or rec_nystrom. Make sure you ran:
-        self.unif_nystrom, self.rec_nystrom or self.full_K before calling this function
-        The result is stored in self.sketched_inverse_K_sq (s*s).
+        X : array-like, shape=(n_samples, n_features)
 
-        Avoid training small ensemble on large dataset. This will likely result in similar voting vectors and
-        increase the chance for the landmark matrix W to be singular. 
+        Yields
+        ------
+        y_pred : np.ndarray, shape=(n_samples,)
         """
-        W = self.W
-        C = self.C
-        lam = self.learning_rate
-        q = 1 - self.dropout_rate
-        retry_count = 0
-
-        while retry_count < 10:
-            try:
-                W_inv = np.linalg.pinv(W)
-                break
-            except np.linalg.LinAlgError:
-                retry_count += 1
-                if retry_count == 10:
-                    raise RuntimeError("SVD did not converge after 10 attempts.")
-        CTC = C.T @ C
-        try:
-            sketched_inverse_K = (W_inv @ C.T @ (lam * np.eye(C.shape[0])) 
-                                - lam**2 * (W_inv @ CTC @ np.linalg.inv((1/q) * W + lam * CTC)) @ C.T)
-            sketched_inverse_K_sq = sketched_inverse_K @ sketched_inverse_K.T
-            self.sketched_inverse_K_sq = sketched_inverse_K_sq
-
-        except np.linalg.LinAlgError:
-            print("Singular matrix encountered during sketching. Falling back to full K.")
-            K = self.full_K()
+        tpq = self.n_trees_per_group
+        P = np.ascontiguousarray(self.get_packed_trees().predict_all(X).T)  # shape: (n_trees, n_samples)
+        y_sum = np.zeros(P.shape[1], dtype=float)
+        for b in range(1, P.shape[0] + 1):
+            y_sum += P[b - 1]
+            yield y_sum / ((b + tpq - 1) // tpq)
 
-    def sketch_r(self, x, vector=False):
+    def kernel_regularization(self):
         """
-        Compute the BRAT weight for a new point x,
-        either from the sketched inverse (if available) or exactly.
-
-        Parameters
-        ----------
-        x : array-like, shape (n_features,)
-            A single test point.
-
-        vector : bool, default=False
-            If True, also return the raw influence vector (sketched_k or rn)
-            along with its norm.
+        Learning rate lam and keep rate q of the regularized kernel of BRAT-P.
 
-        Returns
-        -------
-        rn_norm : float
-            The clipped norm of the (approximate) influence vector, capped at 10.
-
-        If vector=True, returns a tuple (r_vec, rn_norm), where
-        r_vec is the m-dim landmark-space vector (if sketched) or
-            the full n-vector rn (if using the exact K).
-        """
-        if self.sketched_inverse_K_sq is not None:      
-            sketched_k = self.sketch_k(x)
-            rn_norm = np.sqrt(sketched_k.T @ self.sketched_inverse_K_sq @ sketched_k)
-            if rn_norm > 10:
-                rn_norm = 1.0
-            return rn_norm
-        else:
-            k = compute_k_vector(self, self.X_train, x)
-            rn = np.linalg.pinv((1/self.learning_rate) * self.K + (1-self.dropout_rate) * np.eye(self.K.shape[0])) @ k
-            rn_norm = np.linalg.norm(rn)
-            if rn_norm > 10:
-                rn_norm = 1.0
-            if vector:
-                return rn, rn_norm
-            else:
-                return rn_norm
-    
-    def est_sigma_hat2(self, in_bag):
-        """
-        Estimate the variance of the noise.
-        Parameters
-        ----------
-        in_bag: Boolean. If True, will use the training set to estimate the variance
+        Each tree fits the residual of the other n_trees_per_group - 1 slots, so
+        the averaged slots converge to the BRAT-D fixed point with lam = 1 and
+        q = n_trees_per_group - 1; the learning rate only scales the first tree.
 
         Return
         ------
-        sigma_hat2: Estimated variance.
+        lam, q: float
         """
-        X_train = self.X_train
-        y_train = self.y_train
-        X_test = self.X_test
-        y_test = self.y_test
-        if in_bag:
-            n = X_train.shape[0]
-            mse = np.mean((y_train - self.predict(X_train)) ** 2)
-            sigma_hat2 = mse * (n/ (n - 1))
-        else:
-            n = X_test.shape[0]
-            mse = np.mean((y_test - self.predict(X_test)) ** 2)
-            sigma_hat2 = mse * (n/ (n - 1))
-        self.sigma_hat2 = sigma_hat2
-        return sigma_hat2
+        return 1.0, self.n_trees_per_group - 1
 
-    def est_tau_hat2(self, in_bag, Nystrom_subsample, x):
+    def _clipped_rn_norm(self):
         """
-        Estimate the built-in variance tau2.
-
-        Parameters
-        ----------
-        in_bag: Boolean. Deciding the estimation of sigma2_hat
-        Nystrom_subsample: Nystrom subsample rate used to estimate the BRAT weight vector.
-        x: A point of interest of making inference.
-
-        Return
-        ------
-        sigma_hat2: Cache estiamted noise variane
-        rn_norm: Cache BRAT weight vector norm
-        tau_hat2: Estimated built-in variance.
+        Value sketch_r returns in place of a BRAT weight norm above 10.
         """
-        sigma_hat2 = self.est_sigma_hat2(in_bag)
-        self.unif_nystrom(Nystrom_subsample)
-        self.sketch_K()
-        rn_norm = self.sketch_r(x)
-        s = (1+self.learning_rate * (1-self.dropout_rate)) / self.learning_rate
-        tau_hat2 = (s * rn_norm * sigma_hat2)
-        return sigma_hat2, rn_norm, tau_hat2
\ No newline at end of file
+        return 1.0
+
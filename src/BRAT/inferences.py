@@ -1,42 +1,41 @@
+import warnings
+
 import numpy as np
 import pandas as pd
 
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 from scipy.stats import norm
 
 from BRAT.algorithms import BRATD, BRATP
 from BRAT.variance_estimation import compute_k_vector, find_K_matrix, estimate_noise_variance, estimate_built_in_variance, calculate_rn
-from BRAT.utils import generate_data
+from BRAT.trees import effective_n_jobs, spawn_seed_sequences
+from BRAT.utils import generate_data, data_function
 from tqdm import tqdm
 
 def ground_truth(x, function_type='friedman1'):
     """
     Compute the ground truth function value for a given input x.
     
+    The function is the one generate_data draws its targets from (see data_function),
+    so the truth always matches the simulated y_test_true.
+
     Parameters:
-      x: A numpy array representing the input features.
+      x: A numpy array representing the input features, either one point (n_features,)
+         or a batch of points (m, n_features).
       function_type: The type of function to compute (default is 'friedman1').
       
     Returns:
-      f_x: The computed function value.
+      f_x: The computed function value, a scalar for one point or an (m,) array for a batch.
     """
+    x = np.asarray(x)
+    y = data_function(function_type)(np.atleast_2d(x))
     
-    if function_type == 'friedman1':
-        f = lambda x: 10 * np.sin(np.pi * x[0] * x[1]) + 20 * (x[2] - 0.5)**2 + 10 * x[3] + 5 * x[4]
-    elif function_type == 'friedman2':
-        f = lambda x: np.sqrt(x[0]**2 + (x[1]*x[2] - 1/(x[1]*x[3] + 1e-6))**2)
-    elif function_type == 'radial':
-        f = lambda x: np.exp(-np.sum((x - 0.5)**2, dim=1))
-    elif function_type == 'smooth_linear':
-        f = lambda x: 3 * x[0] + 2 * x[1] - x[2] + 0.5 * np.sin(2 * np.pi * x[3]) + 0.3 * x[4]**2
-    else:
-        raise ValueError("Unknown function type. Choose 'friedman1', 'friedman2', or 'radial'.")
-    
-    y = f(x)
-    
-    return y
+    return y[0] if x.ndim == 1 else y
     
 
-def simulated_hypothesis_test(BRAT_model, in_bag, x, f0, Nystrom_subsample=None):
+def simulated_hypothesis_test(BRAT_model, in_bag, x, f0, Nystrom_subsample=None, state=None):
     """
     Perform a hypothesis test to check if the predicted value at x is significantly different from f0.
     Parameters:
@@ -45,6 +44,7 @@ def simulated_hypothesis_test(BRAT_model, in_bag, x, f0, Nystrom_subsample=None)
       x: A test point as a numpy array (shape: (n_features,)).
       f0: The null hypothesis value to test against.
       Nystrom_subsample_rate: The subsample rate used to construct the kernel matrix.
+      state: Optional InferenceState of the model (see BRAT_model.get_inference_state).
     Returns:
       T: The test statistic.
       p_value: The p-value for the hypothesis test.
@@ -55,7 +55,7 @@ def simulated_hypothesis_test(BRAT_model, in_bag, x, f0, Nystrom_subsample=None)
     """
     y_pred = BRAT_model.predict(np.expand_dims(x, axis=0))
 
-    sigma_hat2, rn_norm, tau_hat2 = BRAT_model.est_tau_hat2(in_bag, Nystrom_subsample, x)
+    sigma_hat2, rn_norm, tau_hat2 = BRAT_model.est_tau_hat2(in_bag, Nystrom_subsample, x, state=state)
     tau_hat = np.sqrt(tau_hat2)
     sigma_hat = np.sqrt(sigma_hat2)
     
@@ -65,7 +65,7 @@ def simulated_hypothesis_test(BRAT_model, in_bag, x, f0, Nystrom_subsample=None)
     
     return T, p_value, y_pred, rn_norm, sigma_hat, tau_hat
 
-def PI(BRAT_model, in_bag, x, Nystrom_subsample=None, alpha=0.05):
+def PI(BRAT_model, in_bag, x, Nystrom_subsample=None, alpha=0.05, state=None):
     """
     Compute a 100(1-alpha)% prediction interval for the true function value f(x)
     using the BRAT model's built-in uncertainty quantification.
@@ -84,6 +84,8 @@ def PI(BRAT_model, in_bag, x, Nystrom_subsample=None, alpha=0.05):
       x: A test point as a numpy array (shape: (n_features,)).
       Nystrom_subsample: The subsample rate for constructing kernel matrix
       alpha: Significance level (default 0.05).
+      state: Optional InferenceState of the model, reused across calls. If None, the
+             model's cached state for (in_bag, Nystrom_subsample) is used.
 
     Returns:
       pi: A tuple (lower, upper) representing the prediction interval for f(x).
@@ -94,7 +96,7 @@ def PI(BRAT_model, in_bag, x, Nystrom_subsample=None, alpha=0.05):
     """
     y_pred = BRAT_model.predict(np.expand_dims(x, axis=0))[0]
     
-    sigma_hat2, rn_norm, tau_hat2 = BRAT_model.est_tau_hat2(in_bag, Nystrom_subsample, x)
+    sigma_hat2, rn_norm, tau_hat2 = BRAT_model.est_tau_hat2(in_bag, Nystrom_subsample, x, state=state)
     
     pi_se = np.sqrt(sigma_hat2 + tau_hat2)
     
@@ -105,7 +107,7 @@ def PI(BRAT_model, in_bag, x, Nystrom_subsample=None, alpha=0.05):
     
     return (lower, upper), y_pred, rn_norm, sigma_hat2, tau_hat2
 
-def CI(BRAT_model, in_bag, x, Nystrom_subsample = None, alpha=0.05):
+def CI(BRAT_model, in_bag, x, Nystrom_subsample = None, alpha=0.05, state=None):
     """
     Compute a 100(1-alpha)% confidence interval for the true function value f(x)
     using the BRAT model's built-in uncertainty quantification.
@@ -125,6 +127,8 @@ def CI(BRAT_model, in_bag, x, Nystrom_subsample = None, alpha=0.05):
       x: A test point as a numpy array (shape: (n_features,)).
       Nystrom_subsample: The subsample rate used to construct the kernel matrix.
       alpha: Significance level (default 0.05).
+      state: Optional InferenceState of the model, reused across calls. If None, the
+             model's cached state for (in_bag, Nystrom_subsample) is used.
       
     Returns:
       ci: A tuple (lower, upper) representing the confidence interval for f(x).
@@ -136,7 +140,7 @@ def CI(BRAT_model, in_bag, x, Nystrom_subsample = None, alpha=0.05):
 
     y_pred = BRAT_model.predict(x.reshape(1,-1))
     
-    sigma_hat2, rn_norm, tau_hat2 = BRAT_model.est_tau_hat2(in_bag, Nystrom_subsample, x)
+    sigma_hat2, rn_norm, tau_hat2 = BRAT_model.est_tau_hat2(in_bag, Nystrom_subsample, x, state=state)
 
     tau_hat = np.sqrt(tau_hat2)
     z = norm.ppf(1 - alpha/2)
@@ -146,7 +150,7 @@ def CI(BRAT_model, in_bag, x, Nystrom_subsample = None, alpha=0.05):
     
     return (lower, upper), y_pred, rn_norm, sigma_hat2, tau_hat2
 
-def RI(BRAT_model, x, in_bag=False, Nystrom_subsample = None, alpha=0.05):
+def RI(BRAT_model, x, in_bag=False, Nystrom_subsample = None, alpha=0.05, state=None):
     """
     Compute a 100(1-alpha)% reproduction (prediction) interval for the true function value f(x)
     using the BRAT model's built-in uncertainty quantification, extended with a replication variance term.
@@ -164,6 +168,8 @@ def RI(BRAT_model, x, in_bag=False, Nystrom_subsample = None, alpha=0.05):
       in_bag: Boolean indicating whether to use in-bag samples for noise variance estimation.
       Nystrom_subsample: The subsample rate used to construct the kernel matrix.
       alpha: Significance level (default 0.05).
+      state: Optional InferenceState of the model, reused across calls. If None, the
+             model's cached state for (in_bag, Nystrom_subsample) is used.
       
     Returns:
       reproduction_interval: A tuple (lower, upper) representing the reproduction interval for f(x).
@@ -175,7 +181,7 @@ def RI(BRAT_model, x, in_bag=False, Nystrom_subsample = None, alpha=0.05):
     
     y_pred = BRAT_model.predict(np.expand_dims(x, axis=0))[0]
 
-    sigma_hat2, rn_norm, tau_hat2 = BRAT_model.est_tau_hat2(in_bag, Nystrom_subsample, x)
+    sigma_hat2, rn_norm, tau_hat2 = BRAT_model.est_tau_hat2(in_bag, Nystrom_subsample, x, state=state)
 
     ri_se = np.sqrt(2*tau_hat2)
     
@@ -186,7 +192,7 @@ def RI(BRAT_model, x, in_bag=False, Nystrom_subsample = None, alpha=0.05):
     
     return (lower, upper), y_pred, rn_norm, sigma_hat2, tau_hat2
 
-def all_intervals(BRAT_model, x, in_bag=False, Nystrom_subsample = None, alpha=0.05):
+def all_intervals(BRAT_model, x, in_bag=False, Nystrom_subsample = None, alpha=0.05, state=None):
     """
     To avoid computation redundancy, this function returns the prediction intervals, confidence interval and reproduction interval of a BRAT model at a
     point of interest at the same time.
@@ -214,6 +220,8 @@ def all_intervals(BRAT_model, x, in_bag=False, Nystrom_subsample = None, alpha=0
       in_bag: Boolean indicating whether to use in-bag samples for noise variance estimation.
       Nystrom_subsample: The subsample rate used to construct the kernel matrix.
       alpha: Significance level (default 0.05).
+      state: Optional InferenceState of the model, reused across calls. If None, the
+             model's cached state for (in_bag, Nystrom_subsample) is used.
     
     Returns:
       pi: A tuple (lower, upper) representing the prediction interval for f(x).
@@ -226,10 +234,9 @@ def all_intervals(BRAT_model, x, in_bag=False, Nystrom_subsample = None, alpha=0
     """
     y_pred = BRAT_model.predict(np.expand_dims(x, axis=0))[0]
 
-    sigma_hat2, rn_norm, tau_hat2 = BRAT_model.est_tau_hat2(in_bag, Nystrom_subsample, x)
+    sigma_hat2, rn_norm, tau_hat2 = BRAT_model.est_tau_hat2(in_bag, Nystrom_subsample, x, state=state)
 
-    lam = BRAT_model.learning_rate
-    q = 1 - BRAT_model.dropout_rate
+    lam, q = BRAT_model.kernel_regularization()
     pi_se = np.sqrt((1+lam*q)**2/lam**2 * sigma_hat2 + tau_hat2)
     ci_se = np.sqrt(tau_hat2)
     ri_se = np.sqrt(2 * tau_hat2)
@@ -245,18 +252,183 @@ def all_intervals(BRAT_model, x, in_bag=False, Nystrom_subsample = None, alpha=0
     ri_lower = y_pred - z * ri_se
     ri_upper = y_pred + z * ri_se
 
-    return (pi_lower, pi_upper), (ci_lower, ci_upper), (ri_lower, ri_upper), y_pred, rn_norm, sigma2_hat, tau2_hat
+    return (pi_lower, pi_upper), (ci_lower, ci_upper), (ri_lower, ri_upper), y_pred, rn_norm, sigma_hat2, tau_hat2
+
+def _batch_estimates(BRAT_model, X, in_bag, Nystrom_subsample, state):
+    """
+    Predictions and variance estimates for a batch of points, with one prediction pass
+    and one kernel pass over the batch.
+    """
+    X = np.asarray(X)
+    if X.ndim != 2:
+        raise ValueError("X must be a 2-D array of shape (n_points, n_features).")
+    y_pred = BRAT_model.predict(X)
+    sigma_hat2, rn_norm, tau_hat2 = BRAT_model.est_tau_hat2(in_bag, Nystrom_subsample, X, state=state)
+    return y_pred, rn_norm, sigma_hat2, tau_hat2
+
+def _interval_frame(y_pred, rn_norm, sigma_hat2, tau_hat2, **bounds):
+    df = pd.DataFrame({"y_pred": y_pred, **bounds})
+    df["rn_norm"] = rn_norm
+    df["sigma2_hat"] = sigma_hat2
+    df["tau2_hat"] = tau_hat2
+    return df
+
+def PI_batch(BRAT_model, in_bag, X, Nystrom_subsample=None, alpha=0.05, state=None):
+    """
+    Prediction intervals (see PI) at every row of X.
+
+    Parameters:
+      BRAT_model: A trained BRAT model.
+      in_bag: Boolean indicating whether to use in-bag samples for noise variance estimation.
+      X: Test points (shape: (n_points, n_features)).
+      Nystrom_subsample: The subsample rate for constructing kernel matrix
+      alpha: Significance level (default 0.05).
+      state: Optional InferenceState of the model.
+
+    Returns:
+      df: DataFrame with one row per point and columns
+          'y_pred', 'pi_lower', 'pi_upper', 'rn_norm', 'sigma2_hat', 'tau2_hat'.
+    """
+    y_pred, rn_norm, sigma_hat2, tau_hat2 = _batch_estimates(BRAT_model, X, in_bag, Nystrom_subsample, state)
+    pi_se = np.sqrt(sigma_hat2 + tau_hat2)
+    z = norm.ppf(1 - alpha/2)
+    return _interval_frame(y_pred, rn_norm, sigma_hat2, tau_hat2,
+                           pi_lower=y_pred - z * pi_se, pi_upper=y_pred + z * pi_se)
+
+def CI_batch(BRAT_model, in_bag, X, Nystrom_subsample=None, alpha=0.05, state=None):
+    """
+    Confidence intervals (see CI) at every row of X.
+
+    Parameters:
+      BRAT_model: A trained BRAT model.
+      in_bag: Boolean indicating whether to use in-bag samples for noise variance estimation.
+      X: Test points (shape: (n_points, n_features)).
+      Nystrom_subsample: The subsample rate for constructing kernel matrix
+      alpha: Significance level (default 0.05).
+      state: Optional InferenceState of the model.
+
+    Returns:
+      df: DataFrame with one row per point and columns
+          'y_pred', 'ci_lower', 'ci_upper', 'rn_norm', 'sigma2_hat', 'tau2_hat'.
+    """
+    y_pred, rn_norm, sigma_hat2, tau_hat2 = _batch_estimates(BRAT_model, X, in_bag, Nystrom_subsample, state)
+    ci_se = np.sqrt(tau_hat2)
+    z = norm.ppf(1 - alpha/2)
+    return _interval_frame(y_pred, rn_norm, sigma_hat2, tau_hat2,
+                           ci_lower=y_pred - z * ci_se, ci_upper=y_pred + z * ci_se)
+
+def RI_batch(BRAT_model, X, in_bag=False, Nystrom_subsample=None, alpha=0.05, state=None):
+    """
+    Reproduction intervals (see RI) at every row of X.
+
+    Parameters:
+      BRAT_model: A trained BRAT model.
+      X: Test points (shape: (n_points, n_features)).
+      in_bag: Boolean indicating whether to use in-bag samples for noise variance estimation.
+      Nystrom_subsample: The subsample rate used to construct the kernel matrix.
+      alpha: Significance level (default 0.05).
+      state: Optional InferenceState of the model.
+
+    Returns:
+      df: DataFrame with one row per point and columns
+          'y_pred', 'ri_lower', 'ri_upper', 'rn_norm', 'sigma2_hat', 'tau2_hat'.
+    """
+    y_pred, rn_norm, sigma_hat2, tau_hat2 = _batch_estimates(BRAT_model, X, in_bag, Nystrom_subsample, state)
+    ri_se = np.sqrt(2 * tau_hat2)
+    z = norm.ppf(1 - alpha/2)
+    return _interval_frame(y_pred, rn_norm, sigma_hat2, tau_hat2,
+                           ri_lower=y_pred - z * ri_se, ri_upper=y_pred + z * ri_se)
+
+def all_intervals_batch(BRAT_model, X, in_bag=False, Nystrom_subsample=None, alpha=0.05, state=None):
+    """
+    Prediction, confidence and reproduction intervals (see all_intervals) at every row of X.
+
+    Parameters:
+      BRAT_model: A trained BRAT model.
+      X: Test points (shape: (n_points, n_features)).
+      in_bag: Boolean indicating whether to use in-bag samples for noise variance estimation.
+      Nystrom_subsample: The subsample rate used to construct the kernel matrix.
+      alpha: Significance level (default 0.05).
+      state: Optional InferenceState of the model.
+
+    Returns:
+      df: DataFrame with one row per point and columns 'y_pred', 'pi_lower', 'pi_upper',
+          'ci_lower', 'ci_upper', 'ri_lower', 'ri_upper', 'rn_norm', 'sigma2_hat', 'tau2_hat'.
+    """
+    y_pred, rn_norm, sigma_hat2, tau_hat2 = _batch_estimates(BRAT_model, X, in_bag, Nystrom_subsample, state)
+
+    lam, q = BRAT_model.kernel_regularization()
+    pi_se = np.sqrt((1+lam*q)**2/lam**2 * sigma_hat2 + tau_hat2)
+    ci_se = np.sqrt(tau_hat2)
+    ri_se = np.sqrt(2 * tau_hat2)
+
+    z = norm.ppf(1 - alpha/2)
+
+    return _interval_frame(y_pred, rn_norm, sigma_hat2, tau_hat2,
+                           pi_lower=y_pred - z * pi_se, pi_upper=y_pred + z * pi_se,
+                           ci_lower=y_pred - z * ci_se, ci_upper=y_pred + z * ci_se,
+                           ri_lower=y_pred - z * ri_se, ri_upper=y_pred + z * ri_se)
+
+def interval_widths_grid(BRAT_model, X, learning_rates, dropout_rates, in_bag=False, alpha=0.05):
+    """
+    Exact PI, CI and RI widths (see all_intervals) at every row of X for a grid of
+    learning and dropout rates, with the fitted ensemble held fixed.
+
+    One decomposition of the full kernel serves the whole grid (see BRAT_model.sketch_r_grid);
+    sigma2_hat is estimated once from the fitted model.
+
+    Parameters:
+      BRAT_model: A trained BRAT model.
+      X: Test points (shape: (n_points, n_features)).
+      learning_rates: Sequence of learning rates.
+      dropout_rates: Sequence of dropout rates.
+      in_bag: Boolean indicating whether to use in-bag samples for noise variance estimation.
+      alpha: Significance level (default 0.05).
+
+    Returns:
+      df: DataFrame with one row per (learning_rate, dropout_rate, point) and columns
+          'learning_rate', 'dropout_rate', 'point_idx', 'rn_norm', 'tau2_hat',
+          'pi_width', 'ci_width', 'ri_width'.
+    """
+    X = np.asarray(X)
+    sigma_hat2 = BRAT_model.est_sigma_hat2(in_bag)
+    rn_norm = BRAT_model.sketch_r_grid(X, learning_rates, dropout_rates)
+
+    lam, dropout = np.meshgrid(np.asarray(learning_rates, dtype=float),
+                               np.asarray(dropout_rates, dtype=float), indexing="ij")
+    q = 1 - dropout
+    s = ((1 + lam * q) / lam)[..., None]
+    tau_hat2 = s * rn_norm * sigma_hat2
+    pi_se = np.sqrt(s**2 * sigma_hat2 + tau_hat2)
+    ci_se = np.sqrt(tau_hat2)
+    ri_se = np.sqrt(2 * tau_hat2)
 
-def CI_coverage_rate(BRAT_model, in_bag, test_points, Nystrom_subsample, disable_tqdm, alpha = 0.05, ):
+    z = norm.ppf(1 - alpha/2)
+    m = X.shape[0]
+
+    return pd.DataFrame({
+        "learning_rate": np.repeat(lam.ravel(), m),
+        "dropout_rate": np.repeat(dropout.ravel(), m),
+        "point_idx": np.tile(np.arange(m), lam.size),
+        "rn_norm": rn_norm.ravel(),
+        "tau2_hat": tau_hat2.ravel(),
+        "pi_width": 2 * z * pi_se.ravel(),
+        "ci_width": 2 * z * ci_se.ravel(),
+        "ri_width": 2 * z * ri_se.ravel(),
+    })
+
+def CI_coverage_rate(BRAT_model, in_bag, test_points, Nystrom_subsample=None, disable_tqdm=None, alpha = 0.05,
+                     function_type='friedman1'):
     """
     For a set of test points, compute and return whether each of them is covered by the CI given by a same BRAT model.
     Parameters:
       BRAT_model: A trained BRAT model.
       in_bag: Boolean indicating whether to use in-bag samples for noise variance estimation.
-      test_points: The set of test points that are interested in.
+      test_points: The set of test points that are interested in (shape: (n_points, n_features)).
       Nystrom_subsample: The subsample rate used to construct the kernel matrix.
-      disable_tqdm: Boolean to disable the tqdm progress bar for individual trees(default True).
+      disable_tqdm: Deprecated and ignored; the points are evaluated in one batch without a progress bar.
       alpha: Significance level for the reproduction interval (default 0.05).
+      function_type: Ground truth function of the simulation (see ground_truth).
     Returns:
         avg_coverage_rate: Float, average CI coverage over all replications.
         df: DataFrame with one row per BRAT replication:
@@ -267,45 +439,96 @@ def CI_coverage_rate(BRAT_model, in_bag, test_points, Nystrom_subsample, disable
             - 'y_pred': model prediction at x
     """
 
-    records = []
-    _, _, _ = BRAT_model.unif_nystrom(Nystrom_subsample)
-    BRAT_model.sketch_K()
-    sigma_hat2 = BRAT_model.est_sigma_hat2(in_bag)
+    if disable_tqdm is not None:
+        warnings.warn("CI_coverage_rate no longer shows a progress bar; disable_tqdm is ignored "
+                      "and will be removed.", DeprecationWarning, stacklevel=2)
+    X = np.asarray(test_points)
+    state = BRAT_model.get_inference_state(in_bag, Nystrom_subsample)
+    sigma_hat2 = state.sigma_hat2
     sigma_hat = np.sqrt(sigma_hat2)
-    lam = BRAT_model.learning_rate
-    q = 1 - BRAT_model.dropout_rate
-    s = (1 + lam * q) / lam
-    for i, x in tqdm(test_points, desc="Evaluating coverage on test points", disable=disable_tqdm):
-        y_pred = BRAT_model.predict(x.reshape(1, -1))[0]
-        truth = ground_truth(x)
-        rn_norm = BRAT_model.sketch_r(x)
-        tau_hat = s * rn_norm * sigma_hat
-        tau_hat2 = tau_hat**2
-        ci = (y_pred - norm.ppf(1 - alpha / 2) * tau_hat, y_pred + norm.ppf(1 - alpha / 2) * tau_hat)
-        
-        covered = int(ci[0] <= truth <= ci[1])
-
-        records.append({
-            'test_point_idx': i,
-            'y_pred': y_pred,
-            "truth": truth,
-            "ci_lower": ci[0],
-            "ci_upper": ci[1],
-            "width": ci[1] - ci[0],
-            "sigma2_hat": sigma_hat2,
-            "tau2_hat": tau_hat2,
-            "covered": covered
-        })
+    s = state.scale
+
+    y_pred = BRAT_model.predict(X)
+    truth = ground_truth(X, function_type)
+    rn_norm = state.rn_norm(BRAT_model, X)
+    tau_hat = s * rn_norm * sigma_hat
+    z = norm.ppf(1 - alpha / 2)
+    ci_lower = y_pred - z * tau_hat
+    ci_upper = y_pred + z * tau_hat
+
+    records = {
+        'test_point_idx': np.arange(len(X)),
+        'y_pred': y_pred,
+        "truth": truth,
+        "ci_lower": ci_lower,
+        "ci_upper": ci_upper,
+        "width": ci_upper - ci_lower,
+        "sigma2_hat": sigma_hat2,
+        "tau2_hat": tau_hat**2,
+        "covered": ((ci_lower <= truth) & (truth <= ci_upper)).astype(int)
+    }
 
     df = pd.DataFrame(records)
     avg_coverage_rate = df["covered"].mean()
 
     return avg_coverage_rate, df
 
+def _coverage_replication(i, seed, model_params, n_train, n_test, noise_std, in_bag,
+                          test_point, Nystrom_subsample, alpha, return_model):
+    """
+    One replication of PI_RI_coverage_rate: generate data with seed, fit a BRATD model and
+    compute its intervals at test_point. Module-level so that process pools can run it.
+
+    All draws (data, trees, dropout, landmarks) come from generators seeded with seed, never
+    from the global random state, so replications can share a process or run on threads.
+    The data, the model and the landmarks each get their own child of seed, so the streams
+    are independent of one another.
+    """
+    data_seed, model_seed, landmark_seed = spawn_seed_sequences(int(seed), 3)
+    X_train, y_train, X_test, y_test, _ = generate_data(
+        function_type='friedman1', n_train=n_train, n_test=n_test,
+        noise_std=noise_std, rng=data_seed
+    )
+
+    BRAT_model = BRATD(disable_tqdm=True, random_state=model_seed, **model_params)
+    BRAT_model.fit(X_train, y_train, X_test, y_test)
+
+    state = BRAT_model.get_inference_state(in_bag, Nystrom_subsample, random_state=landmark_seed)
+    pi, _, ri, y_pred, _, sigma2_hat, tau2_hat = all_intervals(
+        BRAT_model, test_point, in_bag=in_bag, Nystrom_subsample=Nystrom_subsample,
+        alpha=alpha, state=state
+    )
+
+    row = {
+        "BRAT_idx": i,
+        "y_pred": y_pred,
+        "pi_lower": pi[0],
+        "pi_upper": pi[1],
+        "ri_lower": ri[0],
+        "ri_upper": ri[1],
+        "sigma2_hat": sigma2_hat,
+        "tau2_hat": tau2_hat,
+    }
+    return row, (BRAT_model if return_model else None)
+
+def _cross_coverage(y_pred, lower, upper):
+    """
+    For each model i, the proportion of the other models' predictions inside [lower[i], upper[i]].
+    Counts come from a single sort of y_pred and two searchsorted passes over the bounds.
+    """
+    n = len(y_pred)
+    sorted_pred = np.sort(y_pred)
+    counts = np.searchsorted(sorted_pred, upper, side="right") - np.searchsorted(sorted_pred, lower, side="left")
+    # drop each model's own prediction, and treat NaN bounds as covering nothing
+    counts = counts - ((lower <= y_pred) & (y_pred <= upper))
+    counts = np.where(np.isnan(lower) | np.isnan(upper), 0, np.maximum(counts, 0))
+    return counts / (n - 1)
+
 def PI_RI_coverage_rate(n_BRAT, total_trees, max_depth, learning_rate, 
                         subsample_rate, dropout_rate, min_sample_split, n_train, 
                         n_test, base_seed, noise_std, in_bag,
-                        test_point, Nystrom_subsample=None, disable_tqdm=True, alpha=0.05):
+                        test_point, Nystrom_subsample=None, disable_tqdm=True, alpha=0.05,
+                        n_jobs=None, executor=None, return_models=False):
     """
     Compute the coverage rates and bounds for Prediction Intervals (PI) and Reproduction Intervals (RI)
     at a fixed test point using multiple independently trained BRAT models.
@@ -333,13 +556,20 @@ def PI_RI_coverage_rate(n_BRAT, total_trees, max_depth, learning_rate,
         - noise_std (float): Standard deviation of the noise in the synthetic data.
         - in_bag (bool): Whether to use in-bag samples for estimating noise variance.
         - test_point (np.ndarray): The fixed input x at which PI and RI are computed.
+        - Nystrom_subsample (float or None): Nyström subsample rate for the intervals; None uses the exact kernel.
         - disable_tqdm (bool): If True, disables tqdm progress bars.
         - alpha (float): Significance level for interval construction (default 0.05).
+        - n_jobs (int or None): Number of worker processes for the replications; negative values count
+          back from the number of cores as in joblib (-1 for all cores). None or 1 runs them in this process.
+        - executor (concurrent.futures.Executor or None): Executor to run the replications on instead
+          of a new process pool; takes precedence over n_jobs.
+        - return_models (bool): If True, also return the trained models (shipped back from the workers).
+          Each replication reseeds from its own seed, so the results do not depend on n_jobs or executor.
 
     Returns:
         - avg_pi_coverage (float): Mean prediction interval coverage rate over all models.
         - avg_ri_coverage (float): Mean reproduction interval coverage rate over all models.
-        - BRAT_list (List): List of all trained BRAT models.
+        - BRAT_list (List or None): List of all trained BRAT models if return_models, else None.
         - df_pi (pd.DataFrame): DataFrame containing:
             - 'idx': Model index
             - 'y_pred': Predicted value at the test point
@@ -359,57 +589,37 @@ def PI_RI_coverage_rate(n_BRAT, total_trees, max_depth, learning_rate,
     rng = np.random.RandomState(base_seed)
     seeds = rng.randint(low=0, high=2**32 - 1, size=n_BRAT)
 
-    BRAT_list = []
-    shared_rows = []
-    
-    for i in tqdm(range(n_BRAT), desc="Training BRAT models", disable=disable_tqdm):
-        X_train, y_train, X_test, y_test = generate_data(
-            function_type='friedman1', n_train=n_train, n_test=n_test,
-            noise_std=noise_std, seed=seeds[i]
-        )
-
-        BRAT_model = BRATD(n_estimators=total_trees, learning_rate=learning_rate, max_depth=max_depth, 
+    model_params = dict(n_estimators=total_trees, learning_rate=learning_rate, max_depth=max_depth,
                         min_samples_split=min_sample_split, subsample_rate=subsample_rate,
-                        dropout_rate=dropout_rate, disable_tqdm=True)
-        BRAT_model.fit(X_train, y_train, X_test, y_test)
-        BRAT_list.append(BRAT_model)
-        
-        pi, _, ri, y_pred, _, sigma2_hat, tau2_hat = all_intervals(
-            BRAT_model, X_train, y_train, X_test, y_test,
-            test_point, in_bag=in_bag, alpha=alpha
-        )
-
-        shared_rows.append({
-            "BRAT_idx": i,
-            "y_pred": y_pred,
-            "pi_lower": pi[0],
-            "pi_upper": pi[1],
-            "ri_lower": ri[0],
-            "ri_upper": ri[1],
-            "sigma2_hat": sigma2_hat,
-            "tau2_hat": tau2_hat,
-        })
+                        dropout_rate=dropout_rate)
+    replicate = partial(_coverage_replication, model_params=model_params, n_train=n_train, n_test=n_test,
+                        noise_std=noise_std, in_bag=in_bag, test_point=test_point,
+                        Nystrom_subsample=Nystrom_subsample, alpha=alpha, return_model=return_models)
+
+    own_executor = None
+    n_workers = effective_n_jobs(n_jobs)
+    if executor is None and n_workers > 1:
+        own_executor = ProcessPoolExecutor(max_workers=n_workers)
+        executor = own_executor
+    try:
+        if executor is None:
+            results = map(replicate, range(n_BRAT), seeds)
+        else:
+            results = executor.map(replicate, range(n_BRAT), seeds)
+        results = list(tqdm(results, total=n_BRAT, desc="Training BRAT models", disable=disable_tqdm))
+    finally:
+        if own_executor is not None:
+            own_executor.shutdown()
+
+    shared_rows = [row for row, _ in results]
+    BRAT_list = [model for _, model in results] if return_models else None
 
     df = pd.DataFrame(shared_rows)
 
     # Evaluate PI & RI coverage separately
-    pi_coverage = []
-    ri_coverage = []
-
-    for i in tqdm(range(n_BRAT), desc="Evaluating coverage rates", disable=disable_tqdm):
-        pi_count = 0
-        ri_count = 0
-        for j in range(n_BRAT):
-            if i == j:
-                continue
-            pred_j = df.loc[j, "y_pred"]
-            if df.loc[i, "pi_lower"] <= pred_j <= df.loc[i, "pi_upper"]:
-                pi_count += 1
-            if df.loc[i, "ri_lower"] <= pred_j <= df.loc[i, "ri_upper"]:
-                ri_count += 1
-        denom = n_BRAT - 1
-        pi_coverage.append(pi_count / denom)
-        ri_coverage.append(ri_count / denom)
+    y_pred = df["y_pred"].to_numpy(dtype=float)
+    pi_coverage = _cross_coverage(y_pred, df["pi_lower"].to_numpy(dtype=float), df["pi_upper"].to_numpy(dtype=float))
+    ri_coverage = _cross_coverage(y_pred, df["ri_lower"].to_numpy(dtype=float), df["ri_upper"].to_numpy(dtype=float))
 
     # Construct separate DataFrames
     df_pi = df[["BRAT_idx", "y_pred", "pi_lower", "pi_upper", "sigma2_hat", "tau2_hat"]].copy()
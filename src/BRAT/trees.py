@@ -1,18 +1,84 @@
+import os
+
 import numpy as np
+from scipy import sparse
 from sklearn.tree import DecisionTreeRegressor
+from sklearn.utils import check_random_state
+
+def spawn_seed_sequences(random_state, n):
+    """
+    n independent child seed sequences of random_state, one per consumer (tree,
+    sampler, replication), so that parallel consumers reproduce a serial run.
+
+    Parameters
+    ----------
+    random_state : int, np.random.SeedSequence or np.random.Generator
+        An int or a SeedSequence gives the same children on every call; a Generator
+        gives new children each time, as drawing from it would.
+    n : int
+
+    Returns
+    -------
+    children : list of np.random.SeedSequence
+    """
+    if isinstance(random_state, np.random.Generator):
+        random_state = random_state.bit_generator.seed_seq
+        return random_state.spawn(n)
+    if not isinstance(random_state, np.random.SeedSequence):
+        random_state = np.random.SeedSequence(random_state)
+    else:
+        random_state = np.random.SeedSequence(random_state.entropy, spawn_key=random_state.spawn_key)
+    return random_state.spawn(n)
+
+
+def effective_n_jobs(n_jobs):
+    """
+    Number of workers for an n_jobs argument, with the joblib convention: None means
+    one, and a negative value counts back from the number of cores, so -1 uses all
+    of them and -2 all but one (never fewer than one).
+
+    Raises
+    ------
+    ValueError
+        If n_jobs is 0.
+    """
+    if n_jobs is None:
+        return 1
+    if n_jobs == 0:
+        raise ValueError("n_jobs == 0 has no meaning; use None or 1 to run serially.")
+    if n_jobs < 0:
+        return max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+    return n_jobs
+
+
+def tree_seed(seed_sequence):
+    """
+    Integer seed for SubsampledDecisionTreeRegressor drawn from a seed sequence.
+    """
+    return int(seed_sequence.generate_state(1)[0])
+
 
 class SubsampledDecisionTreeRegressor:
-    def __init__(self, subsample_rate=0.8, max_depth=None, min_samples_split=2):
+    def __init__(self, subsample_rate=0.8, max_depth=None, min_samples_split=2, random_state=None):
         self.subsample_rate = subsample_rate
         self.max_depth = max_depth
         self.min_samples_split = min_samples_split
+        # None draws from the global numpy random state; an int or RandomState makes
+        # the subsample and the tree's tie-breaking independent of it
+        self.random_state = random_state
         self.tree = DecisionTreeRegressor(max_depth=self.max_depth, min_samples_split=self.min_samples_split)
         self.subsample = None
         self.leaf_assignments = None
+        self.train_predictions = None
 
     def fit(self, X, y):
         n_samples = int(np.round(len(y) * self.subsample_rate))
-        self.indices = np.random.choice(len(y), n_samples, replace=False)
+        if self.random_state is None:
+            self.indices = np.random.choice(len(y), n_samples, replace=False)
+        else:
+            rng = check_random_state(self.random_state)
+            self.indices = rng.choice(len(y), n_samples, replace=False)
+            self.tree.set_params(random_state=rng.randint(np.iinfo(np.int32).max))
         self.subsample = np.zeros(len(y), dtype=bool)
         self.subsample[self.indices] = True
         X_subsample = X[self.indices]
@@ -20,9 +86,152 @@ class SubsampledDecisionTreeRegressor:
 
         self.tree.fit(X_subsample, y_subsample)
         self.leaf_assignments = self.tree.apply(X)
+        # leaf values looked up once at fit time, so that ensembles can reuse
+        # the training predictions without calling predict on X again
+        self.train_predictions = self.tree.tree_.value[self.leaf_assignments, 0, 0]
 
     def predict(self, X):
         return self.tree.predict(X)
     
     def get_tree(self):
-        return self.tree
\ No newline at end of file
+        return self.tree
+
+class PackedEnsemble:
+    """
+    Flat-array representation of a list of fitted SubsampledDecisionTreeRegressor.
+
+    The node arrays of all trees (split feature, threshold, children and leaf
+    value) are concatenated into contiguous buffers, and a batch of rows is
+    routed through every tree at once, one tree level per vectorized step.
+    Leaf nodes point to themselves, so rows that reach a leaf early stay there.
+    """
+    def __init__(self, trees, max_block_size=2**20):
+        """
+        Parameters
+        ----------
+        trees : list of SubsampledDecisionTreeRegressor
+            Fitted trees, in ensemble order.
+        max_block_size : int
+            Upper bound on the number of (row, tree) pairs traversed per block,
+            which bounds the working memory of apply and predict_all.
+        """
+        self.n_trees = len(trees)
+        self.max_block_size = max_block_size
+
+        node_counts = np.array([t.get_tree().tree_.node_count for t in trees], dtype=np.intp)
+        # node_offsets[t] is the global index of the root of tree t
+        self.node_offsets = np.concatenate(([0], np.cumsum(node_counts))).astype(np.intp)
+        self.max_depth = max((t.get_tree().tree_.max_depth for t in trees), default=0)
+
+        empty_idx, empty_val = np.zeros(0, dtype=np.intp), np.zeros(0)
+        feature, left, right = [empty_idx], [empty_idx], [empty_idx]
+        threshold, value = [empty_val], [empty_val]
+        for t, tree in enumerate(trees):
+            tree_ = tree.get_tree().tree_
+            offset = self.node_offsets[t]
+            is_leaf = tree_.children_left == -1
+            own = np.arange(tree_.node_count, dtype=np.intp) + offset
+            feature.append(np.where(is_leaf, 0, tree_.feature))
+            threshold.append(tree_.threshold)
+            left.append(np.where(is_leaf, own, tree_.children_left + offset))
+            right.append(np.where(is_leaf, own, tree_.children_right + offset))
+            value.append(tree_.value[:, 0, 0])
+
+        self.feature = np.concatenate(feature).astype(np.intp)
+        self.threshold = np.concatenate(threshold)
+        self.children_left = np.concatenate(left).astype(np.intp)
+        self.children_right = np.concatenate(right).astype(np.intp)
+        self.value = np.concatenate(value)
+
+    def _traverse(self, X):
+        """
+        Route every row of X through every tree.
+
+        Returns
+        -------
+        nodes : np.ndarray of shape (n_rows, n_trees)
+            Global index (into the packed buffers) of the leaf reached by each row in each tree.
+        """
+        # sklearn compares float32 features against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        m = X.shape[0]
+        nodes = np.empty((m, self.n_trees), dtype=np.intp)
+        block = max(1, self.max_block_size // max(self.n_trees, 1))
+        roots = self.node_offsets[:-1]
+        for start in range(0, m, block):
+            X_block = X[start:start + block]
+            rows = np.arange(X_block.shape[0])[:, None]
+            node = np.broadcast_to(roots, (X_block.shape[0], self.n_trees)).copy()
+            for _ in range(self.max_depth):
+                go_left = X_block[rows, self.feature[node]] <= self.threshold[node]
+                node = np.where(go_left, self.children_left[node], self.children_right[node])
+            nodes[start:start + block] = node
+        return nodes
+
+    def apply(self, X):
+        """
+        Leaf index of each row in each tree, matching DecisionTreeRegressor.apply.
+
+        Returns
+        -------
+        leaf_ids : np.ndarray of shape (n_rows, n_trees)
+        """
+        return self._traverse(X) - self.node_offsets[:-1]
+
+    def predict_all(self, X):
+        """
+        Prediction of each tree for each row.
+
+        Returns
+        -------
+        tree_preds : np.ndarray of shape (n_rows, n_trees)
+        """
+        return self.value[self._traverse(X)]
+
+
+class LeafIndex:
+    """
+    Inverted index from the leaves of an ensemble to the in-bag training rows they hold.
+
+    Leaves are numbered globally as node_offsets[t] + leaf id, following PackedEnsemble.
+    For a global leaf g, rows[ptr[g]:ptr[g + 1]] are the in-bag rows of tree t that
+    fall in it and counts[g] is their number. The same data is exposed as a CSR
+    matrix of shape (total_nodes, n_rows), so a kernel row is a scatter over the
+    co-leaf rows of the query's T leaves only.
+    """
+    def __init__(self, leaf_assignments, subsample, node_offsets, ref_indices=None):
+        """
+        Parameters
+        ----------
+        leaf_assignments : np.ndarray of shape (n_samples, T)
+            Leaf id of every training row in every tree.
+        subsample : np.ndarray of shape (n_samples, T)
+            In-bag mask of every training row in every tree.
+        node_offsets : np.ndarray of shape (T + 1,)
+            Offsets of each tree in the packed node numbering.
+        ref_indices : np.ndarray, optional
+            Restrict the index to these training rows (e.g. Nyström landmarks).
+            Rows are then numbered by their position in ref_indices.
+        """
+        T = len(node_offsets) - 1
+        leaf_assignments = leaf_assignments[:, :T]
+        subsample = subsample[:, :T]
+        if ref_indices is not None:
+            leaf_assignments = leaf_assignments[ref_indices]
+            subsample = subsample[ref_indices]
+        self.ref_indices = ref_indices
+        self.node_offsets = node_offsets
+        self.n_rows = leaf_assignments.shape[0]
+
+        rows, trees = np.nonzero(subsample)
+        leaves = leaf_assignments[rows, trees] + node_offsets[trees]
+        order = np.argsort(leaves, kind="stable")
+        self.rows = rows[order]
+        self.counts = np.bincount(leaves, minlength=node_offsets[-1])
+        self.ptr = np.concatenate(([0], np.cumsum(self.counts)))
+        self.matrix = sparse.csr_matrix(
+            (np.ones(len(self.rows)), self.rows, self.ptr),
+            shape=(node_offsets[-1], self.n_rows),
+        )
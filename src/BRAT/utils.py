@@ -1,3 +1,4 @@
+import copy
 import numpy as np
 import matplotlib.pyplot as plt
 import os
@@ -26,10 +27,10 @@ from BRAT.algorithms import BRATD, BRATP
 
 
 # data generation
-def generate_data(function_type='friedman1', n_train=5000, n_test=1000, 
-                  n_calibration = None, noise_std=1, seed=2):
-    np.random.seed(seed)
-    
+def data_function(function_type='friedman1'):
+    """
+    The regression function f of a synthetic simulation, applied row-wise to X of shape (n, 7).
+    """
     if function_type == 'friedman1':
         f = lambda X: 10 * np.sin(np.pi * X[:, 0] * X[:, 1]) + 20 * (X[:, 2] - 0.5)**2 + 0 * X[:, 3] + 5 * X[:, 4]
     elif function_type == 'friedman2':
@@ -52,19 +53,83 @@ def generate_data(function_type='friedman1', n_train=5000, n_test=1000,
         f = lambda X: 1 / (1 + np.exp(-(10 * np.sin(np.pi * X[:, 0] * X[:, 1]) + 20 * (X[:, 2] - 0.5)**2 + 0 * X[:, 3] + 5 * X[:, 4] - 10) / 3))
     else:
         raise ValueError("Unknown function type. Choose 'friedman1', 'friedman2', 'radial', 'smooth_linear', 'linear', 'constant', 'stepwise', 'sigmoid', or 'mild_sine'.")
+    return f
+
+def generate_data(function_type='friedman1', n_train=5000, n_test=1000, 
+                  n_calibration = None, noise_std=1, seed=2, rng=None):
+    # With rng (an int, SeedSequence or Generator) the draws come from their own
+    # generator; otherwise the global numpy random state is reseeded with seed.
+    if rng is None:
+        np.random.seed(seed)
+        random = np.random
+    else:
+        random = np.random.default_rng(rng)
     
-    X_train = np.random.normal(0, 0.5, size=(n_train, 7))
-    X_test = np.random.normal(0, 0.5, (n_test, 7))
-    y_train = f(X_train) + np.random.normal(0, noise_std, size=(n_train,))
+    f = data_function(function_type)
+
+    X_train = random.normal(0, 0.5, size=(n_train, 7))
+    X_test = random.normal(0, 0.5, (n_test, 7))
+    y_train = f(X_train) + random.normal(0, noise_std, size=(n_train,))
     y_test_true = f(X_test)
-    y_test = f(X_test) + np.random.normal(0, noise_std, size=(n_test,))
+    y_test = f(X_test) + random.normal(0, noise_std, size=(n_test,))
     if n_calibration is not None:
-        X_cal = np.random.normal(0, 0.5, (n_calibration, 7))
-        y_cal = f(X_cal) + np.random.normal(0, noise_std, size=(n_calibration,))
+        X_cal = random.normal(0, 0.5, (n_calibration, 7))
+        y_cal = f(X_cal) + random.normal(0, noise_std, size=(n_calibration,))
         return X_train, y_train, X_test, y_test, y_test_true, X_cal, y_cal
     else:
         return X_train, y_train, X_test, y_test, y_test_true
 
+def stream_data(function_type='friedman1', n_rows=10**6, chunk_size=10**5,
+                noise_std=1, rng=None, dtype=np.float64):
+    """
+    Lazily generate n_rows samples of a synthetic simulation (see generate_data) in chunks.
+
+    The draws come from their own np.random.Generator built from rng (an int, SeedSequence,
+    Generator or None), so the global random state is left untouched. They follow the order
+    of generate_data, every X before any noise, so the concatenated chunks equal
+    generate_data(function_type, n_train=n_rows, n_test=0, noise_std=noise_std, rng=rng)
+    for any chunk_size; the noise comes from a copy of the generator moved past the X draws.
+    Every chunk is drawn and evaluated in float64 and only then cast to dtype, so a smaller
+    dtype rounds the float64 values rather than changing them.
+
+    Yields:
+        (X, y, f_X) per chunk, with X of shape (chunk, 7) and y = f_X + noise, all of dtype.
+    """
+    random = np.random.default_rng(rng)
+    noise_random = copy.deepcopy(random)
+    for start in range(0, n_rows, chunk_size):
+        noise_random.normal(0, 0.5, size=(min(chunk_size, n_rows - start), 7))
+    f = data_function(function_type)
+    for start in range(0, n_rows, chunk_size):
+        m = min(chunk_size, n_rows - start)
+        X = random.normal(0, 0.5, size=(m, 7))
+        f_X = np.asarray(f(X), dtype=np.float64)
+        y = f_X + noise_random.normal(0, noise_std, size=(m,))
+        yield X.astype(dtype, copy=False), y.astype(dtype, copy=False), f_X.astype(dtype, copy=False)
+
+def write_data_memmap(path, function_type='friedman1', n_rows=10**6, chunk_size=10**5,
+                      noise_std=1, rng=None, dtype=np.float64):
+    """
+    Stream a synthetic simulation (see stream_data) straight into memory-mapped .npy files
+    '<path>_X.npy', '<path>_y.npy' and '<path>_f.npy', never holding more than one chunk in RAM.
+
+    Returns:
+        X, y, f_X: The filled arrays as np.memmap (readable later with np.load(..., mmap_mode='r')).
+    """
+    X_out = np.lib.format.open_memmap(f"{path}_X.npy", mode="w+", dtype=dtype, shape=(n_rows, 7))
+    y_out = np.lib.format.open_memmap(f"{path}_y.npy", mode="w+", dtype=dtype, shape=(n_rows,))
+    f_out = np.lib.format.open_memmap(f"{path}_f.npy", mode="w+", dtype=dtype, shape=(n_rows,))
+    start = 0
+    for X, y, f_X in stream_data(function_type, n_rows, chunk_size, noise_std, rng, dtype):
+        stop = start + len(X)
+        X_out[start:stop] = X
+        y_out[start:stop] = y
+        f_out[start:stop] = f_X
+        start = stop
+    for out in (X_out, y_out, f_out):
+        out.flush()
+    return X_out, y_out, f_out
+
 # mse calculation
 def calculate_mse(estimator, X, y, X_test, y_test):
     estimator.fit(X, y)
@@ -448,21 +513,33 @@ def train_all_models(X_train, y_train_arr, X_test, y_test_arr, epoch,
             bratd = BRATD(n_estimators=params['n_estimators'], learning_rate=params['learning_rate'],
                       max_depth=params['max_depth'], dropout_rate=params['dropout_rate'],
                       min_samples_split=2, subsample_rate=params['subsample_rate'])
-            mse_dict[model_name] = bratd.fit(X_train, y_train_arr, X_test, y_test_arr)
+            bratd.fit(X_train, y_train_arr)
+            mse_dict[model_name] = [
+                mean_squared_error(y_test_arr, y_pred)
+                for y_pred in tqdm(bratd.staged_predict(X_test), desc=f"{model_name} staged_predict", total=params['n_estimators'])
+            ]
 
         elif model_name == 'Boulevard':
             print(f"Training {model_name}...")
             boulevard = BRATD(n_estimators=params['n_estimators'], learning_rate=params['learning_rate'],
                             max_depth=params['max_depth'], dropout_rate=0.0,
                             min_samples_split=2, subsample_rate=params['subsample_rate'])
-            mse_dict[model_name] = boulevard.fit(X_train, y_train_arr, X_test, y_test_arr)
+            boulevard.fit(X_train, y_train_arr)
+            mse_dict[model_name] = [
+                mean_squared_error(y_test_arr, y_pred)
+                for y_pred in tqdm(boulevard.staged_predict(X_test), desc=f"{model_name} staged_predict", total=params['n_estimators'])
+            ]
 
         elif model_name == 'BRATP':
             print(f"Training {model_name}...")
             bratp = BRATP(n_estimators=params['n_estimators'], learning_rate=params['learning_rate'],
                         max_depth=params['max_depth'], n_trees_per_group=params['n_trees_per_group'],
                         min_samples_split=2, subsample_rate=params['subsample_rate'])
-            mse_dict[model_name] = bratp.fit(X_train, y_train_arr, X_test, y_test_arr)
+            bratp.fit(X_train, y_train_arr)
+            mse_dict[model_name] = [
+                mean_squared_error(y_test_arr, y_pred)
+                for y_pred in tqdm(bratp.staged_predict(X_test), desc=f"{model_name} staged_predict", total=params['n_estimators'])
+            ]
 
         else:
             print(f"Model {model_name} not supported for training.")
@@ -1,66 +1,225 @@
+import warnings
+from collections import OrderedDict
+
 import numpy as np
 import scipy.linalg as spl
 from scipy import sparse
+from scipy.sparse import linalg as splinalg
 
-def compute_k_vector(BRAT_model, X_train, x):
+from BRAT.trees import LeafIndex
+
+def leaf_indicator(leaf_ids, node_offsets, weights=None):
     """
-    Vectorized computation of the influence vector k at test point x using cached leaf assignments.
+    Sparse one-hot encoding of leaf memberships across all trees of an ensemble.
 
     Parameters:
-      BRATD_model: Trained BRATD model.
-      X_train: (n_samples, n_features)
-      x: (n_features,)
+      leaf_ids: (m, T) leaf index of each row in each tree.
+      node_offsets: (T + 1,) offsets of each tree in the packed node numbering.
+      weights: (m, T) optional weight of each membership (e.g. the in-bag mask).
 
     Returns:
-      k_vector: (n_samples,) influence weights for x.
+      indicator: scipy.sparse.csr_matrix of shape (m, total_nodes) with the weight of
+                 row i at column node_offsets[t] + leaf_ids[i, t].
+    """
+    m, T = leaf_ids.shape
+    columns = (leaf_ids + node_offsets[:-1][None, :]).ravel()
+    data = np.ones(m * T) if weights is None else np.asarray(weights, dtype=float).ravel()
+    indptr = np.arange(0, m * T + 1, T)
+    indicator = sparse.csr_matrix((data, columns, indptr), shape=(m, node_offsets[-1]))
+    indicator.eliminate_zeros()
+    return indicator
+
+
+def get_leaf_index(BRAT_model, ref_indices=None):
+    """
+    Return the leaf-to-in-bag-rows index of a trained BRAT model.
+
+    The index over all training rows is built at fit time; an index restricted to
+    ref_indices (the Nyström landmarks) is built on first use and kept until the
+    landmarks or the trees change.
+
+    Parameters:
+      BRAT_model: Trained BRAT model.
+      ref_indices: Optional training indices to restrict the index to.
+
+    Returns:
+      leaf_index: LeafIndex
+    """
+    packed_trees = BRAT_model.get_packed_trees()
+    if ref_indices is None:
+        index = BRAT_model.leaf_index
+        if index is None or index.node_offsets is not packed_trees.node_offsets:
+            index = LeafIndex(BRAT_model.leaf_assignments, BRAT_model.subsample, packed_trees.node_offsets)
+            BRAT_model.leaf_index = index
+        return index
+
+    index = BRAT_model.landmark_index
+    if (index is None or index.node_offsets is not packed_trees.node_offsets
+            or not np.array_equal(index.ref_indices, ref_indices)):
+        index = LeafIndex(BRAT_model.leaf_assignments, BRAT_model.subsample, packed_trees.node_offsets,
+                          ref_indices=np.array(ref_indices))
+        BRAT_model.landmark_index = index
+    return index
+
+
+def compute_k_matrix(BRAT_model, leaf_ids, ref_indices=None):
+    """
+    Vectorized cross-kernel between a batch of query points and the training set.
+
+    For query i and training point j,
+      K[i, j] = (1/T) * sum_t 1{j in-bag for tree t, same leaf as i} / (in-bag count of that leaf),
+    i.e. one compute_k_vector per row. Each row is a scatter, through the leaf index,
+    over the in-bag rows sharing one of the query's T leaves, so the cost is
+    O(T * leaf size) per row rather than O(n * T).
+
+    Parameters:
+      BRAT_model: Trained BRAT model.
+      leaf_ids: (m, T) leaf ids of the query points, as returned by BRAT_model.apply_all.
+      ref_indices: Optional indices of the training points to compare against (e.g. the
+                   Nyström landmarks). In-bag counts are then taken within this subset only.
+
+    Returns:
+      K: (m, n_samples), or (m, len(ref_indices)) if ref_indices is given.
+    """
+    index = get_leaf_index(BRAT_model, ref_indices)
+    node_offsets = index.node_offsets
+    T = len(node_offsets) - 1
+
+    # Trees where the query's leaf holds no in-bag row contribute nothing
+    query_counts = index.counts[leaf_ids + node_offsets[:-1][None, :]]  # shape: (m, T)
+    query_weights = np.divide(1.0, T * query_counts, out=np.zeros(query_counts.shape), where=query_counts > 0)
+    Q = leaf_indicator(leaf_ids, node_offsets, query_weights)
+
+    return (Q @ index.matrix).toarray()
+
+
+def kernel_factors(BRAT_model):
+    """
+    Sparse factors of the full tree kernel, K = Q @ index.matrix.
+
+    Q (n_samples, total_nodes) holds, for each training row, the weight 1 / (T * in-bag
+    count) of its leaf in every tree; index.matrix (total_nodes, n_samples) marks the
+    in-bag rows of each leaf.
+
+    Parameters:
+      BRAT_model: Trained BRAT model.
+
+    Returns:
+      Q: scipy.sparse.csr_matrix
+      index: LeafIndex over all training rows.
+    """
+    T = len(BRAT_model.models)
+    index = get_leaf_index(BRAT_model)
+    leaf_ids = BRAT_model.leaf_assignments[:, :T]
+
+    query_counts = index.counts[leaf_ids + index.node_offsets[:-1][None, :]]  # shape: (n, T)
+    query_weights = np.divide(1.0, T * query_counts, out=np.zeros(query_counts.shape), where=query_counts > 0)
+    Q = leaf_indicator(leaf_ids, index.node_offsets, query_weights)
+    return Q, index
+
+
+def kernel_operator(BRAT_model):
     """
-    n, T = X_train.shape[0], len(BRAT_model.models)
+    The full tree kernel K as a scipy.sparse.linalg.LinearOperator.
 
-    # Cached leaf assignments: shape (n_samples, T)
-    leaf_ids_train = BRAT_model.leaf_assignments  # shape: (n, T)
+    K @ V and K.T @ V are evaluated through the sparse factors of kernel_factors in
+    O(n * T * ncols) time, without forming K.
 
-    # Get leaf ID for test point x for all trees at once
-    leaf_ids_x = np.array([tree.get_tree().apply(x.reshape(1, -1))[0] for tree in BRAT_model.models])  # shape: (T,)
+    Parameters:
+      BRAT_model: Trained BRAT model.
 
-    # Create same_leaf_mask: shape (n, T), True if train sample in same leaf as x
-    same_leaf_mask = (leaf_ids_train == leaf_ids_x[None, :])  # shape: (n, T)
+    Returns:
+      K: LinearOperator of shape (n_samples, n_samples).
+    """
+    Q, index = kernel_factors(BRAT_model)
+    M = index.matrix
+    QT = Q.T.tocsr()
+    MT = M.T.tocsr()
+    n = Q.shape[0]
+    return splinalg.LinearOperator(
+        (n, n), dtype=np.float64,
+        matvec=lambda v: Q @ (M @ v),
+        matmat=lambda V: Q @ (M @ V),
+        rmatvec=lambda v: MT @ (QT @ v),
+        rmatmat=lambda V: MT @ (QT @ V),
+    )
+
+
+def tree_kernel_matrix(BRAT_model, sparse_output=False, max_memory=2**28, dtype=np.float64):
+    """
+    Full expected tree-kernel matrix K over the training set.
 
-    # Subsample mask: shape (n, T)
-    selected_mask = BRAT_model.subsample  # shape: (n, T)
+    Row i of K is the influence vector of training point i, so
+      K[i, j] = (1/T) * sum_t 1{j in-bag for tree t, same leaf as i} / (in-bag count of that leaf).
+    K is assembled directly from leaf co-membership through the leaf index and never
+    forms the (n, n, T) equality tensor; its storage scales with the number of
+    co-leaf pairs rather than with n^2 * T.
 
-    # Valid samples in same leaf AND selected in subsample
-    valid_mask = same_leaf_mask & selected_mask  # shape: (n, T)
+    Parameters:
+      BRAT_model: Trained BRAT model.
+      sparse_output: If True, return a scipy.sparse.csr_matrix; otherwise (default) a dense array.
+      max_memory: Dense output only. Budget in bytes for the working memory used on top
+                  of K itself (default 256 MiB); K is filled in row blocks that fit the
+                  budget, so the peak is about n^2 * itemsize(dtype) + max_memory.
+                  If None, all rows are computed in one block.
+      dtype: Storage dtype of K, e.g. np.float32 to halve the size of a dense K.
 
-    # Count of valid samples per tree: shape: (T,)
-    counts = np.sum(valid_mask, axis=0)  # shape: (T,)
+    Returns:
+      K: (n_samples, n_samples)
+    """
+    Q, index = kernel_factors(BRAT_model)
+    n = Q.shape[0]
 
-    # Avoid division by zero, set counts to 1 where zero to avoid NaNs
-    counts_safe = np.where(counts == 0, 1, counts)  # shape: (T,)
+    if sparse_output:
+        return (Q @ index.matrix).tocsr().astype(dtype, copy=False)
 
-    # Normalize valid_mask by counts: shape: (n, T)
-    valid_contributions = valid_mask / counts_safe  # shape: (n, T)
+    # Each block row costs at most a float64 CSR row (value + column index) and its copy in dtype;
+    # the block is then written straight into K, without a dense temporary
+    bytes_per_row = n * (8 + 4 + np.dtype(dtype).itemsize + 4)
+    K = np.empty((n, n), dtype=dtype)
+    for rows in row_blocks(n, bytes_per_row, max_memory):
+        (Q[rows] @ index.matrix).astype(dtype).toarray(out=K[rows])
+    return K
 
-    # Zero out trees where count was 0 to avoid wrong sums
-    valid_contributions[:, counts == 0] = 0.0
 
-    # Average across trees
-    k_vector = np.sum(valid_contributions, axis=1) / T  # shape: (n,)
+def row_blocks(n_rows, bytes_per_row, max_memory):
+    """
+    Consecutive row slices covering range(n_rows), each using at most max_memory bytes
+    (but at least one row). If max_memory is None, a single slice is returned.
+    """
+    block = n_rows if max_memory is None else int(max(1, min(n_rows, max_memory // bytes_per_row)))
+    return [slice(start, min(start + block, n_rows)) for start in range(0, n_rows, block)]
+
+
+def compute_k_vector(BRAT_model, X_train, x):
+    """
+    Vectorized computation of the influence vector k at test point x using cached leaf assignments.
+
+    Parameters:
+      BRATD_model: Trained BRATD model.
+      X_train: (n_samples, n_features)
+      x: (n_features,)
 
-    return k_vector
+    Returns:
+      k_vector: (n_samples,) influence weights for x.
+    """
+    leaf_ids_x = BRAT_model.apply_all(x.reshape(1, -1))  # shape: (1, T)
+    return compute_k_matrix(BRAT_model, leaf_ids_x)[0]
 
 
 def compute_k_vector_batch(BRAT_model, X_train, X_batch):
-    m = X_batch.shape[0]
-    n = X_train.shape[0]
-    C = np.zeros((m, n))
-    
-    for i in range(m):
-        C[i, :] = compute_k_vector(BRAT_model, X_train, X_batch[i])
-    return C
+    """
+    Influence vectors for a batch of points, one row per point.
+
+    Returns:
+      C: (m, n_samples)
+    """
+    return compute_k_matrix(BRAT_model, BRAT_model.apply_all(X_batch))
 
 
 # find the K matrix for a given training set X_train and an ensemble of trees
-def find_K_matrix(BRAT_model, X_train, Nystrom_subsample=None, reg=1e-6, rec=False):
+def find_K_matrix(BRAT_model, X_train, Nystrom_subsample=None, reg=1e-6, rec=False, sparse_output=False,
+                  max_memory=2**28, dtype=np.float64, random_state=None):
     """
     Compute the influence matrix K or Nyström approximation for X_train.
     
@@ -72,43 +231,32 @@ def find_K_matrix(BRAT_model, X_train, Nystrom_subsample=None, reg=1e-6, rec=Fal
           - If float (0 < value <= 1), use Nyström with n_components = n * Nystrom_subsample.
       reg: Regularization for W matrix inversion.
       rec: If True, use recursive Nyström; else uniform Nyström.
+      sparse_output: Only for the full K. If True, K is returned as a scipy.sparse.csr_matrix.
+      max_memory, dtype: Only for the full K. Working-memory budget (bytes) for building a dense K
+                         in row blocks, and storage dtype of K. See tree_kernel_matrix.
+      random_state: Seed of the Nyström landmark draw (int, SeedSequence or Generator);
+                    None draws fresh entropy.
     
     Returns:
       - Full K matrix (n x n), or
       - C (n x Nystrom_n), W (Nystrom_n x Nystrom_n), sampled_indices (Nyström).
     """
-    import scipy.linalg as spl
-
     n = X_train.shape[0]
-    B = len(BRAT_model.models)
 
     if Nystrom_subsample is None:
         # --- Full K computation ---
-        ID = np.zeros((n, B), dtype=np.int32)
-        for t, model in enumerate(BRAT_model.models):
-            decision_tree = model.get_tree()
-            ID[:, t] = decision_tree.apply(X_train)
-
-        subsample_mask = BRAT_model.subsample.astype(float)
-
-        eq = (ID[:, None, :] == ID[None, :, :]).astype(float)
-        eq = eq * subsample_mask[None, :, :]
-        row_sums = np.sum(eq, axis=1, keepdims=True)
-        row_sums[row_sums == 0] = 1.0
-        eq_norm = eq / row_sums
-        K = np.sum(eq_norm, axis=2) / B
-        return K
+        return tree_kernel_matrix(BRAT_model, sparse_output=sparse_output, max_memory=max_memory, dtype=dtype)
 
     else:
         Nystrom_n = int(n * Nystrom_subsample)
-        rng = np.random.default_rng()
+        rng = np.random.default_rng(random_state)
 
         if not rec:
             # --- Uniform Nyström ---
             # Update the nystrom subsample indices to the model instantiation.
             sampled_indices = rng.choice(n, size=Nystrom_n, replace=False)
             BRAT_model.nys_sub = sampled_indices
-            C = compute_k_vector_batch(BRAT_model, X_train, X_train[sampled_indices])  # shape: (Nystrom_n, n)
+            C = landmark_rows(BRAT_model, sampled_indices)  # shape: (Nystrom_n, n)
             C = C.T  # shape: (n, Nystrom_n)
 
             W = C[sampled_indices, :]  # shape: (Nystrom_n, Nystrom_n)
@@ -116,71 +264,208 @@ def find_K_matrix(BRAT_model, X_train, Nystrom_subsample=None, reg=1e-6, rec=Fal
             return C, W, sampled_indices
 
         else:
-            # --- Recursive Nyström ---
-            n_oversample = np.log(Nystrom_n)
-            k = int(np.ceil(Nystrom_n / (4 * n_oversample)))
-            n_levels = int(np.ceil(np.log(n / Nystrom_n) / np.log(2)))
-            perm = rng.permutation(n)
+            C, W, indices = recursive_nystrom(BRAT_model, Nystrom_subsample, rng=rng)
+            BRAT_model.nys_sub = indices
+            return C, W, indices
+
+def kernel_diagonal(BRAT_model):
+    """
+    Diagonal of the full tree kernel in closed form, O(n * T).
+
+    K[i, i] = (1/T) * sum_t 1{i in-bag for tree t} / (in-bag count of i's leaf in tree t).
 
-            size_list = [n]
-            for l in range(1, n_levels + 1):
-                size_list.append(int(np.ceil(size_list[l - 1] / 2)))
+    Parameters:
+      BRAT_model: Trained BRAT model.
 
-            sample = np.arange(size_list[-1])
-            indices = perm[sample]
-            weights = np.ones(indices.shape[0])
+    Returns:
+      k_diag: (n_samples,)
+    """
+    index = get_leaf_index(BRAT_model)
+    T = len(index.node_offsets) - 1
+    counts = index.counts[BRAT_model.leaf_assignments[:, :T] + index.node_offsets[:-1][None, :]]  # shape: (n, T)
+    in_bag = BRAT_model.subsample[:, :T]
+    # in-bag rows always sit in a leaf with a positive count
+    return np.divide(in_bag, T * counts, out=np.zeros(counts.shape), where=in_bag).sum(axis=1)
 
-            # Precompute diagonal of kernel matrix
-            k_diag = np.array([compute_k_vector(BRAT_model, X_train, X_train[i])[i] for i in range(n)])
 
-            for l in reversed(range(n_levels)):
-                current_indices = perm[:size_list[l]]
+class KernelColumnCache:
+    """
+    LRU cache of kernel vectors of training points, keyed by training index.
 
-                # Compute KS and SKS using compute_k_vector
-                KS = np.zeros((len(current_indices), len(indices)))
-                for i, idx in enumerate(indices):
-                    KS[:, i] = compute_k_vector(BRAT_model, X_train, X_train[idx])[current_indices]
+    Entry j is row j of the full kernel K, i.e. the Nyström column of landmark j.
+    The cache belongs to one set of fitted trees and holds at most max_bytes of rows;
+    the least recently used rows are evicted first. A budget of 0 disables caching.
+    """
+    def __init__(self, max_bytes, node_offsets):
+        """
+        Parameters:
+          max_bytes: Byte budget of the cached rows.
+          node_offsets: Packed node offsets of the trees the rows were computed from.
+        """
+        self.max_bytes = max_bytes
+        self.node_offsets = node_offsets
+        self.rows = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, BRAT_model, indices):
+        """
+        Kernel rows K[indices, :], computing the missing ones in one batch.
+
+        Returns:
+          rows: (len(indices), n_samples)
+        """
+        indices = np.asarray(indices, dtype=int)
+        unique = np.unique(indices)
+        cached = {i: self.rows[i] for i in unique if i in self.rows}
+        missing = np.array([i for i in unique if i not in cached], dtype=int)
+        self.hits += len(cached)
+        self.misses += len(missing)
+        for i in cached:
+            self.rows.move_to_end(i)
+
+        found = dict(cached)
+        if missing.size:
+            computed = compute_k_matrix(BRAT_model, BRAT_model.leaf_assignments[missing])
+            for i, row in zip(missing, computed):
+                found[i] = row
+                self._put(i, row.copy())  # a view would keep the whole batch alive
+        return np.stack([found[i] for i in indices])
+
+    def _put(self, i, row):
+        if row.nbytes > self.max_bytes:
+            return
+        self.rows[i] = row
+        self.nbytes += row.nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.rows.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+
+def get_kernel_cache(BRAT_model):
+    """
+    Return the kernel-row cache of a trained BRAT model, creating it on first use and
+    replacing it once the trees change.
 
-                SKS = KS[sample, :]
+    Parameters:
+      BRAT_model: Trained BRAT model.
 
-                if k >= SKS.shape[0]:
-                    lmbda = 10e-6
-                else:
-                    weighted_SKS = SKS * weights[:, None] * weights[None, :]
-                    eigs = spl.eigvalsh(weighted_SKS, subset_by_index=(SKS.shape[0]-k, SKS.shape[0]-1))
-                    lmbda = (np.sum(np.diag(SKS) * (weights ** 2)) - np.sum(eigs)) / k
-
-                lmbda = max(lmbda, 1e-6 * SKS.shape[0])
-
-                R = np.linalg.solve(SKS + np.diag(lmbda * weights ** (-2)), KS.T).T
-
-                if l != 0:
-                    leverage_score = np.minimum(1.0, n_oversample * (1 / lmbda) * np.maximum(0.0, (
-                            k_diag[current_indices] - np.sum(R * KS, axis=1))))
-                    sample = np.where(rng.uniform(size=size_list[l]) < leverage_score)[0]
-                    if sample.size == 0:
-                        leverage_score[:] = Nystrom_n / size_list[l]
-                        sample = rng.choice(size_list[l], size=Nystrom_n, replace=False)
-                    weights = np.sqrt(1. / leverage_score[sample])
-                else:
-                    leverage_score = np.minimum(1.0, (1 / lmbda) * np.maximum(0.0, (
-                            k_diag[current_indices] - np.sum(R * KS, axis=1))))
-                    p = leverage_score / leverage_score.sum()
-                    sample = rng.choice(n, size=Nystrom_n, replace=False, p=p)
+    Returns:
+      kernel_cache: KernelColumnCache
+    """
+    node_offsets = BRAT_model.get_packed_trees().node_offsets
+    cache = BRAT_model.kernel_cache
+    if cache is None or cache.node_offsets is not node_offsets:
+        cache = KernelColumnCache(BRAT_model.kernel_cache_bytes, node_offsets)
+        BRAT_model.kernel_cache = cache
+    return cache
 
-                indices = perm[sample]
 
-            # Final C and W for Recursive Nyström
-            C = np.zeros((n, Nystrom_n))
-            for i, idx in enumerate(indices):
-                C[:, i] = compute_k_vector(BRAT_model, X_train, X_train[idx])
+def landmark_rows(BRAT_model, indices, cache=None):
+    """
+    Kernel rows K[indices, :] of training points, through the model's kernel-row cache.
 
-            W = np.zeros((Nystrom_n, Nystrom_n))
-            for i, idx_i in enumerate(indices):
-                W[i, :] = C[idx_i, :]
+    Parameters:
+      BRAT_model: Trained BRAT model.
+      indices: Training indices.
+      cache: Optional dict from training index to its kernel row, checked before the
+             model's cache; rows fetched for this call are added to it. It keeps rows
+             available to the caller when the model's cache is disabled or evicts them.
+
+    Returns:
+      rows: (len(indices), n_samples)
+    """
+    if cache is None:
+        return get_kernel_cache(BRAT_model).get(BRAT_model, indices)
+    missing = np.array([i for i in np.unique(indices) if i not in cache], dtype=int)
+    if missing.size:
+        for i, row in zip(missing, get_kernel_cache(BRAT_model).get(BRAT_model, missing)):
+            cache[i] = row
+    return np.stack([cache[i] for i in indices])
+
+
+def recursive_nystrom(BRAT_model, Nystrom_subsample, rng=None):
+    """
+    Recursive ridge-leverage-score Nyström (Musco and Musco, 2017) on the tree kernel.
+
+    Landmarks are drawn level by level on nested halves of a random permutation of the
+    training set, with probabilities given by approximate ridge leverage scores computed
+    from the landmarks of the previous level. The kernel diagonal is taken in closed form
+    (see kernel_diagonal), and the landmark rows of each level are evaluated in one batch
+    through the model's kernel-row cache, so rows seen on a previous level are reused. Rows
+    evaluated during the call are also kept in a per-call dict, so they are not recomputed
+    when the model's cache is disabled (kernel_cache_bytes=0) or has evicted them.
+
+    Parameters:
+      BRAT_model: Trained BRAT model.
+      Nystrom_subsample: Float (0 < value <= 1); n_components = n * Nystrom_subsample.
+      rng: Optional np.random.Generator.
+
+    Returns:
+      C: (n, Nystrom_n)
+      W: (Nystrom_n, Nystrom_n)
+      indices: Landmark indices, shape (Nystrom_n,).
+    """
+    n = BRAT_model.leaf_assignments.shape[0]
+    Nystrom_n = int(n * Nystrom_subsample)
+    if rng is None:
+        rng = np.random.default_rng()
+
+    n_oversample = np.log(Nystrom_n)
+    k = int(np.ceil(Nystrom_n / (4 * n_oversample)))
+    n_levels = int(np.ceil(np.log(n / Nystrom_n) / np.log(2)))
+    perm = rng.permutation(n)
+
+    size_list = [n]
+    for l in range(1, n_levels + 1):
+        size_list.append(int(np.ceil(size_list[l - 1] / 2)))
+
+    sample = np.arange(size_list[-1])
+    indices = perm[sample]
+    weights = np.ones(indices.shape[0])
+
+    k_diag = kernel_diagonal(BRAT_model)
+    rows = {}
+
+    for l in reversed(range(n_levels)):
+        current_indices = perm[:size_list[l]]
+
+        KS = landmark_rows(BRAT_model, indices, rows)[:, current_indices].T
+
+        SKS = KS[sample, :]
+
+        if k >= SKS.shape[0]:
+            lmbda = 10e-6
+        else:
+            weighted_SKS = SKS * weights[:, None] * weights[None, :]
+            eigs = spl.eigvalsh(weighted_SKS, subset_by_index=(SKS.shape[0]-k, SKS.shape[0]-1))
+            lmbda = (np.sum(np.diag(SKS) * (weights ** 2)) - np.sum(eigs)) / k
+
+        lmbda = max(lmbda, 1e-6 * SKS.shape[0])
+
+        R = np.linalg.solve(SKS + np.diag(lmbda * weights ** (-2)), KS.T).T
+
+        if l != 0:
+            leverage_score = np.minimum(1.0, n_oversample * (1 / lmbda) * np.maximum(0.0, (
+                    k_diag[current_indices] - np.sum(R * KS, axis=1))))
+            sample = np.where(rng.uniform(size=size_list[l]) < leverage_score)[0]
+            if sample.size == 0:
+                leverage_score[:] = Nystrom_n / size_list[l]
+                sample = rng.choice(size_list[l], size=Nystrom_n, replace=False)
+            weights = np.sqrt(1. / leverage_score[sample])
+        else:
+            leverage_score = np.minimum(1.0, (1 / lmbda) * np.maximum(0.0, (
+                    k_diag[current_indices] - np.sum(R * KS, axis=1))))
+            p = leverage_score / leverage_score.sum()
+            sample = rng.choice(n, size=Nystrom_n, replace=False, p=p)
+
+        indices = perm[sample]
+
+    C = landmark_rows(BRAT_model, indices, rows).T  # shape: (n, Nystrom_n)
+    W = C[indices, :]
+    return C, W, indices
 
-            BRAT_model.nys_sub = indices
-            return C, W, indices
 
 def calculate_rn(BRAT, X_train, x, K=None, sketched_inverse_K_sq=None):
     """
@@ -200,11 +485,12 @@ def calculate_rn(BRAT, X_train, x, K=None, sketched_inverse_K_sq=None):
       r_n: Estimated r_n vector (n,).
       r_norm: L2 norm of r_n.
     """
-    lam = BRAT.learning_rate
-    q = 1 - BRAT.dropout_rate
+    lam, q = BRAT.kernel_regularization()
 
     if K is not None:
         # Full K: use direct inverse
+        if sparse.issparse(K):
+            K = K.toarray()
         KRR = np.linalg.inv(q * K + (1 / lam) * np.eye(K.shape[0]))
         k_vector = compute_k_vector(BRAT, X_train, x)
         rn_norm = np.linalg.norm(KRR @ k_vector)
@@ -275,8 +561,7 @@ def estimate_built_in_variance(BRAT_model, X_train, y_train, X_test, y_test, x,
     sigma2_hat = estimate_noise_variance(BRAT_model, X_train, y_train, X_test, y_test, in_bag=in_bag)
     k_vector = compute_k_vector(BRAT_model, X_train, x)\
     
-    q = 1 - BRAT_model.dropout_rate
-    lam = BRAT_model.learning_rate
+    lam, q = BRAT_model.kernel_regularization()
 
     if Nystrom_subsample is not None:
         C, W, _ = find_K_matrix(BRAT_model, X_train, Nystrom_subsample=Nystrom_subsample, rec=rec)
@@ -306,15 +591,313 @@ def estimate_emp_rep_variance(BRATD_model, x):
       tau2_hat: The estimated between-replication variance (a non-negative float).
     """
     
-    predictions = []
-    for est in BRATD_model.models:
-        pred = est.predict(np.expand_dims(x, axis=0))[0]
-        predictions.append(pred)
-        
-    predictions = np.array(predictions)
+    predictions = BRATD_model.get_packed_trees().predict_all(np.expand_dims(x, axis=0))[0]
     
     tau2_hat = np.var(predictions, ddof=1)  
     
     return tau2_hat
 
 
+
+
+def woodbury_sketch(C, W, lam, q):
+    """
+    Square S S^T of the Woodbury-sketched inverse of the regularized Nyström kernel.
+
+    The sketched inverse is S = W^+ (lam I - lam^2 C^T C A^{-1}) C^T with
+    A = (1/q) W + lam C^T C. Since lam I - lam^2 C^T C A^{-1} = (lam / q) W A^{-1},
+      S S^T = W^+ G (C^T C) G^T W^+^T,   G = (lam / q) W A^{-1},
+    which needs only s x s matrices besides C and avoids the cancellation between the
+    two Woodbury terms. Neither W nor A is symmetric, and A is singular whenever two
+    landmarks share every leaf, so A^{-1} is applied as a least-squares solve.
+
+    Parameters:
+      C: Nyström columns (n, s).
+      W: Landmark kernel (s, s).
+      lam: Learning rate.
+      q: Keep rate 1 - dropout_rate.
+
+    Returns:
+      sketched_inverse_K_sq: (s, s), symmetric.
+
+    Raises:
+      np.linalg.LinAlgError: if an SVD does not converge.
+    """
+    W_inv = np.linalg.pinv(W)
+    CTC = C.T @ C
+    A = (1 / q) * W + lam * CTC
+    # G^T = (lam / q) A^{-T} W^T
+    G = (lam / q) * np.linalg.lstsq(A.T, W.T, rcond=None)[0].T
+    sketched_inverse_K_sq = W_inv @ (G @ CTC @ G.T) @ W_inv.T
+    return (sketched_inverse_K_sq + sketched_inverse_K_sq.T) / 2
+
+
+class RegularizedKernelSolver:
+    """
+    Factor-once solver for the regularized kernel system ((1/lam) K + q I) r = k.
+
+    The matrix is LU-factorized once (K is not symmetric in general, since each
+    column is weighted by the in-bag count of its own leaf), and every query is
+    answered with a pair of triangular solves. If the matrix is numerically
+    singular, e.g. q = 0 with a rank-deficient K, the pseudo-inverse is used
+    instead, as in the original per-query computation.
+    """
+    def __init__(self, K, lam, q):
+        """
+        Parameters:
+          K: Full kernel matrix (n, n), dense or scipy.sparse.
+          lam: Learning rate.
+          q: Keep rate 1 - dropout_rate.
+        """
+        self.K = K
+        self.lam = lam
+        self.q = q
+        if sparse.issparse(K):
+            K = K.toarray()
+        A = (1 / lam) * K + q * np.eye(K.shape[0])
+        self.lu = None
+        self.pinv = None
+        with warnings.catch_warnings():
+            # singularity is detected from the pivots below
+            warnings.simplefilter("ignore", spl.LinAlgWarning)
+            lu, piv = spl.lu_factor(A, check_finite=False)
+        pivots = np.abs(np.diag(lu))
+        if pivots.min() > A.shape[0] * np.finfo(A.dtype).eps * pivots.max():
+            self.lu = (lu, piv)
+        else:
+            self.pinv = np.linalg.pinv(A)
+
+    def matches(self, K, lam, q):
+        """
+        Whether the solver was factorized for this kernel and these hyperparameters.
+        """
+        return self.K is K and self.lam == lam and self.q == q
+
+    def solve(self, k):
+        """
+        Weight vectors r = ((1/lam) K + q I)^{-1} k for k of shape (n,) or (n, m).
+        """
+        if self.lu is not None:
+            return spl.lu_solve(self.lu, k, check_finite=False)
+        return self.pinv @ k
+
+
+class KernelSchur:
+    """
+    Complex Schur decomposition K = Z T Z^H of the full kernel, shared by every
+    (learning rate, dropout rate) pair.
+
+    Since Z is unitary, ||((1/lam) K + q I)^{-1} k|| = ||((1/lam) T + q I)^{-1} Z^H k||,
+    so once K is decomposed each hyperparameter setting costs one triangular solve
+    instead of a new factorization. K is not symmetric, so T is triangular rather
+    than diagonal; for a symmetric K this reduces to an eigenvalue rescale.
+    """
+    def __init__(self, K):
+        """
+        Parameters:
+          K: Full kernel matrix (n, n), dense or scipy.sparse.
+        """
+        self.K = K
+        if sparse.issparse(K):
+            K = K.toarray()
+        self.T, self.Z = spl.schur(K, output="complex")
+
+    def matches(self, K):
+        """
+        Whether the decomposition was computed for this kernel.
+        """
+        return self.K is K
+
+    def rn_norms(self, k, learning_rates, dropout_rates):
+        """
+        Unclipped BRAT weight norms for every column of k and every hyperparameter pair.
+
+        Parameters:
+          k: Influence vectors (n,) or (n, m).
+          learning_rates: Sequence of learning rates lam.
+          dropout_rates: Sequence of dropout rates; q = 1 - dropout_rate.
+
+        Returns:
+          rn_norm: (len(learning_rates), len(dropout_rates), m), or without the
+                   last axis if k is a single vector.
+        """
+        k = np.asarray(k)
+        single = k.ndim == 1
+        k = k.reshape(k.shape[0], -1)
+        kz = self.Z.conj().T @ k
+        n = self.T.shape[0]
+        diag = np.diag(self.T)
+        rn_norm = np.empty((len(learning_rates), len(dropout_rates), k.shape[1]))
+        for a, lam in enumerate(learning_rates):
+            for b, dropout_rate in enumerate(dropout_rates):
+                q = 1 - dropout_rate
+                pivots = np.abs(diag / lam + q)
+                if pivots.min() > n * np.finfo(float).eps * pivots.max():
+                    A = self.T / lam
+                    A[np.diag_indices(n)] += q
+                    rn = spl.solve_triangular(A, kz, check_finite=False)
+                else:
+                    rn = RegularizedKernelSolver(self.K, lam, q).solve(k)
+                rn_norm[a, b] = np.linalg.norm(rn, axis=0)
+        return rn_norm[..., 0] if single else rn_norm
+
+
+class RandomizedKernelSketch:
+    """
+    Rank-r randomized SVD K ~ U diag(sigma) V^T of the full tree kernel, and the
+    BRAT weight norms it implies.
+
+    The factor is found with a randomized range finder (Halko, Martinsson and Tropp,
+    2011) that only touches K through products with blocks of vectors (see
+    kernel_operator). Given the factor, ((1/lam) K + q I)^{-1} k follows from the
+    Woodbury identity:
+      r = (k - U y) / q,   y = (lam q diag(1/sigma) + V^T U)^{-1} V^T k,
+    and since U has orthonormal columns ||r||^2 = (||k||^2 - 2 (U^T k)^T y + ||y||^2) / q^2.
+    With q = 0 the system is solved in the least-squares sense on the sketch.
+    """
+    def __init__(self, BRAT_model, rank, n_oversamples=10, n_iter=2, random_state=None):
+        """
+        Parameters:
+          BRAT_model: Trained BRAT model.
+          rank: Rank r of the sketch.
+          n_oversamples: Extra random directions used by the range finder.
+          n_iter: Number of power iterations; more help when the spectrum decays slowly.
+          random_state: Seed or np.random.Generator for the test matrix.
+        """
+        K = kernel_operator(BRAT_model)
+        n = K.shape[0]
+        rank = min(rank, n)
+        size = min(rank + n_oversamples, n)
+        rng = np.random.default_rng(random_state)
+
+        Y = K.matmat(rng.standard_normal((n, size)))
+        Q, _ = np.linalg.qr(Y)
+        for _ in range(n_iter):
+            Q, _ = np.linalg.qr(K.rmatmat(Q))
+            Q, _ = np.linalg.qr(K.matmat(Q))
+        B = K.rmatmat(Q).T  # Q^T K, shape: (size, n)
+        U_B, sigma, Vt = np.linalg.svd(B, full_matrices=False)
+
+        self.rank = rank
+        self.U = Q @ U_B[:, :rank]
+        self.sigma = sigma[:rank]
+        self.V = Vt[:rank].T
+        self.VTU = self.V.T @ self.U
+
+    def _terms(self, k, lam, q):
+        # drop numerically zero singular values, which the range finder returns when
+        # the rank exceeds that of K
+        keep = self.sigma > np.finfo(float).eps * max(self.sigma.max(initial=0.0), 1.0)
+        U, V, sigma = self.U[:, keep], self.V[:, keep], self.sigma[keep]
+        if q == 0:
+            # no ridge: r = lam K^+ k on the range of the sketch
+            return U, V, lam * (U.T @ k) / sigma[:, None]
+        core = lam * q * np.diag(1 / sigma) + self.VTU[np.ix_(keep, keep)]
+        return U, V, np.linalg.solve(core, V.T @ k)
+
+    def solve(self, k, lam, q):
+        """
+        Approximate weight vectors r = ((1/lam) K + q I)^{-1} k for k of shape (n,) or (n, m).
+        """
+        k = np.asarray(k)
+        single = k.ndim == 1
+        k = k.reshape(k.shape[0], -1)
+        U, V, y = self._terms(k, lam, q)
+        r = V @ y if q == 0 else (k - U @ y) / q
+        return r[:, 0] if single else r
+
+    def rn_norms(self, k, lam, q):
+        """
+        Unclipped BRAT weight norms for influence vectors k of shape (n,) or (n, m),
+        without forming the n-dimensional weight vectors.
+        """
+        k = np.asarray(k)
+        single = k.ndim == 1
+        k = k.reshape(k.shape[0], -1)
+        U, V, y = self._terms(k, lam, q)
+        if q == 0:
+            rn_norm = np.linalg.norm(y, axis=0)
+        else:
+            rn_sq = (k * k).sum(axis=0) - 2 * ((U.T @ k) * y).sum(axis=0) + (y * y).sum(axis=0)
+            rn_norm = np.sqrt(np.maximum(rn_sq, 0.0)) / q
+        return rn_norm[0] if single else rn_norm
+
+
+class InferenceState:
+    """
+    Query-independent part of the built-in variance estimate of a fitted BRAT model.
+
+    Built once per fitted model and shared by every point of interest: the noise
+    variance estimate sigma_hat2, the Nyström landmarks with their sketched inverse
+    (or, without Nyström, the factorized regularized full kernel), and the
+    scale factor s = (1 + lam * q) / lam. Because the landmarks are drawn once,
+    repeated queries on the same state give the same intervals.
+
+    A state belongs to the fit it was built from; once the model is refit it is
+    stale and is rejected by the interval functions.
+    """
+    def __init__(self, BRAT_model, in_bag=False, Nystrom_subsample=None, random_state=None):
+        """
+        Parameters:
+          BRAT_model: Trained BRAT model.
+          in_bag: Use the training set (True) or the held-out set (False) to estimate sigma_hat2.
+          Nystrom_subsample: Nyström subsample rate; if None, the exact kernel is used.
+          random_state: Seed of the Nyström landmark draw; None draws fresh entropy.
+        """
+        lam, q = BRAT_model.kernel_regularization()
+
+        self.in_bag = in_bag
+        self.Nystrom_subsample = Nystrom_subsample
+        self.random_state = random_state
+        self.fit_count = BRAT_model.fit_count
+        self.scale = (1 + lam * q) / lam
+        self.sigma_hat2 = BRAT_model.est_sigma_hat2(in_bag)
+
+        self.nys_sub = None
+        self.sketched_inverse_K_sq = None
+        self.K_solver = None
+        if Nystrom_subsample is not None:
+            BRAT_model.unif_nystrom(Nystrom_subsample, random_state=random_state)
+            BRAT_model.sketched_inverse_K_sq = None
+            BRAT_model.sketch_K()
+            self.nys_sub = BRAT_model.nys_sub
+            self.sketched_inverse_K_sq = BRAT_model.sketched_inverse_K_sq
+        if self.sketched_inverse_K_sq is None:
+            # no Nyström requested, or sketch_K fell back to the full kernel
+            self.K_solver = BRAT_model.get_K_solver()
+
+    def is_valid(self, BRAT_model):
+        """
+        Whether the state was built from the current fit of BRAT_model.
+        """
+        return self.fit_count == BRAT_model.fit_count
+
+    def rn_norm(self, BRAT_model, X, max_memory=2**28):
+        """
+        Clipped BRAT weight norms at one point (n_features,) or a batch (m, n_features).
+
+        Norms above 10 are set to 1.0, as in sketch_r. The rows of X are processed in
+        blocks whose kernel rows and weight vectors fit in max_memory bytes (default
+        256 MiB), so the (m, n) cross-kernel is never formed at once; None uses a
+        single block.
+        """
+        X = np.asarray(X)
+        single = X.ndim == 1
+        X = X.reshape(-1, X.shape[-1])
+        if self.sketched_inverse_K_sq is not None:
+            width = len(self.nys_sub)
+        else:
+            width = self.K_solver.K.shape[0]
+        # CSR kernel row (value + column index), its dense copy and its weight vector
+        bytes_per_row = width * (8 + 4 + 8 + 8)
+        rn_norm = np.empty(X.shape[0])
+        for rows in row_blocks(X.shape[0], bytes_per_row, max_memory):
+            leaf_ids = BRAT_model.apply_all(X[rows])
+            if self.sketched_inverse_K_sq is not None:
+                sketched_k = compute_k_matrix(BRAT_model, leaf_ids, ref_indices=self.nys_sub)  # shape: (b, s)
+                rn_norm[rows] = np.sqrt(np.einsum("ij,ij->i", sketched_k @ self.sketched_inverse_K_sq, sketched_k))
+            else:
+                k = compute_k_matrix(BRAT_model, leaf_ids)  # shape: (b, n)
+                rn_norm[rows] = np.linalg.norm(self.K_solver.solve(k.T), axis=0)
+        rn_norm[rn_norm > 10] = 1.0
+        return rn_norm[0] if single else rn_norm
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from BRAT.algorithms import BRATD, BRATP
+from BRAT.utils import generate_data
+
+
+@pytest.fixture
+def data():
+    X_train, y_train, X_test, y_test, _ = generate_data('friedman1', n_train=200, n_test=20, rng=0)
+    return X_train, y_train, X_test, y_test
+
+
+@pytest.fixture
+def bratd(data):
+    X_train, y_train, X_test, y_test = data
+    model = BRATD(n_estimators=12, learning_rate=0.5, dropout_rate=0.3, max_depth=3,
+                  disable_tqdm=True, random_state=0)
+    model.fit(X_train, y_train, X_test, y_test)
+    return model
+
+
+@pytest.fixture
+def bratp(data):
+    X_train, y_train, X_test, y_test = data
+    model = BRATP(n_estimators=12, n_trees_per_group=4, learning_rate=0.5, max_depth=3,
+                  disable_tqdm=True, random_state=0)
+    model.fit(X_train, y_train, X_test, y_test)
+    return model
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from BRAT.inferences import PI, CI, RI, all_intervals, PI_batch, CI_batch, RI_batch, all_intervals_batch
+
+
+@pytest.mark.parametrize("Nystrom_subsample", [None, 0.3])
+def test_batch_intervals_match_pointwise(bratd, data, Nystrom_subsample):
+    X_test = data[2][:8]
+    state = bratd.get_inference_state(True, Nystrom_subsample, random_state=0)
+
+    df_pi = PI_batch(bratd, True, X_test, Nystrom_subsample, state=state)
+    df_ci = CI_batch(bratd, True, X_test, Nystrom_subsample, state=state)
+    df_ri = RI_batch(bratd, X_test, in_bag=True, Nystrom_subsample=Nystrom_subsample, state=state)
+    df_all = all_intervals_batch(bratd, X_test, in_bag=True, Nystrom_subsample=Nystrom_subsample, state=state)
+    assert len(df_all) == len(X_test)
+
+    for i, x in enumerate(X_test):
+        pi, y_pred, rn_norm, sigma_hat2, tau_hat2 = PI(bratd, True, x, Nystrom_subsample, state=state)
+        ci = CI(bratd, True, x, Nystrom_subsample, state=state)[0]
+        ri = RI(bratd, x, in_bag=True, Nystrom_subsample=Nystrom_subsample, state=state)[0]
+        pi_all, ci_all, ri_all = all_intervals(bratd, x, in_bag=True, Nystrom_subsample=Nystrom_subsample,
+                                               state=state)[:3]
+        np.testing.assert_allclose(df_pi.loc[i, ["pi_lower", "pi_upper"]], np.ravel(pi), rtol=1e-10)
+        np.testing.assert_allclose(df_ci.loc[i, ["ci_lower", "ci_upper"]], np.ravel(ci), rtol=1e-10)
+        np.testing.assert_allclose(df_ri.loc[i, ["ri_lower", "ri_upper"]], np.ravel(ri), rtol=1e-10)
+        np.testing.assert_allclose(df_all.loc[i, ["pi_lower", "pi_upper"]], np.ravel(pi_all), rtol=1e-10)
+        np.testing.assert_allclose(df_all.loc[i, ["ci_lower", "ci_upper"]], np.ravel(ci_all), rtol=1e-10)
+        np.testing.assert_allclose(df_all.loc[i, ["ri_lower", "ri_upper"]], np.ravel(ri_all), rtol=1e-10)
+        assert df_pi.loc[i, "y_pred"] == pytest.approx(np.ravel(y_pred)[0])
+        assert df_pi.loc[i, "tau2_hat"] == pytest.approx(np.ravel(tau_hat2)[0])
+
+
+def test_batch_rejects_single_point(bratd, data):
+    with pytest.raises(ValueError):
+        PI_batch(bratd, True, data[2][0])
@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+from BRAT.variance_estimation import tree_kernel_matrix
+
+
+@pytest.mark.parametrize("max_memory", [None, 2**28, 50_000, 1])
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_blocked_dense_kernel_matches_sparse(bratd, max_memory, dtype):
+    reference = tree_kernel_matrix(bratd, sparse_output=True).toarray()
+    K = tree_kernel_matrix(bratd, max_memory=max_memory, dtype=dtype)
+    assert K.dtype == dtype
+    np.testing.assert_allclose(K, reference, rtol=1e-6 if dtype == np.float32 else 1e-14, atol=1e-8)
+
+
+def test_full_K_forwards_budget_and_dtype(bratd):
+    K = bratd.full_K(max_memory=10_000, dtype=np.float32)
+    assert K.dtype == np.float32
+    np.testing.assert_allclose(K, bratd.full_K(max_memory=None), rtol=1e-6, atol=1e-8)
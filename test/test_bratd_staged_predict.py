@@ -0,0 +1,17 @@
+import numpy as np
+
+
+def test_bratd_staged_predict_matches_truncated_ensembles(bratd, data):
+    X_test, y_test = data[2], data[3]
+    staged = list(bratd.staged_predict(X_test))
+    models = bratd.models
+    assert len(staged) == len(models)
+    for b, y_pred in enumerate(staged, start=1):
+        bratd.models = models[:b]
+        np.testing.assert_allclose(y_pred, bratd.predict(X_test), rtol=1e-12, atol=1e-12)
+    bratd.models = models
+
+    X_train, y_train = data[0], data[1]
+    mse = bratd.fit(X_train, y_train, X_test, y_test, eval_every=3)
+    staged = list(bratd.staged_predict(X_test))
+    np.testing.assert_allclose(mse, [np.mean((y_test - staged[b - 1]) ** 2) for b in (3, 6, 9, 12)], rtol=1e-12)
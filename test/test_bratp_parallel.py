@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+from BRAT.algorithms import BRATP
+
+
+@pytest.mark.parametrize("drop_first_row", [False, True])
+def test_n_jobs_does_not_change_the_fit(data, drop_first_row):
+    X_train, y_train, X_test, y_test = data
+    fits = []
+    for n_jobs in (None, 1, 3):
+        model = BRATP(n_estimators=10, n_trees_per_group=4, learning_rate=0.5, max_depth=3,
+                      drop_first_row=drop_first_row, disable_tqdm=True, n_jobs=n_jobs, random_state=7)
+        mse = model.fit(X_train, y_train, X_test, y_test)
+        fits.append((model.predict(X_test), model.tree_pred_table, mse))
+    for y_pred, table, mse in fits[1:]:
+        np.testing.assert_array_equal(y_pred, fits[0][0])
+        np.testing.assert_array_equal(table, fits[0][1])
+        assert mse == fits[0][2]
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+
+def dropped_reference(table, group, slot, drop_first_row):
+    # residual offset of the original BRATP.fit, from a copy of the prediction table
+    R = table.copy()
+    R[:, slot, :] = 0.0
+    if group == 0 and drop_first_row:
+        R[0, :, :] = 0.0
+    elif group > 0:
+        R[group, :, :] = 0.0
+    mask = (R != 0).any(axis=2)
+    avg_partial = np.zeros(R.shape[1:])
+    for t in range(R.shape[1]):
+        if mask[:, t].sum() > 0:
+            avg_partial[t] = R[mask[:, t], t, :].mean(axis=0)
+    return avg_partial.sum(axis=0)
+
+
+@pytest.mark.parametrize("drop_first_row", [False, True])
+def test_dropped_prediction_matches_table_copy(bratp, drop_first_row):
+    bratp.drop_first_row = drop_first_row
+    full_table = bratp.tree_pred_table.copy()
+    ng, tpq, _ = full_table.shape
+    np.testing.assert_allclose(bratp.completed_slot_sums, full_table.sum(axis=0))
+    for group in range(ng):
+        for slot in range(tpq):
+            # prediction table as it was just before tree (group, slot) was fitted
+            table = full_table.copy()
+            table[group, slot:] = 0.0
+            table[group + 1:] = 0.0
+            bratp.tree_pred_table = table
+            bratp.completed_slot_sums = table[:group].sum(axis=0)
+            np.testing.assert_allclose(bratp._dropped_prediction(group, slot),
+                                       dropped_reference(table, group, slot, drop_first_row),
+                                       rtol=1e-12, atol=1e-12)
+
+
+def test_prediction_table_matches_tree_predict(bratp, data):
+    X_train = data[0]
+    tpq = bratp.n_trees_per_group
+    for b, tree in enumerate(bratp.models, start=1):
+        expected = tree.predict(X_train)
+        if b == 1:
+            expected = bratp.learning_rate * expected
+        np.testing.assert_allclose(bratp.tree_pred_table[(b - 1) // tpq, (b - 1) % tpq], expected, rtol=1e-12)
@@ -0,0 +1,11 @@
+import numpy as np
+
+
+def test_bratp_staged_predict_matches_predict(bratp, data):
+    X_test, y_test = data[2], data[3]
+    staged = list(bratp.staged_predict(X_test))
+    assert len(staged) == len(bratp.models)
+    for b, y_pred in enumerate(staged, start=1):
+        np.testing.assert_allclose(y_pred, bratp.predict(X_test, num_trees=b), rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(staged[-1], bratp.predict(X_test), rtol=1e-12)
+    np.testing.assert_allclose(bratp.mse_values, [np.mean((y_test - y) ** 2) for y in staged], rtol=1e-12)
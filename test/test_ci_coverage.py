@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from scipy.stats import norm
+
+from BRAT.inferences import CI_coverage_rate, ground_truth
+from BRAT.utils import generate_data
+
+
+@pytest.mark.parametrize("function_type", ["friedman1", "friedman2", "radial", "smooth_linear", "stepwise"])
+def test_ground_truth_matches_generated_truth(function_type):
+    _, _, X_test, _, y_test_true = generate_data(function_type, n_train=10, n_test=30, rng=3)
+    np.testing.assert_array_equal(ground_truth(X_test, function_type), y_test_true)
+    assert ground_truth(X_test[4], function_type) == y_test_true[4]
+
+
+def test_coverage_matches_pointwise_loop(bratd, data):
+    X_test = data[2]
+    avg_coverage_rate, df = CI_coverage_rate(bratd, True, X_test)
+    state = bratd.get_inference_state(True, None)
+    z = norm.ppf(0.975)
+    covered = []
+    for i, x in enumerate(X_test):
+        y_pred = bratd.predict(x.reshape(1, -1))[0]
+        tau_hat = state.scale * state.rn_norm(bratd, x) * np.sqrt(state.sigma_hat2)
+        truth = ground_truth(x)
+        assert df.loc[i, "truth"] == truth
+        np.testing.assert_allclose(df.loc[i, ["ci_lower", "ci_upper"]], [y_pred - z * tau_hat, y_pred + z * tau_hat],
+                                   rtol=1e-12)
+        covered.append(int(y_pred - z * tau_hat <= truth <= y_pred + z * tau_hat))
+    np.testing.assert_array_equal(df["covered"], covered)
+    assert avg_coverage_rate == np.mean(covered)
+
+
+def test_disable_tqdm_is_deprecated(bratd, data):
+    with pytest.warns(DeprecationWarning):
+        CI_coverage_rate(bratd, True, data[2], None, True)
@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from BRAT.inferences import PI_RI_coverage_rate
+from BRAT.trees import spawn_seed_sequences
+from BRAT.utils import generate_data
+
+
+CONFIG = dict(n_BRAT=4, total_trees=8, max_depth=3, learning_rate=0.5, subsample_rate=0.8,
+              dropout_rate=0.3, min_sample_split=2, n_train=120, n_test=10, base_seed=3,
+              noise_std=1.0, in_bag=True, test_point=np.full(7, 0.2))
+
+
+@pytest.mark.parametrize("Nystrom_subsample", [None, 0.3])
+def test_results_do_not_depend_on_workers(Nystrom_subsample):
+    serial = PI_RI_coverage_rate(**CONFIG, Nystrom_subsample=Nystrom_subsample)
+    pooled = PI_RI_coverage_rate(**CONFIG, Nystrom_subsample=Nystrom_subsample, n_jobs=2)
+    with ThreadPoolExecutor(3) as executor:
+        threaded = PI_RI_coverage_rate(**CONFIG, Nystrom_subsample=Nystrom_subsample, executor=executor)
+
+    assert serial[2] is None
+    assert list(serial[3]["BRAT_idx"]) == list(range(CONFIG["n_BRAT"]))
+    for other in (pooled, threaded):
+        assert other[:2] == serial[:2]
+        assert other[3].equals(serial[3])
+        assert other[4].equals(serial[4])
+
+
+def test_return_models():
+    _, _, models, df_pi, _ = PI_RI_coverage_rate(**CONFIG, return_models=True)
+    assert len(models) == CONFIG["n_BRAT"]
+    np.testing.assert_allclose([m.predict(CONFIG["test_point"][None])[0] for m in models], df_pi["y_pred"])
+
+
+def test_streams_are_independent():
+    _, _, models, _, _ = PI_RI_coverage_rate(**CONFIG, Nystrom_subsample=0.3, return_models=True)
+    seeds = np.random.RandomState(CONFIG["base_seed"]).randint(low=0, high=2**32 - 1, size=CONFIG["n_BRAT"])
+    n = CONFIG["n_train"]
+    for model, seed in zip(models, seeds):
+        data_seed, _, landmark_seed = spawn_seed_sequences(int(seed), 3)
+        landmarks = model.inference_state.nys_sub
+        np.testing.assert_array_equal(
+            landmarks, np.random.default_rng(landmark_seed).choice(n, size=len(landmarks), replace=False))
+        # the landmark draw no longer replays the start of the data stream
+        data_stream = np.random.default_rng(data_seed).choice(n, size=len(landmarks), replace=False)
+        assert not np.array_equal(landmarks, data_stream)
+        X_train = generate_data('friedman1', n_train=n, n_test=CONFIG["n_test"], rng=data_seed)[0]
+        np.testing.assert_array_equal(model.X_train, X_train)
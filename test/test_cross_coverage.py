@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from BRAT.inferences import _cross_coverage
+
+
+def nested_loop_coverage(y_pred, lower, upper):
+    # the original per-pair loop of PI_RI_coverage_rate
+    n = len(y_pred)
+    return np.array([sum(1 for j in range(n) if j != i and lower[i] <= y_pred[j] <= upper[i]) / (n - 1)
+                     for i in range(n)])
+
+
+@pytest.mark.parametrize("n", [2, 5, 60])
+def test_matches_nested_loop(n):
+    rng = np.random.default_rng(n)
+    # rounded values create ties between predictions and bounds
+    y_pred = np.round(rng.normal(size=n), 1)
+    lower = np.round(y_pred - np.abs(rng.normal(size=n)), 1)
+    upper = np.round(y_pred + np.abs(rng.normal(size=n)), 1)
+    lower[::4] = y_pred[::4] + 0.5  # intervals that miss their own prediction
+    upper[1::7] = np.nan
+    np.testing.assert_array_equal(_cross_coverage(y_pred, lower, upper), nested_loop_coverage(y_pred, lower, upper))
@@ -0,0 +1,34 @@
+import numpy as np
+from scipy import sparse
+
+from BRAT.variance_estimation import find_K_matrix, tree_kernel_matrix
+
+
+def dense_kernel_reference(model):
+    # (n, n, T) equality tensor of the original full_K
+    ID = model.leaf_assignments
+    eq = (ID[:, None, :] == ID[None, :, :]) * model.subsample[None, :, :].astype(float)
+    row_sums = eq.sum(axis=1, keepdims=True)
+    row_sums[row_sums == 0] = 1.0
+    return (eq / row_sums).sum(axis=2) / len(model.models)
+
+
+def test_full_K_matches_dense_reference(bratd):
+    reference = dense_kernel_reference(bratd)
+    K = bratd.full_K()
+    assert isinstance(K, np.ndarray)
+    np.testing.assert_allclose(K, reference, atol=1e-14)
+    assert bratd.K is K
+
+
+def test_sparse_output(bratd, data):
+    reference = dense_kernel_reference(bratd)
+    K = bratd.full_K(sparse_output=True)
+    assert sparse.issparse(K) and K.format == "csr"
+    np.testing.assert_allclose(K.toarray(), reference, atol=1e-14)
+    np.testing.assert_allclose(tree_kernel_matrix(bratd, sparse_output=True).toarray(), reference, atol=1e-14)
+    np.testing.assert_allclose(find_K_matrix(bratd, data[0]), reference, atol=1e-14)
+
+
+def test_bratp_full_K(bratp):
+    np.testing.assert_allclose(bratp.full_K(), dense_kernel_reference(bratp), atol=1e-14)
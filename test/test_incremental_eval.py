@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from BRAT.algorithms import BRATD
+
+
+def new_model():
+    return BRATD(n_estimators=10, learning_rate=0.5, dropout_rate=0.3, max_depth=3, disable_tqdm=True,
+                 random_state=0)
+
+
+@pytest.mark.parametrize("eval_every", [1, 4])
+def test_logged_mse_matches_predict(data, eval_every):
+    X_train, y_train, X_test, y_test = data
+    model = new_model()
+    mse_list = model.fit(X_train, y_train, X_test, y_test, eval_every=eval_every)
+    stages = range(eval_every, len(model.models) + 1, eval_every)
+    assert len(mse_list) == len(stages)
+
+    models = model.models
+    for mse, b in zip(mse_list, stages):
+        model.models = models[:b]
+        assert mse == pytest.approx(np.mean((model.predict(X_test) - y_test) ** 2), rel=1e-12)
+    model.models = models
+
+
+@pytest.mark.parametrize("eval_every", [None, 0])
+def test_evaluation_can_be_skipped(data, eval_every):
+    X_train, y_train, X_test, y_test = data
+    reference = new_model()
+    reference.fit(X_train, y_train, X_test, y_test)
+    model = new_model()
+    assert model.fit(X_train, y_train, X_test, y_test, eval_every=eval_every) == []
+    np.testing.assert_array_equal(model.predict(X_test), reference.predict(X_test))
+
+
+def test_evaluation_without_held_out_set(data):
+    X_train, y_train = data[0], data[1]
+    assert new_model().fit(X_train, y_train) == []
+    assert new_model().fit(X_train, y_train, eval_every=2) == []
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from BRAT.variance_estimation import compute_k_matrix
+
+
+def test_state_is_reused_for_the_same_settings(bratd):
+    state = bratd.get_inference_state(in_bag=True)
+    assert bratd.get_inference_state(in_bag=True) is state
+    assert bratd.get_inference_state(in_bag=False) is not state
+    assert bratd.get_inference_state(in_bag=False, Nystrom_subsample=0.3, random_state=0) is not state
+
+
+def test_state_matches_direct_estimates(bratd, data):
+    X_test = data[2]
+    state = bratd.get_inference_state(in_bag=True)
+    assert state.sigma_hat2 == pytest.approx(bratd.est_sigma_hat2(True))
+    np.testing.assert_allclose(state.rn_norm(bratd, X_test), bratd.sketch_r_batch(X_test), rtol=1e-12)
+    sigma_hat2, rn_norm, tau_hat2 = bratd.est_tau_hat2(True, None, X_test[0], state=state)
+    assert tau_hat2 == pytest.approx(state.scale * rn_norm * sigma_hat2)
+
+
+def test_nystrom_state_is_reproducible(bratd, data):
+    X_test = data[2]
+    first = bratd.get_inference_state(in_bag=True, Nystrom_subsample=0.3, random_state=1).rn_norm(bratd, X_test)
+    bratd.inference_state = None
+    second = bratd.get_inference_state(in_bag=True, Nystrom_subsample=0.3, random_state=1).rn_norm(bratd, X_test)
+    np.testing.assert_array_equal(first, second)
+
+
+def test_refit_invalidates_state_and_sketches(bratd, data):
+    X_train, y_train, X_test, y_test = data
+    state = bratd.get_inference_state(in_bag=True, Nystrom_subsample=0.3, random_state=0)
+    bratd.randomized_sketch(rank=5, random_state=0)
+    bratd.fit(X_train, y_train, X_test, y_test)
+
+    assert not state.is_valid(bratd)
+    with pytest.raises(ValueError):
+        bratd.est_tau_hat2(True, 0.3, X_test[0], state=state)
+    for name in ("inference_state", "K", "K_solver", "K_schur", "rsvd_sketch",
+                 "C", "W", "nys_sub", "sketched_inverse_K_sq"):
+        assert getattr(bratd, name) is None, name
+    assert bratd.get_inference_state(in_bag=True) is not state
+
+
+def test_bratp_state_uses_its_regularized_kernel(bratp, data):
+    X_test = data[2]
+    lam, q = bratp.kernel_regularization()
+    assert (lam, q) == (1.0, bratp.n_trees_per_group - 1)
+
+    state = bratp.get_inference_state(in_bag=True)
+    assert state.scale == pytest.approx(bratp.n_trees_per_group)
+    K = bratp.full_K()
+    k = compute_k_matrix(bratp, bratp.apply_all(X_test))
+    expected = np.linalg.norm(np.linalg.solve(K + q * np.eye(K.shape[0]), k.T), axis=0)
+    expected[expected > 10] = 1.0
+    rn_norm = bratp.sketch_r_batch(X_test)
+    np.testing.assert_allclose(rn_norm, expected, rtol=1e-8)
+    np.testing.assert_allclose(state.rn_norm(bratp, X_test), rn_norm, rtol=1e-12)
+    np.testing.assert_allclose([bratp.sketch_r(x) for x in X_test], rn_norm, rtol=1e-10)
+
+    nystrom = bratp.get_inference_state(in_bag=True, Nystrom_subsample=0.5, random_state=0)
+    assert nystrom.rn_norm(bratp, X_test).shape == (X_test.shape[0],)
@@ -0,0 +1,40 @@
+import numpy as np
+
+from BRAT.algorithms import BRATD
+from BRAT.variance_estimation import KernelColumnCache, get_kernel_cache, landmark_rows, recursive_nystrom
+
+
+def test_cached_rows_match_full_K(bratd):
+    K = bratd.full_K()
+    cache = get_kernel_cache(bratd)
+    np.testing.assert_allclose(landmark_rows(bratd, [3, 7, 3]), K[[3, 7, 3]], atol=1e-14)
+    assert (cache.hits, cache.misses) == (0, 2)
+    np.testing.assert_allclose(landmark_rows(bratd, [7, 9]), K[[7, 9]], atol=1e-14)
+    assert (cache.hits, cache.misses) == (1, 3)
+    assert get_kernel_cache(bratd) is cache
+
+
+def test_least_recently_used_rows_are_evicted(bratd):
+    row_bytes = bratd.leaf_assignments.shape[0] * 8
+    cache = KernelColumnCache(2 * row_bytes, bratd.get_packed_trees().node_offsets)
+    cache.get(bratd, [0, 1])
+    cache.get(bratd, [0])
+    cache.get(bratd, [2])
+    assert list(cache.rows) == [0, 2]
+    assert cache.nbytes <= cache.max_bytes
+
+
+def test_recursive_nystrom_reuses_rows_without_shared_cache(data):
+    X_train, y_train = data[0], data[1]
+    results = []
+    for kernel_cache_bytes in (2**28, 0):
+        model = BRATD(n_estimators=12, max_depth=3, disable_tqdm=True, random_state=0,
+                      kernel_cache_bytes=kernel_cache_bytes)
+        model.fit(X_train, y_train)
+        C, W, indices = recursive_nystrom(model, 0.2, rng=np.random.default_rng(1))
+        results.append((C, indices, model.kernel_cache.misses))
+    (C_cached, idx_cached, misses_cached), (C_off, idx_off, misses_off) = results
+    np.testing.assert_array_equal(idx_off, idx_cached)
+    np.testing.assert_array_equal(C_off, C_cached)
+    # every distinct row is computed once per call either way
+    assert misses_off == misses_cached
@@ -0,0 +1,37 @@
+import numpy as np
+
+from BRAT.inferences import interval_widths_grid
+from BRAT.variance_estimation import KernelSchur, RegularizedKernelSolver, compute_k_matrix
+
+
+def test_schur_norms_match_solver(bratd, data):
+    K = bratd.full_K()
+    k = compute_k_matrix(bratd, bratd.apply_all(data[2])).T
+    learning_rates, dropout_rates = [0.1, 0.5, 1.0], [0.0, 0.3, 1.0]
+    rn_norm = KernelSchur(K).rn_norms(k, learning_rates, dropout_rates)
+    assert rn_norm.shape == (3, 3, k.shape[1])
+    for a, lam in enumerate(learning_rates):
+        for b, dropout_rate in enumerate(dropout_rates):
+            reference = np.linalg.norm(RegularizedKernelSolver(K, lam, 1 - dropout_rate).solve(k), axis=0)
+            np.testing.assert_allclose(rn_norm[a, b], reference, rtol=1e-7, atol=1e-10)
+
+
+def test_sketch_r_grid_matches_sketch_r_batch(bratd, data):
+    X_test = data[2]
+    learning_rates, dropout_rates = [0.2, 0.5], [0.1, 0.3]
+    grid = bratd.sketch_r_grid(X_test, learning_rates, dropout_rates)
+    schur = bratd.K_schur
+    for a, lam in enumerate(learning_rates):
+        for b, dropout_rate in enumerate(dropout_rates):
+            bratd.learning_rate, bratd.dropout_rate = lam, dropout_rate
+            np.testing.assert_allclose(grid[a, b], bratd.sketch_r_batch(X_test), rtol=1e-7)
+    bratd.sketch_r_grid(X_test, learning_rates, dropout_rates)
+    assert bratd.K_schur is schur
+
+
+def test_interval_widths_grid(bratd, data):
+    X_test = data[2][:5]
+    df = interval_widths_grid(bratd, X_test, [0.5, 1.0], [0.3], in_bag=True)
+    assert len(df) == 2 * 1 * 5
+    assert np.all(df["pi_width"] >= df["ci_width"])
+    np.testing.assert_allclose(df["ri_width"], np.sqrt(2) * df["ci_width"], rtol=1e-12)
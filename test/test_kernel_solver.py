@@ -0,0 +1,37 @@
+import numpy as np
+
+from BRAT.variance_estimation import RegularizedKernelSolver, compute_k_matrix
+
+
+def test_solver_matches_pinv(bratd, data):
+    K = bratd.full_K()
+    lam, q = bratd.learning_rate, 1 - bratd.dropout_rate
+    k = compute_k_matrix(bratd, bratd.apply_all(data[2])).T
+    reference = np.linalg.pinv((1 / lam) * K + q * np.eye(K.shape[0])) @ k
+    solver = RegularizedKernelSolver(K, lam, q)
+    assert solver.lu is not None
+    np.testing.assert_allclose(solver.solve(k), reference, rtol=1e-8, atol=1e-12)
+    np.testing.assert_allclose(solver.solve(k[:, 0]), reference[:, 0], rtol=1e-8, atol=1e-12)
+
+
+def test_singular_system_falls_back_to_pinv(bratd):
+    K = bratd.full_K()
+    k = K[:, :3]
+    solver = RegularizedKernelSolver(K, 1.0, 0.0)
+    assert solver.lu is None
+    np.testing.assert_allclose(solver.solve(k), np.linalg.pinv(K) @ k, atol=1e-8)
+
+
+def test_exact_sketch_r_factorizes_once(bratd, data):
+    X_test = data[2]
+    lam, q = bratd.learning_rate, 1 - bratd.dropout_rate
+    rn, rn_norm = bratd.sketch_r(X_test[0], vector=True)
+    solver = bratd.K_solver
+    bratd.sketch_r(X_test[1])
+    assert bratd.K_solver is solver
+    reference = np.linalg.pinv((1 / lam) * bratd.K + q * np.eye(bratd.K.shape[0])) @ compute_k_matrix(
+        bratd, bratd.apply_all(X_test[:1]))[0]
+    np.testing.assert_allclose(rn, reference, rtol=1e-8, atol=1e-12)
+
+    bratd.learning_rate = 0.25
+    assert bratd.get_K_solver() is not solver
@@ -0,0 +1,39 @@
+import numpy as np
+
+from BRAT.variance_estimation import compute_k_matrix, compute_k_vector, compute_k_vector_batch
+
+
+def k_vector_reference(model, x):
+    # per-tree loop of the original compute_k_vector
+    leaf_ids_x = np.array([tree.get_tree().apply(x.reshape(1, -1).astype(np.float32))[0] for tree in model.models])
+    valid = (model.leaf_assignments == leaf_ids_x[None, :]) & model.subsample
+    counts = valid.sum(axis=0)
+    contributions = valid / np.where(counts == 0, 1, counts)
+    return contributions.sum(axis=1) / len(model.models)
+
+
+def test_apply_all_matches_every_tree(bratd, data):
+    X_test = data[2]
+    leaf_ids = bratd.apply_all(X_test)
+    for t, tree in enumerate(bratd.models):
+        np.testing.assert_array_equal(leaf_ids[:, t], tree.get_tree().apply(X_test.astype(np.float32)))
+
+
+def test_k_matrix_matches_per_tree_loop(bratd, data):
+    X_train, X_test = data[0], data[2]
+    reference = np.stack([k_vector_reference(bratd, x) for x in X_test])
+    np.testing.assert_allclose(compute_k_matrix(bratd, bratd.apply_all(X_test)), reference, atol=1e-14)
+    np.testing.assert_allclose(compute_k_vector_batch(bratd, X_train, X_test), reference, atol=1e-14)
+    np.testing.assert_allclose(compute_k_vector(bratd, X_train, X_test[0]), reference[0], atol=1e-14)
+
+
+def test_k_matrix_against_landmarks(bratd, data):
+    X_test = data[2]
+    ref_indices = np.arange(0, 200, 3)
+    k = compute_k_matrix(bratd, bratd.apply_all(X_test), ref_indices=ref_indices)
+    # in-bag counts are taken within the landmarks only
+    leaf_ids = bratd.apply_all(X_test)
+    valid = (bratd.leaf_assignments[ref_indices][None] == leaf_ids[:, None, :]) & bratd.subsample[ref_indices][None]
+    counts = valid.sum(axis=1, keepdims=True)
+    reference = (valid / np.where(counts == 0, 1, counts)).sum(axis=2) / len(bratd.models)
+    np.testing.assert_allclose(k, reference, atol=1e-14)
@@ -0,0 +1,25 @@
+import numpy as np
+
+from BRAT.trees import LeafIndex
+
+
+def test_leaf_index_lists_in_bag_rows_of_each_leaf(bratd):
+    index = bratd.leaf_index
+    offsets = index.node_offsets
+    for t in range(len(bratd.models)):
+        for leaf in np.unique(bratd.leaf_assignments[:, t]):
+            g = offsets[t] + leaf
+            expected = np.flatnonzero((bratd.leaf_assignments[:, t] == leaf) & bratd.subsample[:, t])
+            np.testing.assert_array_equal(np.sort(index.rows[index.ptr[g]:index.ptr[g + 1]]), expected)
+            assert index.counts[g] == len(expected)
+    assert index.counts.sum() == bratd.subsample.sum()
+    np.testing.assert_array_equal(index.matrix.sum(axis=0).A1, bratd.subsample.sum(axis=1))
+
+
+def test_restricted_index_renumbers_rows(bratd):
+    ref_indices = np.array([5, 17, 42, 99, 150])
+    index = LeafIndex(bratd.leaf_assignments, bratd.subsample, bratd.leaf_index.node_offsets,
+                      ref_indices=ref_indices)
+    full = bratd.leaf_index.matrix[:, ref_indices].toarray()
+    np.testing.assert_array_equal(index.matrix.toarray(), full)
+    np.testing.assert_array_equal(index.counts, full.sum(axis=1))
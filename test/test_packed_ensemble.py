@@ -0,0 +1,29 @@
+import numpy as np
+
+from BRAT.trees import PackedEnsemble
+
+
+def test_apply_and_predict_match_sklearn(bratd, data):
+    X_test = data[2]
+    packed = PackedEnsemble(bratd.models)
+    leaf_ids = packed.apply(X_test)
+    tree_preds = packed.predict_all(X_test)
+    for t, tree in enumerate(bratd.models):
+        np.testing.assert_array_equal(leaf_ids[:, t], tree.get_tree().apply(X_test.astype(np.float32)))
+        np.testing.assert_allclose(tree_preds[:, t], tree.predict(X_test), rtol=0, atol=1e-12)
+
+
+def test_blocked_traversal_matches_single_block(bratd, data):
+    X_train = data[0]
+    full = PackedEnsemble(bratd.models)
+    blocked = PackedEnsemble(bratd.models, max_block_size=len(bratd.models) * 7)
+    np.testing.assert_array_equal(blocked.apply(X_train), full.apply(X_train))
+    np.testing.assert_array_equal(blocked.apply(X_train), bratd.leaf_assignments)
+
+
+def test_predict_matches_per_tree_average(bratd, data):
+    X_test = data[2]
+    lam, q = bratd.learning_rate, 1 - bratd.dropout_rate
+    reference = lam * np.mean([tree.predict(X_test) for tree in bratd.models], axis=0)
+    reference = reference * (1 + lam * q) / lam
+    np.testing.assert_allclose(bratd.predict(X_test), reference, rtol=1e-12)
@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+import pytest
+
+from BRAT.algorithms import BRATD, BRATP
+from BRAT.trees import effective_n_jobs, spawn_seed_sequences
+from BRAT.utils import generate_data
+
+
+def fit_predictions(model_class, data, random_state, **params):
+    X_train, y_train, X_test, _ = data
+    model = model_class(n_estimators=8, max_depth=3, disable_tqdm=True, random_state=random_state, **params)
+    model.fit(X_train, y_train)
+    return model.predict(X_test)
+
+
+def test_fits_are_reproducible_and_leave_global_state_alone(data):
+    for model_class, params in ((BRATD, {"dropout_rate": 0.5}), (BRATP, {"n_trees_per_group": 4})):
+        np.random.seed(0)
+        first = fit_predictions(model_class, data, 11, **params)
+        after_first = np.random.random()
+        np.random.seed(0)
+        second = fit_predictions(model_class, data, np.random.SeedSequence(11), **params)
+        assert np.random.random() == after_first
+        np.testing.assert_array_equal(first, second)
+        assert not np.array_equal(first, fit_predictions(model_class, data, 12, **params))
+
+
+def test_spawned_sequences():
+    children = spawn_seed_sequences(3, 4)
+    assert [c.generate_state(1)[0] for c in children] == [c.generate_state(1)[0] for c in spawn_seed_sequences(3, 4)]
+    rng = np.random.default_rng(3)
+    assert spawn_seed_sequences(rng, 2)[0].spawn_key != spawn_seed_sequences(rng, 2)[0].spawn_key
+
+
+def test_generate_data_with_rng():
+    np.random.seed(0)
+    state = np.random.get_state()[1].copy()
+    first = generate_data(n_train=50, n_test=10, rng=4)
+    np.testing.assert_array_equal(np.random.get_state()[1], state)
+    for a, b in zip(first, generate_data(n_train=50, n_test=10, rng=4)):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_nystrom_landmarks_are_seeded(bratd):
+    first = bratd.unif_nystrom(0.3, random_state=2)[2]
+    np.testing.assert_array_equal(bratd.unif_nystrom(0.3, random_state=2)[2], first)
+
+
+def test_effective_n_jobs_follows_joblib(monkeypatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+    assert effective_n_jobs(None) == 1
+    assert effective_n_jobs(3) == 3
+    assert effective_n_jobs(-1) == 8
+    assert effective_n_jobs(-2) == 7
+    assert effective_n_jobs(-20) == 1
+    with pytest.raises(ValueError):
+        effective_n_jobs(0)
@@ -0,0 +1,35 @@
+import numpy as np
+
+from BRAT.variance_estimation import RandomizedKernelSketch, RegularizedKernelSolver, compute_k_matrix, kernel_operator
+
+
+def test_kernel_operator_matches_full_K(bratd):
+    K = bratd.full_K()
+    V = np.random.default_rng(0).standard_normal((K.shape[0], 3))
+    op = kernel_operator(bratd)
+    np.testing.assert_allclose(op.matmat(V), K @ V, atol=1e-12)
+    np.testing.assert_allclose(op.rmatmat(V), K.T @ V, atol=1e-12)
+
+
+def test_full_rank_sketch_is_exact(bratd, data):
+    K = bratd.full_K()
+    n = K.shape[0]
+    lam, q = bratd.learning_rate, 1 - bratd.dropout_rate
+    k = compute_k_matrix(bratd, bratd.apply_all(data[2])).T
+    sketch = RandomizedKernelSketch(bratd, rank=n, n_oversamples=0, random_state=0)
+    np.testing.assert_allclose(sketch.U @ np.diag(sketch.sigma) @ sketch.V.T, K, atol=1e-10)
+
+    reference = RegularizedKernelSolver(K, lam, q).solve(k)
+    np.testing.assert_allclose(sketch.solve(k, lam, q), reference, rtol=1e-6, atol=1e-9)
+    np.testing.assert_allclose(sketch.rn_norms(k, lam, q), np.linalg.norm(reference, axis=0), rtol=1e-6)
+
+
+def test_low_rank_sketch_is_seeded(bratd, data):
+    X_test = data[2]
+    first = bratd.randomized_sketch(rank=15, random_state=3)
+    norms = bratd.sketch_r_batch(X_test)
+    second = bratd.randomized_sketch(rank=15, random_state=3)
+    assert first is not second
+    np.testing.assert_array_equal(first.U, second.U)
+    np.testing.assert_array_equal(bratd.sketch_r_batch(X_test), norms)
+    assert bratd.sketched_inverse_K_sq is None
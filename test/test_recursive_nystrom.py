@@ -0,0 +1,24 @@
+import numpy as np
+
+from BRAT.variance_estimation import kernel_diagonal, recursive_nystrom
+
+
+def test_kernel_diagonal_matches_full_K(bratd, bratp):
+    for model in (bratd, bratp):
+        np.testing.assert_allclose(kernel_diagonal(model), np.diag(model.full_K()), atol=1e-14)
+
+
+def test_factors_are_kernel_columns(bratd):
+    K = bratd.full_K()
+    C, W, indices = recursive_nystrom(bratd, 0.2, rng=np.random.default_rng(0))
+    assert len(indices) == int(0.2 * K.shape[0])
+    assert len(np.unique(indices)) == len(indices)
+    # column j of C is the kernel row of landmark j
+    np.testing.assert_allclose(C, K[indices].T, atol=1e-14)
+    np.testing.assert_allclose(W, K[np.ix_(indices, indices)].T, atol=1e-14)
+
+
+def test_rec_nystrom_is_seeded(bratd, data):
+    C, W, indices = bratd.rec_nystrom(data[0], 0.2, random_state=5)
+    assert bratd.nys_sub is indices
+    np.testing.assert_array_equal(bratd.rec_nystrom(data[0], 0.2, random_state=5)[2], indices)
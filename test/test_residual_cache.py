@@ -0,0 +1,51 @@
+import numpy as np
+
+from BRAT.algorithms import BRATD
+from BRAT.trees import SubsampledDecisionTreeRegressor
+
+
+def reference_fit(X_train, y_train, n_estimators, learning_rate, dropout_rate, max_depth):
+    # the original BRATD.fit loop, re-predicting every kept tree on X_train each round
+    models = []
+    for _ in range(n_estimators):
+        if models:
+            num_residual_models = int(np.round((1 - dropout_rate) * len(models)))
+            residual_models = [models[i] for i in np.random.permutation(len(models))[:num_residual_models]]
+        else:
+            residual_models = []
+        if residual_models:
+            preds = np.zeros(len(y_train))
+            for model in residual_models:
+                preds += model.predict(X_train)
+            preds /= len(models)
+            preds *= learning_rate
+            residuals = y_train - preds
+        else:
+            residuals = y_train
+        tree = SubsampledDecisionTreeRegressor(subsample_rate=0.8, max_depth=max_depth, min_samples_split=2)
+        tree.fit(X_train, y=residuals)
+        models.append(tree)
+    return models
+
+
+def test_cached_train_predictions(bratd, data):
+    X_train = data[0]
+    for b, tree in enumerate(bratd.models):
+        np.testing.assert_allclose(tree.train_predictions, tree.predict(X_train), rtol=0, atol=1e-12)
+        np.testing.assert_array_equal(bratd.train_predictions[b], tree.train_predictions)
+
+
+def test_fit_matches_per_model_predict_loop(data):
+    X_train, y_train, X_test, _ = data
+    params = dict(n_estimators=15, learning_rate=0.5, dropout_rate=0.4, max_depth=3)
+    np.random.seed(3)
+    model = BRATD(disable_tqdm=True, **params)
+    model.fit(X_train, y_train)
+    np.random.seed(3)
+    reference = reference_fit(X_train, y_train, **params)
+
+    lam, q = params["learning_rate"], 1 - params["dropout_rate"]
+    reference_pred = lam * np.mean([tree.predict(X_test) for tree in reference], axis=0) * (1 + lam * q) / lam
+    np.testing.assert_allclose(model.predict(X_test), reference_pred, rtol=1e-10, atol=1e-10)
+    for tree, reference_tree in zip(model.models, reference):
+        np.testing.assert_array_equal(tree.indices, reference_tree.indices)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from BRAT.algorithms import BRATD, BRATP, KernelInferenceMixin
+
+
+def looped_sketch_r(model, X):
+    return np.array([np.ravel(model.sketch_r(x))[0] for x in X])
+
+
+def test_exact_batch_matches_sketch_r(bratd, data):
+    X_test = data[2]
+    np.testing.assert_allclose(bratd.sketch_r_batch(X_test), looped_sketch_r(bratd, X_test), rtol=1e-10)
+
+
+def test_nystrom_batch_matches_sketch_r(bratd, data):
+    X_test = data[2]
+    bratd.unif_nystrom(0.3, random_state=0)
+    bratd.sketch_K()
+    assert bratd.sketched_inverse_K_sq is not None
+    np.testing.assert_allclose(bratd.sketch_r_batch(X_test), looped_sketch_r(bratd, X_test), rtol=1e-10)
+
+
+def test_randomized_batch_matches_sketch_r(bratd, data):
+    X_test = data[2]
+    bratd.randomized_sketch(rank=20, random_state=0)
+    np.testing.assert_allclose(bratd.sketch_r_batch(X_test), looped_sketch_r(bratd, X_test), rtol=1e-10)
+
+
+def test_kernel_methods_are_shared():
+    for name in ("apply_all", "full_K", "sketch_r", "sketch_r_batch", "get_K_solver", "sketch_r_grid",
+                 "randomized_sketch", "get_inference_state"):
+        assert getattr(BRATD, name) is getattr(KernelInferenceMixin, name)
+        assert getattr(BRATP, name) is getattr(KernelInferenceMixin, name)
+
+
+@pytest.mark.parametrize("nystrom", [False, True])
+def test_row_blocks_match_one_block(bratd, data, nystrom):
+    X_test = data[2]
+    if nystrom:
+        state = bratd.get_inference_state(in_bag=True, Nystrom_subsample=0.3, random_state=0)
+        width = len(state.nys_sub)
+    else:
+        state = bratd.get_inference_state(in_bag=True)
+        width = bratd.X_train.shape[0]
+    # three rows per block
+    max_memory = 3 * width * (8 + 4 + 8 + 8)
+    np.testing.assert_allclose(bratd.sketch_r_batch(X_test, max_memory=max_memory),
+                               bratd.sketch_r_batch(X_test, max_memory=None), rtol=1e-12)
+    np.testing.assert_allclose(state.rn_norm(bratd, X_test, max_memory=max_memory),
+                               state.rn_norm(bratd, X_test, max_memory=None), rtol=1e-12)
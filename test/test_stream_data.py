@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from BRAT.utils import data_function, generate_data, stream_data, write_data_memmap
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_chunks(dtype):
+    chunks = list(stream_data('radial', n_rows=25, chunk_size=10, noise_std=0.5, rng=1, dtype=dtype))
+    assert [len(X) for X, _, _ in chunks] == [10, 10, 5]
+    f = data_function('radial')
+    for X, y, f_X in chunks:
+        assert X.shape[1] == 7
+        assert X.dtype == y.dtype == f_X.dtype == dtype
+        np.testing.assert_allclose(f_X, f(X).astype(dtype), rtol=1e-6)
+    again = list(stream_data('radial', n_rows=25, chunk_size=10, noise_std=0.5, rng=1, dtype=dtype))
+    for a, b in zip(chunks, again):
+        for u, v in zip(a, b):
+            np.testing.assert_array_equal(u, v)
+
+
+def test_stream_leaves_global_state_alone():
+    np.random.seed(0)
+    expected = np.random.random()
+    np.random.seed(0)
+    for _ in stream_data(n_rows=100, chunk_size=30, rng=2):
+        pass
+    assert np.random.random() == expected
+
+
+def test_memmap_holds_the_stream(tmp_path):
+    path = str(tmp_path / "sim")
+    X, y, f_X = write_data_memmap(path, n_rows=1000, chunk_size=300, rng=5, dtype=np.float32)
+    streamed = [np.concatenate(parts) for parts in zip(*stream_data(n_rows=1000, chunk_size=300, rng=5,
+                                                                    dtype=np.float32))]
+    for name, written, expected in zip("Xyf", (X, y, f_X), streamed):
+        loaded = np.load(f"{path}_{name}.npy", mmap_mode="r")
+        assert loaded.dtype == np.float32
+        np.testing.assert_array_equal(loaded, expected)
+        np.testing.assert_array_equal(written, expected)
+
+
+@pytest.mark.parametrize("chunk_size", [1000, 300, 7])
+def test_chunks_concatenate_to_generate_data(chunk_size):
+    streamed = [np.concatenate(parts) for parts in zip(*stream_data(n_rows=1000, chunk_size=chunk_size,
+                                                                    noise_std=0.5, rng=5))]
+    X_train, y_train, _, _, _ = generate_data('friedman1', n_train=1000, n_test=0, noise_std=0.5, rng=5)
+    np.testing.assert_array_equal(streamed[0], X_train)
+    np.testing.assert_array_equal(streamed[1], y_train)
+    np.testing.assert_array_equal(streamed[2], data_function('friedman1')(X_train))
+
+
+def test_smaller_dtype_rounds_the_float64_values():
+    for wide, narrow in zip(stream_data(n_rows=50, chunk_size=20, rng=3),
+                            stream_data(n_rows=50, chunk_size=20, rng=3, dtype=np.float32)):
+        for u, v in zip(wide, narrow):
+            np.testing.assert_array_equal(v, u.astype(np.float32))
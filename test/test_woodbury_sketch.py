@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import BRAT.algorithms
+from BRAT.variance_estimation import woodbury_sketch
+
+
+def woodbury_reference(C, W, lam, q):
+    # original sketch_K: forms the (s, n) sketched inverse through the n x n identity
+    W_inv = np.linalg.pinv(W)
+    CTC = C.T @ C
+    S = (W_inv @ C.T @ (lam * np.eye(C.shape[0]))
+         - lam**2 * (W_inv @ CTC @ np.linalg.inv((1/q) * W + lam * CTC)) @ C.T)
+    return S @ S.T
+
+
+def test_matches_original_formula_on_well_conditioned_factors():
+    rng = np.random.default_rng(0)
+    C = rng.uniform(size=(60, 8))
+    W = C[:8] + np.eye(8)
+    for lam, q in [(1.0, 0.5), (0.3, 0.9), (0.1, 0.2)]:
+        sketch = woodbury_sketch(C, W, lam, q)
+        np.testing.assert_allclose(sketch, sketch.T)
+        np.testing.assert_allclose(sketch, woodbury_reference(C, W, lam, q), rtol=1e-7, atol=1e-10)
+
+
+def test_tree_kernel_landmarks(bratd):
+    C, W, _ = bratd.unif_nystrom(0.3, random_state=0)
+    lam, q = bratd.learning_rate, 1 - bratd.dropout_rate
+    sketch = woodbury_sketch(C, W, lam, q)
+    assert sketch.shape == W.shape
+    assert np.all(np.isfinite(sketch))
+    # positive semi-definite, being S S^T
+    assert np.linalg.eigvalsh(sketch).min() > -1e-8 * np.abs(sketch).max()
+    bratd.sketch_K()
+    np.testing.assert_array_equal(bratd.sketched_inverse_K_sq, sketch)
+
+
+def test_sketch_K_warns_and_falls_back_when_svd_fails(bratd, monkeypatch):
+    def fail(C, W, lam, q):
+        raise np.linalg.LinAlgError("SVD did not converge")
+
+    bratd.unif_nystrom(0.3, random_state=0)
+    monkeypatch.setattr(BRAT.algorithms, "woodbury_sketch", fail)
+    with pytest.warns(RuntimeWarning, match="Falling back to full K"):
+        bratd.sketch_K()
+    assert bratd.sketched_inverse_K_sq is None
+    assert bratd.K is not None